@@ -0,0 +1,111 @@
+"""
+Бенчмарк пути попадания в кэш для /api/ltc-exchanges и /api/ltc-price-history.
+
+Сравнивает прежний путь (json.loads строки из Redis, валидация модели ответа,
+jsonable_encoder и повторная сериализация в JSONResponse) с текущим
+(готовые байты из Redis отдаются в Response как есть).
+Redis не нужен: измеряется только работа процесса после получения значения.
+
+Запуск: python benchmarks/bench_cache_hit.py [--exchanges 300] [--points 2160] [--repeat 2000]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse, Response  # noqa: E402
+
+import main  # noqa: E402
+
+
+def make_exchange_payload(count: int) -> bytes:
+    """Отсортированное представление списка бирж в том виде, в каком оно лежит в Redis"""
+    rng = random.Random(42)
+    records = [
+        main.ExchangeRecord(
+            exchange=f"Exchange {i}",
+            pair="LTC/USDT",
+            price=rng.uniform(70, 90),
+            plus_depth=rng.uniform(1e3, 1e6),
+            minus_depth=rng.uniform(1e3, 1e6),
+            volume=rng.uniform(1e3, 1e8),
+            volume_percentage=rng.uniform(0, 2),
+            last_updated="2025-03-23T12:00:00Z",
+            icon=f"https://coin-images.coingecko.com/markets/images/{i}/small/icon.png",
+        )
+        for i in range(count)
+    ]
+    views = main.materialize_sort_views(records, "2025-03-23T12:00:00Z", 1)
+    return views[main.exchanges_sort_cache_key(1, None, True)]
+
+
+def make_history_payload(points: int) -> bytes:
+    rng = random.Random(7)
+    return main.orjson.dumps({
+        "status": "success",
+        "data": [{"date": f"3/{1 + i % 28}", "price": round(rng.uniform(70, 90), 2)} for i in range(points)],
+        "currency": "USD",
+        "period": "90 дней",
+    })
+
+
+def exchanges_hit_before(cached: bytes) -> bytes:
+    # Прежний путь: redis-py с decode_responses=True отдавал str
+    data = json.loads(cached.decode())
+    validated = main.ExchangeResponse(**data)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def history_hit_before(cached: bytes) -> bytes:
+    data = json.loads(cached.decode())
+    return JSONResponse(jsonable_encoder(data)).body
+
+
+def hit_after(cached: bytes) -> bytes:
+    return Response(content=cached, media_type="application/json").body
+
+
+def measure(func, payload: bytes, repeat: int) -> dict:
+    for _ in range(min(50, repeat)):
+        func(payload)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(payload)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "p50_us": statistics.median(timings) * 1e6,
+        "p99_us": timings[int(len(timings) * 0.99) - 1] * 1e6,
+        "mean_us": statistics.fmean(timings) * 1e6,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exchanges", type=int, default=300, help="число бирж в ответе")
+    parser.add_argument("--points", type=int, default=2160, help="число точек истории цены (90 дней по часам)")
+    parser.add_argument("--repeat", type=int, default=2000, help="число повторов каждого замера")
+    args = parser.parse_args()
+
+    cases = [
+        ("ltc-exchanges", make_exchange_payload(args.exchanges), exchanges_hit_before),
+        ("ltc-price-history", make_history_payload(args.points), history_hit_before),
+    ]
+    print(f"{'путь':<20}{'вариант':<10}{'p50, мкс':>12}{'p99, мкс':>12}{'среднее, мкс':>15}")
+    for name, payload, before in cases:
+        results = {"before": measure(before, payload, args.repeat), "after": measure(hit_after, payload, args.repeat)}
+        for variant, stats in results.items():
+            print(f"{name:<20}{variant:<10}{stats['p50_us']:>12.1f}{stats['p99_us']:>12.1f}{stats['mean_us']:>15.1f}")
+        speedup = results["before"]["p50_us"] / results["after"]["p50_us"]
+        print(f"{name:<20}{'ускорение':<10}{speedup:>11.0f}x  ({len(payload) / 1024:.0f} КБ)")
+
+
+if __name__ == "__main__":
+    main_cli()
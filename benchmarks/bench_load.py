@@ -0,0 +1,192 @@
+"""
+Нагрузочный тест API на локальной заглушке внешних API.
+
+Запускает fake_upstream.py и приложение (run_app.py) в отдельных процессах,
+дожидается первого снапшота бирж и истории цены, затем по очереди нагружает сценарии
+и печатает пропускную способность и p50/p95/p99 времени ответа:
+
+    cache-hit       /api/ltc-exchanges - готовые байты из Redis
+    cache-miss      /api/ltc-price-history?days=90&max_points=N - каждый раз новый ключ,
+                    ответ собирается из хранилища истории
+    sort-variant    /api/ltc-exchanges с перебором sort_by, descending, raw и top
+    depth           /api/ltc-depth/binance с оценкой стоимости исполнения
+    history         /api/ltc-price-history со стандартными периодами
+
+Результаты сохраняются в benchmarks/results/load-*.json; --compare печатает
+изменение относительно сохраненного запуска.
+
+Запуск: python benchmarks/bench_load.py [--fake-redis] [--concurrency 32] [--duration 10]
+                                        [--latency-ms 80] [--jitter-ms 30] [--error-rate 0]
+                                        [--scenarios cache-hit,depth] [--compare results/load-....json]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator
+
+import httpx
+
+from bench_utils import BENCHMARKS_DIR, load_results, print_comparison, save_results, summarize
+
+# Внешние API приложения: все направляются на заглушку, неизвестные пути отвечают 404
+UPSTREAM_NAMES = ("coingecko", "binance", "coinmarketcap", "okx", "bybit", "kraken",
+                  "kucoin", "gate", "htx", "mexc")
+SORT_CRITERIA = ("id", "price", "volume", "plus_depth", "minus_depth", "exchange", "volume_percentage")
+HISTORY_DAYS = (1, 7, 30, 90, 365)
+STARTUP_TIMEOUT = 120.0
+
+
+def cache_hit() -> Iterator[str]:
+    return itertools.repeat("/api/ltc-exchanges")
+
+
+def cache_miss() -> Iterator[str]:
+    # Каждое значение max_points - отдельный ключ кэша
+    return (f"/api/ltc-price-history?days=90&max_points={n}" for n in itertools.count(3))
+
+
+def sort_variant() -> Iterator[str]:
+    variants = [
+        f"/api/ltc-exchanges?sort_by={sort_by}&descending={str(descending).lower()}&raw={str(raw).lower()}"
+        + (f"&top={top}" if top else "")
+        for sort_by, descending, raw, top in itertools.product(SORT_CRITERIA, (True, False), (False, True), (None, 10))
+    ]
+    return itertools.cycle(variants)
+
+
+def depth() -> Iterator[str]:
+    return itertools.repeat("/api/ltc-depth/binance?notional=10000")
+
+
+def history() -> Iterator[str]:
+    return itertools.cycle(f"/api/ltc-price-history?days={days}" for days in HISTORY_DAYS)
+
+
+SCENARIOS: Dict[str, Callable[[], Iterator[str]]] = {
+    "cache-hit": cache_hit,
+    "cache-miss": cache_miss,
+    "sort-variant": sort_variant,
+    "depth": depth,
+    "history": history,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client: httpx.AsyncClient, path: str, deadline: float):
+    while True:
+        try:
+            response = await client.get(path)
+            if response.status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{path} не ответил 200 за {STARTUP_TIMEOUT:.0f} с")
+        await asyncio.sleep(0.5)
+
+
+async def run_scenario(client: httpx.AsyncClient, urls: Iterator[str], concurrency: int, duration: float) -> dict:
+    """Держит concurrency запросов в работе duration секунд; ответы не 2xx/304 считаются ошибками"""
+    timings = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            url = next(urls)
+            started = time.perf_counter()
+            try:
+                response = await client.get(url)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            timings.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {"requests": len(timings), "errors": errors, "rps": len(timings) / elapsed, **summarize(timings)}
+
+
+async def run(args, app_url: str) -> Dict[str, dict]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=30) as client:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        await wait_ready(client, "/api/ltc-exchanges", deadline)
+        await wait_ready(client, "/api/ltc-price-history?days=365", deadline)
+        results = {}
+        for name in args.scenarios:
+            urls = SCENARIOS[name]()
+            # Прогрев: соединения, первые промахи и материализация представлений
+            await run_scenario(client, urls, args.concurrency, min(1.0, args.duration))
+            results[name] = stats = await run_scenario(client, urls, args.concurrency, args.duration)
+            print(f"{name:<14}{stats['requests']:>9}{stats['errors']:>8}{stats['rps']:>10.0f}"
+                  f"{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['p99']:>9.2f}", flush=True)
+        return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fake-redis", action="store_true", help="fakeredis в процессе приложения вместо сервера Redis")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных запросов")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность каждого сценария, секунды")
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="задержка заглушки внешних API")
+    parser.add_argument("--jitter-ms", type=float, default=30.0, help="разброс задержки заглушки, ±")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ошибок заглушки (0..1)")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda value: [name for name in value.split(",") if name],
+                        help=f"сценарии через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument("--compare", help="файл прошлого запуска для сравнения")
+    parser.add_argument("--no-save", action="store_true", help="не сохранять результаты")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    upstream_port, app_port = free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, LOG_LEVEL="WARNING",
+                   PRICE_HISTORY_DB_PATH=os.path.join(data_dir, "history.sqlite3"))
+        env.update({f"{name.upper()}_BASE_URL": f"{upstream_url}/{name}" for name in UPSTREAM_NAMES})
+        processes = [
+            subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, "fake_upstream.py"),
+                              "--port", str(upstream_port), "--latency-ms", str(args.latency_ms),
+                              "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate),
+                              "--error-status", str(args.error_status)]),
+            subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, "run_app.py"), "--port", str(app_port)]
+                             + (["--fake-redis"] if args.fake_redis else []), env=env),
+        ]
+        try:
+            print(f"{'сценарий':<14}{'запросов':>9}{'ошибок':>8}{'в сек':>10}"
+                  f"{'p50, мс':>9}{'p95, мс':>9}{'p99, мс':>9}")
+            results = asyncio.run(run(args, f"http://127.0.0.1:{app_port}"))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait(timeout=10)
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("compare", "no_save")}
+    if not args.no_save:
+        print(f"\nРезультаты сохранены: {save_results('load', settings, results)}")
+    if args.compare:
+        print_comparison(load_results(args.compare), results, ["rps", "p50", "p95", "p99"])
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,135 @@
+"""
+Микробенчмарки функций преобразования и сортировки без сети и Redis.
+
+Данные берутся из тех же фикстур, что отдает fake_upstream.py (записанных или сгенерированных):
+тикеры CoinGecko, книга ордеров Binance и год цены по 5 минут.
+
+Результаты сохраняются в benchmarks/results/micro-*.json; --compare печатает
+изменение относительно сохраненного запуска. Названия случаев не зависят от данных,
+размер входа (записей, уровней, точек) сохраняется отдельным полем size, поэтому
+запуски на фикстурах разного размера сравниваются по тем же случаям.
+
+Запуск: python benchmarks/bench_micro.py [--repeat 200] [--filter sort] [--compare results/micro-....json]
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+import fake_upstream  # noqa: E402
+from bench_utils import load_results, print_comparison, save_results, summarize  # noqa: E402
+
+
+def exchange_records(tickers: dict) -> List[main.ExchangeRecord]:
+    """Записи бирж так же, как их строит fetch_exchange_data_from_api"""
+    return [
+        main.ExchangeRecord(
+            exchange=ticker["market"]["name"],
+            pair="LTC/USDT",
+            price=float(ticker["last"]),
+            plus_depth=ticker["converted_volume"].get("usd", 0) * 0.06,
+            minus_depth=ticker["converted_volume"].get("usd", 0) * 0.05,
+            volume=ticker["converted_volume"].get("usd", 0),
+            volume_percentage=ticker.get("bid_ask_spread_percentage", 1.0),
+            last_updated="2025-03-23T12:00:00Z",
+            icon=f"https://coin-images.coingecko.com/markets/images/{i}/small/icon.png",
+        )
+        for i, ticker in enumerate(tickers["tickers"]) if ticker["target"] == "USDT"
+    ]
+
+
+def build_cases() -> Dict[str, Tuple[Callable[[], object], int]]:
+    """Случаи: название -> (функция, размер входа)"""
+    fake_upstream.load_fixtures(seed=42)
+    fixtures = fake_upstream.fixtures
+    records = exchange_records(fixtures["coingecko_tickers"])
+    stored = [record.to_dict() for record in records]
+    changed = [record.copy() for record in records]
+    for record in changed[::5]:
+        record.price *= 1.001
+    old_rows, new_rows = main.exchange_rows(records), main.exchange_rows(changed)
+    body = main.orjson.dumps({"status": "success", "data": main.render_exchanges(records, False)})
+
+    depth = fixtures["binance_depth"]
+    bids, asks = main.parse_binance_book(depth)
+    book = main.OrderBook("binance", bids, asks)
+    bands = main.parse_depth_bands("0.5,1,2,5")
+
+    series = fake_upstream.price_series
+    points = [(int(ts), price) for ts, price in series.tolist()]
+    now_ms = points[-1][0]
+    points_90 = [point for point in points if point[0] >= now_ms - 90 * fake_upstream.DAY_MS]
+    timestamps, prices = series[:, 0].copy(), series[:, 1].copy()
+
+    levels = len(bids) + len(asks)
+    cases = {
+        "records.from_dict": (lambda: [main.ExchangeRecord.from_dict(item) for item in stored], len(stored)),
+        "render_exchanges.display": (lambda: main.render_exchanges(records, False), len(records)),
+        "render_exchanges.raw": (lambda: main.render_exchanges(records, True), len(records)),
+        "encode_payload": (lambda: main.encode_payload(body, 0.0, 0.0), len(body)),
+        "exchange_rows+diff": (lambda: main.diff_exchange_rows(old_rows, main.exchange_rows(changed)), len(records)),
+        "diff_exchange_rows": (lambda: main.diff_exchange_rows(old_rows, new_rows), len(records)),
+        "materialize_sort_views": (lambda: main.materialize_sort_views(records, "2025-03-23T12:00:00Z", 1),
+                                   len(records)),
+        "order_book.init": (lambda: main.OrderBook("binance", bids, asks), levels),
+        "order_book.depth_bands": (lambda: book.depth_bands(bands), levels),
+        "order_book.fill": (lambda: book.fill(100_000.0, "buy"), levels),
+        "render_price_history.365d": (lambda: main.render_price_history(points, 365, False, None, False),
+                                      len(points)),
+        "render_price_history.90d": (lambda: main.render_price_history(points_90, 90, False, None, False),
+                                     len(points_90)),
+        "render_price_history.90d.lttb500": (lambda: main.render_price_history(points_90, 90, False, 500, False),
+                                             len(points_90)),
+        "lttb.1000": (lambda: main.lttb(timestamps, prices, 1000), len(timestamps)),
+        "resample_ohlc.1h": (lambda: main.resample_ohlc(timestamps, prices, 3_600_000), len(timestamps)),
+    }
+    for criterion in main.SortCriterion:
+        cases[f"sort_order.{criterion.value}"] = (lambda c=criterion: main.sort_order(records, c, True), len(records))
+    cases["select_order.volume.top10"] = (lambda: main.select_order(records, main.SortCriterion.VOLUME, True, 10),
+                                          len(records))
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict:
+    for _ in range(min(20, repeat)):
+        func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    # В микросекундах
+    return summarize(timings, scale=1e6)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="число повторов каждого замера")
+    parser.add_argument("--filter", default="", help="только случаи, в названии которых есть эта строка")
+    parser.add_argument("--compare", help="файл прошлого запуска для сравнения")
+    parser.add_argument("--no-save", action="store_true", help="не сохранять результаты")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'случай':<42}{'размер':>9}{'p50, мкс':>12}{'p95, мкс':>12}{'p99, мкс':>12}")
+    for name, (func, size) in build_cases().items():
+        if args.filter not in name:
+            continue
+        results[name] = stats = {**measure(func, args.repeat), "size": size}
+        print(f"{name:<42}{size:>9}{stats['p50']:>12.1f}{stats['p95']:>12.1f}{stats['p99']:>12.1f}", flush=True)
+
+    if not args.no_save:
+        settings = {"repeat": args.repeat, "filter": args.filter, "numpy": np.__version__}
+        print(f"\nРезультаты сохранены: {save_results('micro', settings, results)}")
+    if args.compare:
+        print_comparison(load_results(args.compare), results, ["p50", "p95", "p99"])
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,93 @@
+"""
+Общие функции бенчмарков: перцентили, сохранение результатов и сравнение с прошлым запуском.
+
+Результаты сохраняются в benchmarks/results/<вид>-<время>.json; файл прошлого
+запуска передается в --compare, и для каждой метрики печатается изменение в процентах.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль q (0..100) по отсортированному списку, ближайший ранг"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(timings: List[float], scale: float = 1e3) -> Dict[str, float]:
+    """p50/p95/p99, среднее и максимум; по умолчанию секунды переводятся в миллисекунды"""
+    values = sorted(t * scale for t in timings)
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values) if values else float("nan"),
+        "max": values[-1] if values else float("nan"),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(kind: str, settings: dict, results: Dict[str, dict]) -> str:
+    """Сохраняет результаты вместе с ревизией и окружением; возвращает путь к файлу"""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    path = os.path.join(RESULTS_DIR, f"{kind}-{now.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "kind": kind,
+            "createdAt": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": settings,
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def load_results(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_comparison(baseline: dict, results: Dict[str, dict], metrics: List[str],
+                     higher_is_better: tuple = ("rps",)):
+    """
+    Печатает изменение метрик относительно сохраненного запуска.
+    Ухудшение помечается "!": рост времени или падение пропускной способности больше чем на 10%.
+    Если у случая изменился размер входа (поле size), это печатается перед его метриками.
+    """
+    print(f"\nСравнение с {baseline.get('revision') or '?'} от {baseline.get('createdAt')}")
+    print(f"{'случай':<34}{'метрика':<8}{'было':>12}{'стало':>12}{'изменение':>12}")
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        if previous.get("size") != current.get("size"):
+            print(f"{name:<34}{'size':<8}{previous.get('size')!s:>12}{current.get('size')!s:>12}{'другой вход':>12}")
+        for metric in metrics:
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = change < -10 if metric in higher_is_better else change > 10
+            print(f"{name:<34}{metric:<8}{old:>12.3f}{new:>12.3f}{change:>+11.1f}%{' !' if worse else ''}")
@@ -0,0 +1,252 @@
+"""
+Локальная заглушка внешних API для нагрузочных тестов: отдает записанные (или
+сгенерированные) ответы CoinGecko и Binance с настраиваемой задержкой, разбросом и ошибками.
+
+Маршруты повторяют пути API под префиксом внешнего API, поэтому приложение
+направляется на заглушку переменными окружения:
+    COINGECKO_BASE_URL=http://127.0.0.1:9100/coingecko
+    BINANCE_BASE_URL=http://127.0.0.1:9100/binance
+Остальные внешние API (OKX, Bybit, ...) можно направить туда же: заглушка ответит 404,
+и глубина для этих бирж будет оценена по объему, как при их недоступности.
+
+Ответы берутся из benchmarks/fixtures/*.json, если они записаны (--record),
+иначе генерируются детерминированно (--seed). Время в истории цены сдвигается
+так, чтобы последняя точка совпадала с моментом запуска.
+
+Запуск: python benchmarks/fake_upstream.py [--port 9100] [--latency-ms 80] [--jitter-ms 30]
+                                           [--error-rate 0.01] [--error-status 429]
+        python benchmarks/fake_upstream.py --record
+Настройки можно менять на ходу: POST /_config {"latency_ms": 200, "error_rate": 0.1}
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, List
+
+import numpy as np
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, Response
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Записываемые ответы: имя фикстуры -> (адрес реального API, путь, параметры)
+FIXTURE_SOURCES = {
+    "coingecko_tickers": ("https://api.coingecko.com/api/v3", "/coins/litecoin/tickers", {}),
+    "coingecko_exchanges": ("https://api.coingecko.com/api/v3", "/exchanges", {}),
+    "coingecko_market_chart_365": ("https://api.coingecko.com/api/v3", "/coins/litecoin/market_chart",
+                                   {"vs_currency": "usd", "days": 365}),
+    "coingecko_market_chart_90": ("https://api.coingecko.com/api/v3", "/coins/litecoin/market_chart",
+                                  {"vs_currency": "usd", "days": 90}),
+    "coingecko_market_chart_1": ("https://api.coingecko.com/api/v3", "/coins/litecoin/market_chart",
+                                 {"vs_currency": "usd", "days": 1}),
+    "binance_ticker_price": ("https://api.binance.com/api/v3", "/ticker/price", {"symbol": "LTCUSDT"}),
+    "binance_depth": ("https://api.binance.com/api/v3", "/depth", {"symbol": "LTCUSDT", "limit": 1000}),
+}
+
+# Идентификаторы CoinGecko бирж с коннекторами книги ордеров (см. ORDER_BOOK_CONNECTORS)
+CONNECTOR_MARKETS = {
+    "binance": "Binance", "okex": "OKX", "bybit_spot": "Bybit", "kraken": "Kraken",
+    "kucoin": "KuCoin", "gate": "Gate", "huobi": "HTX", "mxc": "MEXC",
+}
+
+DAY_MS = 86_400_000
+FIVE_MINUTES_MS = 300_000
+HOUR_MS = 3_600_000
+
+settings = {
+    "latency_ms": 0.0,      # средняя задержка ответа
+    "jitter_ms": 0.0,       # равномерный разброс задержки, ±
+    "error_rate": 0.0,      # доля ответов с ошибкой
+    "error_status": 429,    # код ошибки; для 429 добавляется Retry-After
+    "retry_after": 1,
+}
+fixtures: Dict[str, object] = {}
+price_series = np.empty((0, 2))
+
+
+def record_fixtures():
+    """Записывает ответы реальных API в benchmarks/fixtures"""
+    import httpx
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    with httpx.Client(timeout=30) as client:
+        for name, (base_url, path, params) in FIXTURE_SOURCES.items():
+            response = client.get(base_url + path, params=params)
+            response.raise_for_status()
+            with open(os.path.join(FIXTURES_DIR, f"{name}.json"), "wb") as f:
+                f.write(response.content)
+            print(f"{name}: {len(response.content) / 1024:.0f} КБ")
+            # Публичный API CoinGecko ограничивает частоту запросов
+            time.sleep(3)
+
+
+def generate_fixtures(seed: int) -> Dict[str, object]:
+    """Правдоподобные ответы без обращения к сети: ~300 тикеров, год цены по 5 минут, книга на 1000 уровней"""
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000) // FIVE_MINUTES_MS * FIVE_MINUTES_MS
+    steps = 365 * DAY_MS // FIVE_MINUTES_MS
+    walk = np.random.default_rng(seed).normal(0, 0.001, steps).cumsum()
+    prices = 85.0 * np.exp(walk - walk[-1])
+    chart = np.column_stack((now_ms - np.arange(steps)[::-1] * FIVE_MINUTES_MS, prices))
+    last_price = round(float(prices[-1]), 2)
+
+    markets = dict(CONNECTOR_MARKETS)
+    markets.update({f"exchange_{i}": f"Exchange {i}" for i in range(250)})
+    tickers = []
+    for identifier, name in markets.items():
+        for target in ("USDT", "BTC", "USD") if rng.random() < 0.3 else ("USDT",):
+            tickers.append({
+                "base": "LTC",
+                "target": target,
+                "market": {"name": name, "identifier": identifier, "has_trading_incentive": False},
+                "last": round(last_price * rng.uniform(0.995, 1.005), 4),
+                "converted_volume": {"usd": round(rng.lognormvariate(12, 2), 2)},
+                "bid_ask_spread_percentage": round(rng.uniform(0.01, 1.5), 4),
+            })
+    exchanges = [
+        {"id": identifier, "name": name,
+         "image": f"https://coin-images.coingecko.com/markets/images/{i}/small/{identifier}.png"}
+        for i, (identifier, name) in enumerate(markets.items()) if rng.random() < 0.9
+    ]
+    bids = [[f"{last_price - 0.01 * (i + 1):.2f}", f"{rng.lognormvariate(2, 1):.3f}"] for i in range(1000)]
+    asks = [[f"{last_price + 0.01 * (i + 1):.2f}", f"{rng.lognormvariate(2, 1):.3f}"] for i in range(1000)]
+    return {
+        "coingecko_tickers": {"name": "Litecoin", "tickers": tickers},
+        "coingecko_exchanges": exchanges,
+        "synthetic_market_chart": {"prices": chart.tolist()},
+        "binance_ticker_price": {"symbol": "LTCUSDT", "price": f"{last_price:.2f}"},
+        "binance_depth": {"lastUpdateId": 1, "bids": bids, "asks": asks},
+    }
+
+
+def load_fixtures(seed: int):
+    """Загружает записанные фикстуры (недостающие генерирует) и собирает общий ряд цены"""
+    global price_series
+    fixtures.update(generate_fixtures(seed))
+    recorded = []
+    if os.path.isdir(FIXTURES_DIR):
+        for name in FIXTURE_SOURCES:
+            path = os.path.join(FIXTURES_DIR, f"{name}.json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    fixtures[name] = json.load(f)
+                recorded.append(name)
+    # Записанные периоды объединяются: подробные точки за последние сутки, часовые за 90 дней и т.д.
+    charts = [name for name in recorded if name.startswith("coingecko_market_chart")] or ["synthetic_market_chart"]
+    series = np.concatenate([np.asarray(fixtures[name]["prices"], dtype=float).reshape(-1, 2) for name in charts])
+    series = series[np.argsort(series[:, 0], kind="stable")]
+    # Записанные ответы устаревают: сдвигаем время так, чтобы последняя точка была "сейчас"
+    series[:, 0] += int(time.time() * 1000) - series[-1, 0]
+    price_series = series
+    return recorded
+
+
+def chart_points(from_ms: float, to_ms: float) -> List[list]:
+    """Точки за интервал с шагом, как у CoinGecko: до суток - 5 минут, до 90 дней - час, дальше - сутки"""
+    span = to_ms - from_ms
+    step = FIVE_MINUTES_MS if span <= DAY_MS else HOUR_MS if span <= 90 * DAY_MS else DAY_MS
+    selected = price_series[(price_series[:, 0] >= from_ms) & (price_series[:, 0] <= to_ms)]
+    if len(selected) == 0:
+        return []
+    buckets = (selected[:, 0] // step).astype(np.int64)
+    # Последняя точка каждого шага
+    last = np.flatnonzero(np.append(buckets[1:] != buckets[:-1], True))
+    return selected[last].tolist()
+
+
+app = FastAPI(title="Fake upstream")
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    if request.url.path.startswith("/_"):
+        return await call_next(request)
+    delay = settings["latency_ms"] + random.uniform(-settings["jitter_ms"], settings["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if random.random() < settings["error_rate"]:
+        headers = {"Retry-After": str(settings["retry_after"])} if settings["error_status"] == 429 else {}
+        return JSONResponse({"error": "injected"}, status_code=settings["error_status"], headers=headers)
+    return await call_next(request)
+
+
+def fixture_response(name: str) -> Response:
+    return Response(json.dumps(fixtures[name]), media_type="application/json")
+
+
+@app.get("/coingecko/coins/litecoin/tickers")
+async def tickers():
+    return fixture_response("coingecko_tickers")
+
+
+@app.get("/coingecko/exchanges")
+async def exchanges():
+    return fixture_response("coingecko_exchanges")
+
+
+@app.get("/coingecko/coins/litecoin/market_chart")
+async def market_chart(days: float = 1):
+    now_ms = price_series[-1, 0]
+    return {"prices": chart_points(now_ms - days * DAY_MS, now_ms), "market_caps": [], "total_volumes": []}
+
+
+@app.get("/coingecko/coins/litecoin/market_chart/range")
+async def market_chart_range(from_: float = Query(..., alias="from"), to: float = Query(...)):
+    return {"prices": chart_points(from_ * 1000, to * 1000), "market_caps": [], "total_volumes": []}
+
+
+@app.get("/binance/ticker/price")
+async def ticker_price():
+    return fixture_response("binance_ticker_price")
+
+
+@app.get("/binance/depth")
+async def depth(limit: int = 100):
+    book = fixtures["binance_depth"]
+    return {"lastUpdateId": book["lastUpdateId"], "bids": book["bids"][:limit], "asks": book["asks"][:limit]}
+
+
+@app.get("/_config")
+async def get_config():
+    return settings
+
+
+@app.post("/_config")
+async def update_config(request: Request):
+    changes = await request.json()
+    unknown = set(changes) - set(settings)
+    if unknown:
+        return JSONResponse({"error": f"неизвестные настройки: {sorted(unknown)}"}, status_code=400)
+    settings.update(changes)
+    return settings
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="средняя задержка ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="разброс задержки, ±")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой (0..1)")
+    parser.add_argument("--error-status", type=int, default=429, help="код ответа с ошибкой")
+    parser.add_argument("--seed", type=int, default=42, help="зерно генерации фикстур")
+    parser.add_argument("--record", action="store_true", help="записать ответы реальных API и выйти")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures()
+        return
+    settings.update(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                    error_rate=args.error_rate, error_status=args.error_status)
+    recorded = load_fixtures(args.seed)
+    print(f"Фикстуры: записанные {recorded or 'нет'}, остальные сгенерированы", flush=True)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,55 @@
+"""
+Запуск приложения для нагрузочного теста: с настоящим Redis (REDIS_HOST/REDIS_PORT)
+или, с --fake-redis, с fakeredis в памяти процесса (pip install "fakeredis[lua]":
+снятие блокировок и бюджет запросов к внешним API выполняются скриптами Lua через EVALSHA).
+Адреса внешних API задаются переменными <UPSTREAM>_BASE_URL (см. fake_upstream.py).
+
+Запуск: python benchmarks/run_app.py [--port 8000] [--fake-redis]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+
+def use_fake_redis():
+    """
+    Подменяет клиент Redis приложения на fakeredis с тем же замером команд.
+    Нужен fakeredis с поддержкой Lua (pip install "fakeredis[lua]"): без lupa
+    EVALSHA в снятии блокировок и бюджете запросов завершается ошибкой.
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit('Для --fake-redis нужен пакет fakeredis: pip install "fakeredis[lua]"')
+    try:
+        import lupa  # noqa: F401 - исполняет скрипты Lua в fakeredis
+    except ImportError:
+        sys.exit('Для --fake-redis нужна поддержка Lua в fakeredis: pip install "fakeredis[lua]"')
+    pool = main.redis.asyncio.ConnectionPool(
+        connection_class=fakeredis.FakeAsyncConnection,
+        server=fakeredis.FakeServer(),
+        decode_responses=False,
+    )
+    main.redis_client = main.TimedRedis(connection_pool=pool)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fake-redis", action="store_true", help="Redis в памяти процесса вместо сервера")
+    args = parser.parse_args()
+
+    if args.fake_redis:
+        use_fake_redis()
+
+    import uvicorn
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main_cli()
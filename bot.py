@@ -428,12 +428,12 @@ async def delete_exchange_confirm(callback: types.CallbackQuery) -> None:
 
 # Функция для получения текущей цены LTC с Binance
 async def get_binance_ltc_price() -> float:
-    """Получение текущей цены LTC с Binance"""
+    """Получение текущей цены LTC с Binance через оракул цены API-сервера"""
     try:
-        response = requests.get('https://api.binance.com/api/v3/ticker/price', params={'symbol': 'LTCUSDT'})
+        response = requests.get(f"{API_BASE_URL}/api/ltc-price/binance")
         if response.status_code == 200:
             data = response.json()
-            return float(data['price'])
+            return float(data['data']['price'])
         else:
             return 0
     except Exception as e:
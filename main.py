@@ -1,20 +1,322 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Union
-import requests
+from typing import List, Optional, Dict, Union, Set, Callable, Awaitable, Any, AsyncIterator, Iterable
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from collections import deque
+import httpx
+import gzip
+import brotli
+import hashlib
+import hmac
 import math
-import json
+import os
+import orjson
 import redis
+import redis.asyncio
 import time
-from datetime import datetime
+import random
+import heapq
+import bisect
+import sqlite3
+import sys
+import threading
+import numpy as np
+import asyncio
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from enum import Enum
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Логирование: по умолчанию только предупреждения и ошибки.
+# LOG_LEVEL=DEBUG включает отладочные сообщения; сообщения горячего пути (на каждый
+# запрос или тикер) и тогда выводятся выборочно, с вероятностью LOG_SAMPLE_RATE
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("ltc_api")
+logger.setLevel(LOG_LEVEL)
+
+def log_sampled(level: int, message: str, *args):
+    """
+    Сообщение горячего пути: уровень проверяется до форматирования,
+    а выводится только доля LOG_SAMPLE_RATE сообщений
+    """
+    if logger.isEnabledFor(level) and random.random() < LOG_SAMPLE_RATE:
+        logger.log(level, message, *args)
+
+# Метрики Prometheus (/metrics)
+REQUEST_LATENCY = Histogram(
+    "ltc_api_request_duration_seconds", "Время обработки запроса по маршруту",
+    ["route", "method", "status"],
+)
+CACHE_REQUESTS = Counter(
+    "ltc_api_cache_requests_total", "Обращения к кэшу по семействам ключей: hit, miss, stale",
+    ["family", "result"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "ltc_api_upstream_request_duration_seconds", "Время запроса к внешнему API (до заголовков ответа)",
+    ["upstream"],
+)
+UPSTREAM_ERRORS = Counter(
+    "ltc_api_upstream_errors_total", "Ошибки запросов к внешним API: timeout, connection или http_<код>",
+    ["upstream", "kind"],
+)
+REDIS_LATENCY = Histogram(
+    "ltc_api_redis_command_duration_seconds", "Время команды или пайплайна Redis",
+    ["command"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+RATE_LIMIT_TOKENS = Gauge(
+    "ltc_api_rate_limit_tokens", "Оценка остатка бюджета запросов к внешнему API",
+    ["upstream"],
+)
+RATE_LIMIT_BLOCKED = Gauge(
+    "ltc_api_rate_limit_blocked_seconds", "Сколько еще действует пауза по Retry-After",
+    ["upstream"],
+)
+RATE_LIMIT_WAIT = Histogram(
+    "ltc_api_rate_limit_wait_seconds", "Ожидание бюджета запросов по приоритетам",
+    ["upstream", "priority"],
+)
+RATE_LIMIT_DENIED = Counter(
+    "ltc_api_rate_limit_denied_total", "Вызовы, не дождавшиеся бюджета запросов",
+    ["upstream", "priority"],
+)
+REFRESH_INTERVAL = Gauge(
+    "ltc_api_refresh_interval_seconds", "Текущий интервал фонового обновления с учетом бюджета запросов",
+    ["job"],
+)
+SNAPSHOT_AGE = Gauge(
+    "ltc_api_snapshot_age_seconds", "Возраст данных: снапшот бирж, история цены, локальные книги ордеров",
+    ["snapshot"],
+)
+
+# Медленные запросы: если запрос обрабатывался дольше SLOW_REQUEST_THRESHOLD секунд,
+# его разбивка по этапам (Redis, внешний API, преобразование, сортировка, сериализация)
+# сохраняется в кольцевой буфер (/api/admin/slow-requests)
+SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD", "0.5"))
+SLOW_REQUEST_RING_SIZE = 200
+slow_requests: deque = deque(maxlen=SLOW_REQUEST_RING_SIZE)
+# Этапы текущего запроса: этап -> [количество, суммарное время]; None вне запроса
+request_stages: ContextVar[Optional[Dict[str, list]]] = ContextVar("request_stages", default=None)
+
+def add_stage_time(stage: str, seconds: float):
+    """
+    Добавляет время этапа к текущему запросу (вне запроса ничего не делает).
+    Контекст наследуется задачами и asyncio.to_thread, поэтому учитывается
+    и работа, запущенная запросом в других задачах и потоках.
+    """
+    stages = request_stages.get()
+    if stages is None:
+        return
+    entry = stages.get(stage)
+    if entry is None:
+        stages[stage] = [1, seconds]
+    else:
+        entry[0] += 1
+        entry[1] += seconds
+
+@contextmanager
+def request_stage(stage: str):
+    """
+    Замеряет блок кода как этап текущего запроса
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(stage, time.perf_counter() - started)
+
+# Настройки пулов соединений к внешним API.
+# Для каждого хоста свой клиент: свой лимит соединений и keep-alive пул.
+# rate_limit - бюджет запросов (запросов, за секунд), общий для всех процессов (см. acquire_upstream_budget);
+# для бирж с книгами ордеров не задан: их лимиты намного выше частоты наших запросов
+UPSTREAMS = {
+    "coingecko": {
+        "base_url": "https://api.coingecko.com/api/v3",
+        "max_connections": 10,
+        "max_keepalive_connections": 5,
+        "http2": True,
+        "rate_limit": (20, 60),
+    },
+    "binance": {
+        "base_url": "https://api.binance.com/api/v3",
+        "max_connections": 10,
+        "max_keepalive_connections": 5,
+        "http2": True,
+        "rate_limit": (1000, 60),
+    },
+    "coinmarketcap": {
+        "base_url": "https://pro-api.coinmarketcap.com/v1",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+        "rate_limit": (30, 60),
+    },
+    # Биржи, с которых берутся книги ордеров (см. ORDER_BOOK_CONNECTORS)
+    "okx": {
+        "base_url": "https://www.okx.com/api/v5",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+    },
+    "bybit": {
+        "base_url": "https://api.bybit.com/v5",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+    },
+    "kraken": {
+        "base_url": "https://api.kraken.com/0/public",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+    },
+    "kucoin": {
+        "base_url": "https://api.kucoin.com/api/v1",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+    },
+    "gate": {
+        "base_url": "https://api.gateio.ws/api/v4",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+    },
+    "htx": {
+        "base_url": "https://api.huobi.pro",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+    },
+    "mexc": {
+        "base_url": "https://api.mexc.com/api/v3",
+        "max_connections": 4,
+        "max_keepalive_connections": 2,
+        "http2": True,
+    },
+}
+HTTP_CONNECT_TIMEOUT = 3.0  # секунды на установку соединения
+HTTP_READ_TIMEOUT = 10.0    # секунды на чтение ответа
+HTTP_KEEPALIVE_EXPIRY = 30.0
+
+# Клиенты создаются и закрываются в lifespan приложения
+http_clients: Dict[str, httpx.AsyncClient] = {}
+
+class TimedTransport(httpx.AsyncHTTPTransport):
+    """
+    Транспорт httpx, который замеряет время запросов к внешнему API и считает ошибки
+    """
+    def __init__(self, upstream: str, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream = upstream
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await acquire_upstream_budget(self.upstream)
+        started = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except httpx.TimeoutException:
+            UPSTREAM_ERRORS.labels(self.upstream, "timeout").inc()
+            raise
+        except httpx.TransportError:
+            UPSTREAM_ERRORS.labels(self.upstream, "connection").inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPSTREAM_LATENCY.labels(self.upstream).observe(elapsed)
+            add_stage_time("upstream", elapsed)
+        if response.status_code >= 400:
+            UPSTREAM_ERRORS.labels(self.upstream, f"http_{response.status_code}").inc()
+        if response.status_code in RATE_LIMIT_STATUSES or (
+                response.status_code == 503 and 'retry-after' in response.headers):
+            await block_upstream(self.upstream, parse_retry_after(response.headers.get('retry-after')))
+        return response
+
+def create_http_client(upstream: str) -> httpx.AsyncClient:
+    """
+    Создает асинхронный HTTP-клиент с пулом соединений для указанного внешнего API
+    """
+    config = UPSTREAMS[upstream]
+    return httpx.AsyncClient(
+        # Адрес можно переопределить, например BINANCE_BASE_URL=http://localhost:9000 для локальной заглушки
+        base_url=os.getenv(f"{upstream.upper()}_BASE_URL", config["base_url"]),
+        transport=TimedTransport(
+            upstream,
+            http2=config["http2"],
+            limits=httpx.Limits(
+                max_connections=config["max_connections"],
+                max_keepalive_connections=config["max_keepalive_connections"],
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        ),
+        timeout=httpx.Timeout(
+            HTTP_READ_TIMEOUT,
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+        ),
+    )
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """
+    Возвращает общий HTTP-клиент для внешнего API (ключ из UPSTREAMS: coingecko, binance, ...)
+    """
+    client = http_clients.get(upstream)
+    if client is None:
+        # Например, при вызове вне lifespan (скрипты, тесты)
+        client = create_http_client(upstream)
+        http_clients[upstream] = client
+    return client
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Жизненный цикл приложения: открывает пулы соединений при старте и закрывает при остановке
+    """
+    for upstream in UPSTREAMS:
+        http_clients[upstream] = create_http_client(upstream)
+    try:
+        await load_custom_exchanges()
+    except Exception as e:
+        # Загрузим позже: при первом обращении или после переподключения подписки
+        logger.warning("Не удалось загрузить пользовательские биржи из Redis: %s", e)
+    tasks = [
+        asyncio.create_task(exchange_snapshot_refresher()),
+        asyncio.create_task(custom_exchanges_listener()),
+        asyncio.create_task(price_history_refresher()),
+    ]
+    if BINANCE_DEPTH_STREAM:
+        book = live_order_books["binance"] = LocalOrderBook("binance")
+        SNAPSHOT_AGE.labels("order_book_binance").set_function(lambda: book.age)
+        tasks.append(asyncio.create_task(
+            local_order_book_task(book, binance_depth_stream, fetch_binance_depth_snapshot)
+        ))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for client in http_clients.values():
+            await client.aclose()
+        http_clients.clear()
+        await redis_client.connection_pool.disconnect()
 
 # Инициализация приложения FastAPI
 app = FastAPI(
     title="LTC Exchange API",
     description="API для получения данных о биржах, торгующих Litecoin (LTC)",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Настройка CORS для доступа с фронтенда
@@ -26,10 +328,661 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Инициализация подключения к Redis
-redis_client = redis.Redis(host='redis', port=6379, db=0, decode_responses=True)
+class MetricsMiddleware:
+    """
+    Время обработки запросов по шаблону маршрута (/api/ltc-depth/{exchange}),
+    чтобы число рядов метрики не зависело от параметров пути.
+    Для потоковых ответов учитывается время до конца отправки.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            REQUEST_LATENCY.labels(
+                getattr(route, 'path', 'unmatched'), scope['method'], str(status)
+            ).observe(time.perf_counter() - started)
+
+class SlowRequestMiddleware:
+    """
+    Собирает время этапов каждого запроса и сохраняет разбивку запросов
+    дольше SLOW_REQUEST_THRESHOLD в кольцевой буфер slow_requests.
+    Потоки (SSE) и административные маршруты не учитываются: они долгие по природе.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith('/api/admin/'):
+            await self.app(scope, receive, send)
+            return
+        stages: Dict[str, list] = {}
+        token = request_stages.set(stages)
+        started = time.perf_counter()
+        response = {'status': 500, 'stream': False}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                for name, value in message.get('headers', []):
+                    if name.lower() == b'content-type' and value.startswith(b'text/event-stream'):
+                        response['stream'] = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_stages.reset(token)
+            elapsed = time.perf_counter() - started
+            if elapsed >= SLOW_REQUEST_THRESHOLD and not response['stream']:
+                record_slow_request(scope, response['status'], elapsed, stages)
+
+def record_slow_request(scope, status: int, elapsed: float, stages: Dict[str, list]):
+    """
+    Сохраняет разбивку медленного запроса по этапам. Время этапов может пересекаться
+    (например, при параллельных запросах к биржам), поэтому otherMs - оценка снизу.
+    """
+    # Копия: фоновые задачи, запущенные запросом, могут дописывать этапы и позже
+    stage_ms = {
+        stage: {'count': count, 'ms': round(seconds * 1000, 3)}
+        for stage, (count, seconds) in stages.items()
+    }
+    query = scope.get('query_string', b'').decode('latin-1')
+    route = scope.get('route')
+    slow_requests.append({
+        'at': format_timestamp(datetime.now(timezone.utc)),
+        'method': scope['method'],
+        'path': scope['path'] + (f"?{query}" if query else ''),
+        'route': getattr(route, 'path', 'unmatched'),
+        'status': status,
+        'durationMs': round(elapsed * 1000, 3),
+        'stages': stage_ms,
+        'otherMs': round(max(0.0, elapsed * 1000 - sum(item['ms'] for item in stage_ms.values())), 3),
+    })
+
+app.add_middleware(SlowRequestMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+# Настройки подключения к Redis
+# Адрес можно переопределить, например REDIS_HOST=localhost для запуска вне docker-compose
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = 0
+REDIS_POOL_SIZE = 20                # максимум соединений в пуле процесса
+REDIS_POOL_TIMEOUT = 2.0            # сколько ждать свободное соединение из пула
+REDIS_SOCKET_TIMEOUT = 1.0          # таймаут чтения/записи команды
+REDIS_SOCKET_CONNECT_TIMEOUT = 1.0  # таймаут установки соединения
+REDIS_HEALTH_CHECK_INTERVAL = 30    # PING перед командой, если соединение простаивало дольше
+
+# Задержки операций Redis по командам: количество, суммарное и максимальное время
+redis_latency: Dict[str, Dict[str, float]] = {}
+
+def record_redis_latency(operation: str, seconds: float):
+    stats = redis_latency.get(operation)
+    if stats is None:
+        stats = redis_latency[operation] = {'count': 0, 'total': 0.0, 'max': 0.0}
+    stats['count'] += 1
+    stats['total'] += seconds
+    stats['max'] = max(stats['max'], seconds)
+    REDIS_LATENCY.labels(operation).observe(seconds)
+    add_stage_time("redis", seconds)
+
+class TimedRedis(redis.asyncio.Redis):
+    """
+    Асинхронный клиент Redis, который замеряет время каждой команды и пайплайна
+    """
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            record_redis_latency(str(args[0]).upper(), time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        async def timed_execute(raise_on_error: bool = True):
+            started = time.perf_counter()
+            try:
+                return await execute(raise_on_error)
+            finally:
+                record_redis_latency('PIPELINE', time.perf_counter() - started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+# Инициализация подключения к Redis: общий пул соединений процесса
+redis_client = TimedRedis(connection_pool=redis.asyncio.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    # Значения хранятся готовыми байтами ответа и отдаются без декодирования
+    decode_responses=False,
+    max_connections=REDIS_POOL_SIZE,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+))
+
+# Бюджет запросов к внешним API, общий для всех процессов: маркерная корзина в Redis
+# на каждый хост с rate_limit в UPSTREAMS. Менее важные вызовы не расходуют резерв
+# корзины, поэтому при нехватке бюджета первым уступает фоновая догрузка истории,
+# затем список иконок, и только потом снапшот бирж.
+UPSTREAM_PRIORITY_SNAPSHOT = 0   # снапшот бирж и запросы по обращению клиента
+UPSTREAM_PRIORITY_ICONS = 1      # список бирж CoinGecko для иконок
+UPSTREAM_PRIORITY_HISTORY = 2    # загрузка истории цены
+UPSTREAM_PRIORITY_NAMES = {0: "snapshot", 1: "icons", 2: "history"}
+RATE_LIMIT_RESERVE = {0: 0.0, 1: 0.3, 2: 0.5}     # доля корзины, которую вызов не может израсходовать
+RATE_LIMIT_MAX_WAIT = {0: 15.0, 1: 0.0, 2: 10.0}  # сколько вызов может ждать бюджет, секунды
+RATE_LIMIT_STATUSES = (429, 418)        # ответы о превышении лимита (418 - бан IP у Binance)
+RATE_LIMIT_DEFAULT_RETRY_AFTER = 60     # пауза, если Retry-After не указан
+RATE_LIMIT_SLOWDOWN_BELOW = 0.5         # ниже этой доли бюджета фоновые обновления замедляются
+RATE_LIMIT_MAX_SLOWDOWN = 4.0           # во сколько раз максимум растут интервалы обновления
+
+# Приоритет вызовов внешних API в текущей задаче (см. upstream_call_priority)
+upstream_priority: ContextVar[int] = ContextVar("upstream_priority", default=UPSTREAM_PRIORITY_SNAPSHOT)
+# Последнее известное процессу состояние бюджета: для адаптивных интервалов и метрик
+rate_limit_state: Dict[str, dict] = {}
+
+# KEYS[1] - корзина (tokens, ts), KEYS[2] - время окончания паузы по Retry-After (мс).
+# ARGV: емкость, пополнение в секунду, резерв. Возвращает {ожидание мс, остаток, пауза мс}.
+# Время берется из Redis, чтобы часы процессов не влияли на бюджет
+TAKE_BUDGET_SCRIPT = redis_client.register_script("""
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local capacity, rate, reserve = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local blocked = math.max(0, (tonumber(redis.call('GET', KEYS[2])) or 0) - now)
+local wait = 0
+if blocked > 0 then
+    wait = blocked
+elseif tokens >= reserve + 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((reserve + 1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 60000)
+return {wait, tostring(tokens), blocked}
+""")
+
+# KEYS как у TAKE_BUDGET_SCRIPT, ARGV[1] - пауза в мс. Пауза только продлевается, бюджет обнуляется
+BLOCK_BUDGET_SCRIPT = redis_client.register_script("""
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local until_ms = now + tonumber(ARGV[1])
+if until_ms > (tonumber(redis.call('GET', KEYS[2])) or 0) then
+    redis.call('SET', KEYS[2], until_ms, 'PX', ARGV[1])
+end
+redis.call('HSET', KEYS[1], 'tokens', '0', 'ts', now)
+return until_ms
+""")
+
+class UpstreamRateLimited(HTTPException):
+    """
+    Бюджет запросов к внешнему API исчерпан: клиент получает 503 с Retry-After, а не 500
+    """
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(status_code=503,
+                         detail=f"Исчерпан лимит запросов к {upstream}, повторите через {retry_after:.0f} с",
+                         headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+@contextmanager
+def upstream_call_priority(priority: int):
+    """
+    Задает приоритет вызовов внешних API внутри блока (и в запущенных из него задачах)
+    """
+    token = upstream_priority.set(priority)
+    try:
+        yield
+    finally:
+        upstream_priority.reset(token)
+
+def upstream_budget_keys(upstream: str) -> List[str]:
+    return [f"ratelimit:{upstream}", f"ratelimit:{upstream}:blocked"]
+
+def update_rate_limit_state(upstream: str, tokens: float, blocked_ms: float = 0.0):
+    capacity, period = UPSTREAMS[upstream]['rate_limit']
+    rate_limit_state[upstream] = {
+        'tokens': tokens,
+        'capacity': capacity,
+        'rate': capacity / period,
+        'checkedAt': time.time(),
+        'blockedUntil': time.time() + blocked_ms / 1000,
+    }
+
+def estimated_budget(upstream: str) -> Optional[float]:
+    """
+    Оценка текущего остатка бюджета по последней проверке с учетом пополнения
+    """
+    state = rate_limit_state.get(upstream)
+    if state is None:
+        return None
+    if state['blockedUntil'] > time.time():
+        return 0.0
+    refill = (time.time() - max(state['checkedAt'], state['blockedUntil'])) * state['rate']
+    return min(state['capacity'], state['tokens'] + refill)
+
+async def acquire_upstream_budget(upstream: str):
+    """
+    Берет из общего бюджета хоста разрешение на один запрос, при необходимости
+    дожидаясь пополнения в пределах RATE_LIMIT_MAX_WAIT для приоритета вызова.
+    Если ждать дольше нельзя, бросает UpstreamRateLimited.
+    Без Redis запросы не блокируются: отказ всех вызовов хуже риска превысить лимит.
+    """
+    limit = UPSTREAMS[upstream].get('rate_limit')
+    if limit is None:
+        return
+    capacity, period = limit
+    priority = upstream_priority.get()
+    max_wait = RATE_LIMIT_MAX_WAIT[priority]
+    started = time.monotonic()
+    while True:
+        try:
+            wait_ms, tokens, blocked_ms = await TAKE_BUDGET_SCRIPT(
+                keys=upstream_budget_keys(upstream),
+                args=[capacity, capacity / period, capacity * RATE_LIMIT_RESERVE[priority]],
+                client=redis_client,
+            )
+        except redis.exceptions.RedisError as e:
+            log_sampled(logging.WARNING, "Бюджет запросов к %s недоступен, запрос идет без проверки: %s", upstream, e)
+            return
+        update_rate_limit_state(upstream, float(tokens), blocked_ms)
+        waited = time.monotonic() - started
+        if wait_ms == 0:
+            RATE_LIMIT_WAIT.labels(upstream, UPSTREAM_PRIORITY_NAMES[priority]).observe(waited)
+            return
+        if waited + wait_ms / 1000 > max_wait:
+            RATE_LIMIT_DENIED.labels(upstream, UPSTREAM_PRIORITY_NAMES[priority]).inc()
+            raise UpstreamRateLimited(upstream, wait_ms / 1000)
+        await asyncio.sleep(wait_ms / 1000)
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """
+    Retry-After в секундах или в виде HTTP-даты
+    """
+    if not value:
+        return RATE_LIMIT_DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return RATE_LIMIT_DEFAULT_RETRY_AFTER
+
+async def block_upstream(upstream: str, seconds: float):
+    """
+    Приостанавливает запросы к хосту во всех процессах после ответа о превышении лимита
+    """
+    if UPSTREAMS[upstream].get('rate_limit') is None or seconds <= 0:
+        return
+    logger.warning("Превышен лимит запросов к %s, пауза %.0f с", upstream, seconds)
+    try:
+        await BLOCK_BUDGET_SCRIPT(keys=upstream_budget_keys(upstream), args=[math.ceil(seconds * 1000)],
+                                  client=redis_client)
+    except redis.exceptions.RedisError as e:
+        logger.warning("Не удалось сохранить паузу запросов к %s: %s", upstream, e)
+    update_rate_limit_state(upstream, 0.0, seconds * 1000)
+
+def adaptive_interval(upstream: str, interval: float) -> float:
+    """
+    Интервал фонового обновления с учетом бюджета: пока бюджета больше
+    RATE_LIMIT_SLOWDOWN_BELOW, интервал не меняется, дальше растет до RATE_LIMIT_MAX_SLOWDOWN раз;
+    во время паузы по Retry-After обновление откладывается до ее окончания
+    """
+    tokens = estimated_budget(upstream)
+    if tokens is None:
+        return interval
+    state = rate_limit_state[upstream]
+    remaining = tokens / state['capacity']
+    if remaining < RATE_LIMIT_SLOWDOWN_BELOW:
+        interval *= 1 + (RATE_LIMIT_MAX_SLOWDOWN - 1) * (1 - remaining / RATE_LIMIT_SLOWDOWN_BELOW)
+    return max(interval, state['blockedUntil'] - time.time())
+
+for _upstream, _config in UPSTREAMS.items():
+    if _config.get('rate_limit') is not None:
+        RATE_LIMIT_TOKENS.labels(_upstream).set_function(
+            lambda upstream=_upstream: estimated_budget(upstream) if upstream in rate_limit_state else math.nan
+        )
+        RATE_LIMIT_BLOCKED.labels(_upstream).set_function(
+            lambda upstream=_upstream: max(0.0, rate_limit_state.get(upstream, {}).get('blockedUntil', 0.0) - time.time())
+        )
 CACHE_TTL = 180  # время жизни кэша - 3 минуты
 
+# Фоновое обновление снапшота бирж: обновляем раньше, чем истечет CACHE_TTL,
+# а сам снапшот храним дольше, чтобы при сбоях API отдавать последние данные
+EXCHANGES_BASE_CACHE_KEY = "ltc_exchanges_base_data"
+EXCHANGES_REFRESH_INTERVAL = 120        # целевой возраст снапшота перед обновлением
+EXCHANGES_REFRESH_CHECK_INTERVAL = 10   # как часто каждый процесс проверяет возраст снапшота
+EXCHANGES_REFRESH_RETRY_INTERVAL = 15   # повтор после неудачного обновления
+EXCHANGES_SNAPSHOT_MAX_AGE = 3600       # сколько хранить последний снапшот в Redis
+EXCHANGES_SNAPSHOT_WAIT_TIMEOUT = 20    # ожидание первого снапшота после старта
+
+# Отсортированные представления хранятся под ключами с номером версии.
+# Новая версия выдается при каждом обновлении снапшота и каждом изменении
+# пользовательских бирж, поэтому старые ключи не нужно искать и удалять по шаблону.
+EXCHANGES_VERSION_KEY = "ltc_exchanges:version"          # текущая версия представлений
+EXCHANGES_VERSION_SEQ_KEY = "ltc_exchanges:version_seq"  # счетчик для выдачи новых версий
+EXCHANGES_VERSION_CHANNEL = "ltc_exchanges:version_changes"
+EXCHANGES_OLD_VERSION_TTL = 60          # сколько живут представления предыдущей версии
+# Изменения по биржам между соседними версиями для ?since=<версия>:
+# кольцо последних версий и по ключу с изменениями на каждую
+EXCHANGES_DELTA_RING_KEY = "ltc_exchanges:recent_versions"
+EXCHANGES_DELTA_RING_SIZE = 30          # около часа при обновлении раз в 2 минуты
+EXCHANGES_REBUILD_LOCK_TIMEOUT = 10     # сколько изменение ждет идущее обновление снапшота
+
+# Последняя известная процессу версия представлений (обновляется по pub/sub)
+exchanges_version: Optional[int] = None
+
+# Постраничный вывод /api/ltc-exchanges
+EXCHANGES_PAGE_MAX_LIMIT = 500
+# Записи бирж последней прочитанной версии: версия и (записи, asOf, время свежести)
+exchange_records_cache: Dict[str, Any] = {'version': None, 'loaded': None}
+
+# Объединение параллельных промахов кэша (single-flight)
+SINGLE_FLIGHT_LOCK_TTL = 30         # на сколько секунд берется блокировка в Redis
+SINGLE_FLIGHT_WAIT_TIMEOUT = 20     # сколько ждать значение, которое считает другой процесс
+SINGLE_FLIGHT_POLL_INTERVAL = 0.2   # как часто проверять кэш во время ожидания
+EARLY_EXPIRATION_BETA = 1.0         # >1 - обновлять раньше, <1 - ближе к концу TTL
+
+# Вычисления, которые сейчас выполняются в этом процессе, по ключу
+inflight_computations: Dict[str, asyncio.Task] = {}
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks: Set[asyncio.Task] = set()
+
+def format_timestamp(dt: datetime) -> str:
+    """
+    Форматирует время в ISO 8601 (UTC), например "2025-03-23T12:00:00Z"
+    """
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def spawn_background(coro: Awaitable) -> asyncio.Task:
+    """
+    Запускает корутину в фоне, не дожидаясь результата
+    """
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def single_flight(key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Выполняет compute() один раз для всех параллельных вызовов с одинаковым ключом
+    в пределах процесса: остальные вызовы ждут тот же результат.
+    Отмена одного из ожидающих запросов не прерывает общее вычисление.
+    """
+    task = inflight_computations.get(key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        inflight_computations[key] = task
+
+        def forget(done_task: asyncio.Task):
+            if inflight_computations.get(key) is done_task:
+                del inflight_computations[key]
+
+        task.add_done_callback(forget)
+    return await asyncio.shield(task)
+
+def should_refresh_early(computed_at: float, delta: float, ttl: float,
+                         beta: float = EARLY_EXPIRATION_BETA) -> bool:
+    """
+    Вероятностное раннее истечение (XFetch): чем ближе конец TTL и чем дольше
+    считается значение (delta), тем выше вероятность обновить его заранее.
+    Так обновления разных ключей и процессов не совпадают с границей TTL.
+    """
+    expires_at = computed_at + ttl
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+# Готовые ответы в кэше: исходные байты, gzip и brotli варианты и ETag.
+# Сжатие выполняется один раз при записи, а не на каждый запрос.
+PAYLOAD_GZIP_LEVEL = 6
+PAYLOAD_BROTLI_QUALITY = 5                # 11 сжимает лучше, но в десятки раз медленнее
+CACHE_MIN_STALE_WHILE_REVALIDATE = 30     # границы stale-while-revalidate в Cache-Control
+CACHE_MAX_STALE_WHILE_REVALIDATE = 300
+PAYLOAD_ENCODINGS = ('br', 'gzip')        # в порядке предпочтения
+
+def encode_payload(body: bytes, fresh_until: float, expires_at: float) -> Dict[str, Any]:
+    """
+    Готовит запись кэша для ответа: исходные байты, сжатые варианты
+    и сильный ETag по содержимому
+
+    - **fresh_until**: до какого времени (unix) данные считаются свежими
+    - **expires_at**: когда запись будет удалена из кэша
+    """
+    with request_stage("serialize"):
+        return {
+            'body': body,
+            'gzip': gzip.compress(body, compresslevel=PAYLOAD_GZIP_LEVEL, mtime=0),
+            'br': brotli.compress(body, quality=PAYLOAD_BROTLI_QUALITY),
+            'etag': hashlib.blake2b(body, digest_size=16).hexdigest(),
+            'freshUntil': fresh_until,
+            'expiresAt': expires_at,
+        }
+
+def parse_quality(params: str) -> float:
+    """
+    Значение q из параметров элемента Accept-Encoding; некорректное значение считается 1
+    """
+    for param in params.split(';'):
+        name, _, value = param.strip().partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                quality = float(value.strip())
+            except ValueError:
+                return 1.0
+            return min(max(quality, 0.0), 1.0) if math.isfinite(quality) else 1.0
+    return 1.0
+
+def choose_encoding(request: Request) -> Optional[str]:
+    """
+    Выбирает сжатие по заголовку Accept-Encoding (None - без сжатия): кодировку
+    с наибольшим q, при равных q - в порядке PAYLOAD_ENCODINGS
+    """
+    qualities = {}
+    for part in request.headers.get('accept-encoding', '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if token:
+            qualities[token] = parse_quality(params)
+    wildcard = qualities.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in PAYLOAD_ENCODINGS:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    # Явно предпочтенный ответ без сжатия
+    if best is not None and qualities.get('identity', 0.0) > best_quality:
+        return None
+    return best
+
+async def read_payload(cache_key: str, encoding: Optional[str], extra_fields: tuple = ()) -> Optional[Dict[str, Any]]:
+    """
+    Читает из кэша готовый ответ в нужной кодировке одной командой HMGET
+    """
+    names = ['etag', 'freshUntil', 'expiresAt', encoding or 'body', *extra_fields]
+    values = await redis_client.hmget(cache_key, names)
+    if values[0] is None or values[3] is None:
+        return None
+    return dict(zip(names, values))
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        # Сравниваем без учета суффикса кодировки: содержимое у вариантов одно
+        tag = tag.removeprefix('W/').strip('"')
+        if tag == etag or tag.rsplit('-', 1)[0] == etag:
+            return True
+    return False
+
+def payload_response(payload: Dict[str, Any], request: Request, encoding: Optional[str]) -> Response:
+    """
+    Формирует ответ из записи кэша: ETag, Cache-Control по оставшемуся времени
+    свежести и 304 Not Modified, если клиент прислал совпадающий If-None-Match
+    """
+    etag = payload['etag']
+    if isinstance(etag, bytes):
+        etag = etag.decode()
+    now = time.time()
+    max_age = max(0, int(float(payload['freshUntil']) - now))
+    stale = int(float(payload['expiresAt']) - max(now, float(payload['freshUntil'])))
+    stale = min(max(stale, CACHE_MIN_STALE_WHILE_REVALIDATE), CACHE_MAX_STALE_WHILE_REVALIDATE)
+    headers = {
+        'ETag': f'"{etag}-{encoding}"' if encoding else f'"{etag}"',
+        'Cache-Control': f"public, max-age={max_age}, stale-while-revalidate={stale}",
+        'Vary': 'Accept-Encoding',
+    }
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(content=payload[encoding or 'body'], media_type="application/json", headers=headers)
+
+async def write_payload(cache_key: str, payload: Dict[str, Any], ttl: int):
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(cache_key)
+        pipe.hset(cache_key, mapping=payload)
+        pipe.expire(cache_key, ttl)
+        await pipe.execute()
+
+async def read_cache_entry(cache_key: str, encoding: Optional[str] = None,
+                           all_encodings: bool = False) -> Optional[dict]:
+    """
+    Читает запись кэша: готовый ответ в нужной кодировке (или во всех, all_encodings=True)
+    и метаданные для раннего истечения. Сами данные не разбираются - они отдаются клиенту как есть.
+    """
+    extra_fields = ('computedAt', 'delta', 'ttl')
+    if all_encodings:
+        encoding, extra_fields = None, PAYLOAD_ENCODINGS + extra_fields
+    entry = await read_payload(cache_key, encoding, extra_fields)
+    if entry is None or entry['computedAt'] is None:
+        return None
+    entry['computedAt'] = float(entry['computedAt'])
+    entry['delta'] = float(entry['delta'])
+    entry['ttl'] = int(entry['ttl'])
+    return entry
+
+def build_cache_entry(value: Any, ttl: int, delta: float, fresh_until: Optional[float] = None) -> dict:
+    """
+    Сериализует и сжимает значение и добавляет метаданные для раннего истечения
+    """
+    computed_at = time.time()
+    if fresh_until is None:
+        fresh_until = computed_at + ttl
+    entry = encode_payload(orjson.dumps(value), fresh_until, computed_at + ttl)
+    entry.update(computedAt=computed_at, delta=delta, ttl=ttl)
+    return entry
+
+async def write_cache_entry(cache_key: str, value: Any, ttl: int, delta: float) -> dict:
+    """
+    Сериализует и сжимает значение один раз и сохраняет готовый ответ в кэш
+    вместе с временем вычисления и его длительностью
+    """
+    entry = build_cache_entry(value, ttl, delta)
+    await write_payload(cache_key, entry, ttl)
+    return entry
+
+async def wait_for_cache_value(cache_key: str, timeout: float = SINGLE_FLIGHT_WAIT_TIMEOUT) -> Optional[bytes]:
+    """
+    Ждет, пока значение появится в кэше (например, его считает другой процесс)
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        cached = await redis_client.get(cache_key)
+        if cached or time.monotonic() >= deadline:
+            return cached
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+async def compute_cache_entry(cache_key: str, ttl: int, compute: Callable[[], Awaitable[Any]],
+                              wait: bool) -> Optional[dict]:
+    """
+    Межпроцессное объединение: значение вычисляется только под блокировкой в Redis.
+    Если блокировку держит другой процесс, ждет его результат (wait=True)
+    или сразу возвращает None.
+    """
+    lock = redis_client.lock(f"lock:{cache_key}", timeout=SINGLE_FLIGHT_LOCK_TTL, blocking=False)
+    if not await lock.acquire():
+        if not wait:
+            return None
+        deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+            # Результат общий для запросов с разными Accept-Encoding - читаем все варианты
+            entry = await read_cache_entry(cache_key, all_encodings=True)
+            if entry is not None:
+                return entry
+        # Другой процесс не успел - считаем сами
+        logger.debug("Не дождались значения %s от другого процесса, вычисляем сами", cache_key)
+        lock = None
+    try:
+        started = time.monotonic()
+        value = await compute()
+        return await write_cache_entry(cache_key, value, ttl, time.monotonic() - started)
+    finally:
+        if lock is not None:
+            try:
+                await lock.release()
+            except redis.exceptions.LockError:
+                # Блокировка истекла, пока шло вычисление
+                pass
+
+async def get_or_compute(cache_key: str, ttl: int, compute: Callable[[], Awaitable[Any]],
+                         encoding: Optional[str] = None) -> dict:
+    """
+    Возвращает готовый ответ из кэша (байты в нужной кодировке, ETag и время свежести),
+    а при промахе вычисляет его через compute() один раз на все параллельные
+    запросы (в процессе и между процессами).
+    Незадолго до истечения TTL значение с некоторой вероятностью обновляется в фоне,
+    а запрос сразу получает текущее.
+    """
+    family = cache_key.split(':', 1)[0]
+    entry = await read_cache_entry(cache_key, encoding)
+    if entry is not None:
+        if should_refresh_early(entry['computedAt'], entry['delta'], entry['ttl']):
+            CACHE_REQUESTS.labels(family, "stale").inc()
+            logger.debug("Раннее обновление кэша %s", cache_key)
+            spawn_background(single_flight(
+                f"refresh:{cache_key}",
+                lambda: compute_cache_entry(cache_key, ttl, compute, wait=False)
+            ))
+        else:
+            CACHE_REQUESTS.labels(family, "hit").inc()
+        return entry
+    
+    CACHE_REQUESTS.labels(family, "miss").inc()
+    # Все варианты кодировки вычисляются вместе, поэтому ожидание общее
+    return await single_flight(
+        cache_key,
+        lambda: compute_cache_entry(cache_key, ttl, compute, wait=True)
+    )
+
 # Обновляем класс перечисления для поддержки возможных критериев сортировки
 class SortCriterion(str, Enum):
     ID = "id"  # Добавляем новый критерий сортировки по ID
@@ -54,22 +1007,263 @@ class ExchangeData(BaseModel):
     lastUpdated: str
     icon: Optional[str] = None  # Дополнительное поле для иконки биржи
 
+class RawExchangeData(BaseModel):
+    """Биржа с числовыми значениями (ответ при raw=true)"""
+    id: int
+    exchange: str
+    pair: str
+    price: float
+    price_percent: Optional[float] = None
+    plusTwoPercentDepth: float
+    minusTwoPercentDepth: float
+    volume24h: float
+    volumePercentage: float
+    lastUpdated: str
+    icon: Optional[str] = None
+
 class ExchangeResponse(BaseModel):
     status: str
-    data: List[ExchangeData]
+    data: List[Union[ExchangeData, RawExchangeData]]
+    asOf: Optional[str] = None  # Время получения снапшота из API (UTC)
+    version: Optional[int] = None   # Версия данных для запроса изменений (?since=)
+    total: Optional[int] = None   # Общее число бирж (при постраничном выводе)
+    offset: Optional[int] = None
+    limit: Optional[int] = None
+
+# Поля, которые можно запросить через fields= (в порядке вывода)
+EXCHANGE_FIELDS = list(ExchangeData.__annotations__)
+
+def format_price(value: float) -> str:
+    return f"{value:.4f}"
+
+def format_usd(value: float) -> str:
+    return f"${math.floor(value):,}"
+
+def format_percent(value: float) -> str:
+    return f"{value:.2f}%"
+
+class ExchangeRecord:
+    """
+    Внутреннее компактное представление биржи с числовыми значениями.
+    Сортировка и расчеты работают с ним, а строковый формат для ответа
+    (ExchangeData) строится только при сериализации.
+    """
+    __slots__ = ('exchange', 'pair', 'price', 'price_percent', 'plus_depth', 'minus_depth',
+                 'volume', 'volume_percentage', 'last_updated', 'icon')
+
+    def __init__(self, exchange: str, pair: str, price: float, plus_depth: float, minus_depth: float,
+                 volume: float, volume_percentage: float, last_updated: str,
+                 price_percent: Optional[float] = None, icon: Optional[str] = None):
+        self.exchange = exchange
+        self.pair = pair
+        self.price = price
+        self.price_percent = price_percent
+        self.plus_depth = plus_depth
+        self.minus_depth = minus_depth
+        self.volume = volume
+        self.volume_percentage = volume_percentage
+        self.last_updated = last_updated
+        self.icon = icon
+
+    def to_dict(self) -> dict:
+        """Словарь для хранения в кэше"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExchangeRecord":
+        return cls(**data)
+
+    def copy(self) -> "ExchangeRecord":
+        return ExchangeRecord.from_dict(self.to_dict())
+
+    def to_display(self, exchange_id: int = 0) -> dict:
+        """Строковый формат ответа API (как ExchangeData)"""
+        return {
+            'id': exchange_id,
+            'exchange': self.exchange,
+            'pair': self.pair,
+            'price': format_price(self.price),
+            'price_percent': self.price_percent,
+            'plusTwoPercentDepth': format_usd(self.plus_depth),
+            'minusTwoPercentDepth': format_usd(self.minus_depth),
+            'volume24h': format_usd(self.volume),
+            'volumePercentage': format_percent(self.volume_percentage),
+            'lastUpdated': self.last_updated,
+            'icon': self.icon
+        }
+
+    def to_raw(self, exchange_id: int = 0) -> dict:
+        """Числовой формат ответа API (как RawExchangeData)"""
+        return {
+            'id': exchange_id,
+            'exchange': self.exchange,
+            'pair': self.pair,
+            'price': self.price,
+            'price_percent': self.price_percent,
+            'plusTwoPercentDepth': self.plus_depth,
+            'minusTwoPercentDepth': self.minus_depth,
+            'volume24h': self.volume,
+            'volumePercentage': self.volume_percentage,
+            'lastUpdated': self.last_updated,
+            'icon': self.icon
+        }
+
+class DepthBand(BaseModel):
+    percent: float
+    plusDepth: float    # USDT в asks до reference*(1+percent%)
+    minusDepth: float   # USDT в bids до reference*(1-percent%)
+
+class FillEstimate(BaseModel):
+    side: str
+    notional: float
+    filledNotional: float
+    volume: float
+    averagePrice: Optional[float] = None
+    slippagePercent: Optional[float] = None
+    cost: Optional[float] = None    # потери в USDT относительно reference
 
 class DepthData(BaseModel):
     exchange: str
     currentPrice: float
     plus2PercentDepth: str
     minus2PercentDepth: str
+    bestBid: Optional[float] = None
+    bestAsk: Optional[float] = None
+    updatedAt: Optional[str] = None
+    source: Optional[str] = None  # rest - снимок книги, stream - локальная книга из потока
+    midPrice: Optional[float] = None
+    microPrice: Optional[float] = None
+    reference: Optional[str] = None    # от какой цены считаются полосы: mid или microprice
+    bands: Optional[List[DepthBand]] = None
+    fills: Optional[List[FillEstimate]] = None
 
 class DepthResponse(BaseModel):
     status: str
     data: DepthData
 
-# Глобальное хранилище для пользовательских бирж
-custom_exchanges: Dict[str, ExchangeData] = {}
+class DepthBatchResponse(BaseModel):
+    status: str
+    data: List[DepthData]
+    errors: Dict[str, str] = {}
+
+# Пользовательские биржи хранятся в Redis: хэш на биржу и множество-индекс.
+# Каждый процесс держит локальную копию и обновляет ее по сообщениям pub/sub,
+# поэтому изменения из бота видны всем воркерам и переживают перезапуск.
+# Копия только для чтения: версии представлений публикуются по данным,
+# перечитанным из Redis под блокировкой (см. publish_exchange_views).
+CUSTOM_EXCHANGE_KEY_PREFIX = "custom_exchange:"
+CUSTOM_EXCHANGES_INDEX_KEY = "custom_exchanges:index"
+CUSTOM_EXCHANGES_CHANNEL = "custom_exchanges:changes"
+CUSTOM_EXCHANGES_RESUBSCRIBE_DELAY = 5  # пауза перед переподключением подписки
+
+# Локальная копия пользовательских бирж (read-through)
+custom_exchanges: Dict[str, ExchangeRecord] = {}
+custom_exchanges_loaded = False
+
+def custom_exchange_key(exchange_id: str) -> str:
+    return f"{CUSTOM_EXCHANGE_KEY_PREFIX}{exchange_id}"
+
+def record_to_hash(record: ExchangeRecord) -> Dict[str, bytes]:
+    """Поля записи для HSET (значения в JSON, чтобы сохранить типы и None)"""
+    return {name: orjson.dumps(value) for name, value in record.to_dict().items()}
+
+def record_from_hash(data: Dict[bytes, bytes]) -> ExchangeRecord:
+    return ExchangeRecord.from_dict({name.decode(): orjson.loads(value) for name, value in data.items()})
+
+async def load_custom_exchanges() -> Dict[str, ExchangeRecord]:
+    """
+    Полностью перечитывает пользовательские биржи из Redis в локальную копию и возвращает ее
+    """
+    global custom_exchanges, custom_exchanges_loaded
+    exchange_ids = sorted(member.decode() for member in await redis_client.smembers(CUSTOM_EXCHANGES_INDEX_KEY))
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for exchange_id in exchange_ids:
+            pipe.hgetall(custom_exchange_key(exchange_id))
+        hashes = await pipe.execute()
+    custom_exchanges = {
+        exchange_id: record_from_hash(data)
+        for exchange_id, data in zip(exchange_ids, hashes)
+        if data
+    }
+    custom_exchanges_loaded = True
+    logger.debug("Загружено %d пользовательских бирж из Redis", len(custom_exchanges))
+    return custom_exchanges
+
+async def reload_custom_exchange(exchange_id: str):
+    """
+    Перечитывает одну пользовательскую биржу из Redis (после сообщения об изменении)
+    """
+    data = await redis_client.hgetall(custom_exchange_key(exchange_id))
+    if data:
+        custom_exchanges[exchange_id] = record_from_hash(data)
+    else:
+        custom_exchanges.pop(exchange_id, None)
+
+async def get_custom_exchange_records() -> Dict[str, ExchangeRecord]:
+    """
+    Возвращает локальную копию пользовательских бирж, при необходимости загружая ее из Redis.
+    Копия может отставать от Redis на доставку сообщения pub/sub, поэтому подходит
+    для ответов на чтение, но не для публикации версий.
+    """
+    if not custom_exchanges_loaded:
+        await single_flight(CUSTOM_EXCHANGES_INDEX_KEY, load_custom_exchanges)
+    return custom_exchanges
+
+async def save_custom_exchange(exchange_id: str, record: ExchangeRecord):
+    """
+    Сохраняет пользовательскую биржу в Redis и оповещает остальные процессы
+    """
+    key = custom_exchange_key(exchange_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=record_to_hash(record))
+        pipe.sadd(CUSTOM_EXCHANGES_INDEX_KEY, exchange_id)
+        pipe.publish(CUSTOM_EXCHANGES_CHANNEL, exchange_id)
+        await pipe.execute()
+    custom_exchanges[exchange_id] = record
+
+async def remove_custom_exchange(exchange_id: str) -> bool:
+    """
+    Удаляет пользовательскую биржу из Redis; возвращает False, если ее не было
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.srem(CUSTOM_EXCHANGES_INDEX_KEY, exchange_id)
+        pipe.delete(custom_exchange_key(exchange_id))
+        pipe.publish(CUSTOM_EXCHANGES_CHANNEL, exchange_id)
+        removed, _, _ = await pipe.execute()
+    custom_exchanges.pop(exchange_id, None)
+    return bool(removed)
+
+async def custom_exchanges_listener():
+    """
+    Фоновая задача: слушает сообщения об изменении пользовательских бирж
+    и о новых версиях представлений и обновляет локальные копии.
+    После переподключения перечитывает все, так как сообщения за время разрыва потеряны.
+    """
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CUSTOM_EXCHANGES_CHANNEL, EXCHANGES_VERSION_CHANNEL)
+            await load_custom_exchanges()
+            await load_exchanges_version()
+            while True:
+                message = await pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                if message['channel'] == EXCHANGES_VERSION_CHANNEL.encode():
+                    set_exchanges_version(int(message['data']))
+                else:
+                    await reload_custom_exchange(message['data'].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Ошибка подписки на изменения пользовательских бирж: %s", e)
+            await asyncio.sleep(CUSTOM_EXCHANGES_RESUBSCRIBE_DELAY)
+        finally:
+            try:
+                await pubsub.reset()
+            except Exception:
+                pass
 
 class CustomExchangeInput(BaseModel):
     exchange: str
@@ -97,8 +1291,6 @@ async def add_custom_exchange(exchange_data: CustomExchangeInput):
     Добавляет или обновляет пользовательскую биржу с указанными данными.
     Биржа будет отображаться в общем списке при запросе всех бирж.
     """
-    global custom_exchanges
-    
     exchange_id = exchange_data.exchange.lower()
     
     # Если указан процент, рассчитываем цену автоматически
@@ -108,19 +1300,20 @@ async def add_custom_exchange(exchange_data: CustomExchangeInput):
         if binance_price > 0:
             price = binance_price * (1 + exchange_data.price_percent / 100)
     
-    custom_exchanges[exchange_id] = ExchangeData(
-        id=0,  # ID будет присвоен позже при объединении списков
+    record = ExchangeRecord(
         exchange=exchange_data.exchange,
         pair=exchange_data.pair,
-        price=f"{price:.4f}" if price else "0.0000",
+        price=price or 0.0,
         price_percent=exchange_data.price_percent,  # Сохраняем процентную корректировку
-        plusTwoPercentDepth=f"${math.floor(exchange_data.plusTwoPercentDepth):,}",
-        minusTwoPercentDepth=f"${math.floor(exchange_data.minusTwoPercentDepth):,}",
-        volume24h=f"${math.floor(exchange_data.volume24h):,}",
-        volumePercentage=f"{exchange_data.volumePercentage:.2f}%",
-        lastUpdated='Recently',
+        plus_depth=exchange_data.plusTwoPercentDepth,
+        minus_depth=exchange_data.minusTwoPercentDepth,
+        volume=exchange_data.volume24h,
+        volume_percentage=exchange_data.volumePercentage,
+        last_updated=format_timestamp(datetime.now(timezone.utc)),
         icon=exchange_data.icon
     )
+    await save_custom_exchange(exchange_id, record)
+    await rebuild_exchange_views()
     
     return {
         "status": "success",
@@ -134,7 +1327,7 @@ async def get_custom_exchanges():
     """
     return {
         "status": "success",
-        "data": list(custom_exchanges.values())
+        "data": [exchange.to_display() for exchange in (await get_custom_exchange_records()).values()]
     }
 
 @app.delete("/api/custom-exchanges/{exchange_name}", tags=["exchanges"])
@@ -142,11 +1335,9 @@ async def delete_custom_exchange(exchange_name: str):
     """
     Удаляет пользовательскую биржу по имени.
     """
-    global custom_exchanges
-    
     exchange_id = exchange_name.lower()
-    if exchange_id in custom_exchanges:
-        del custom_exchanges[exchange_id]
+    if await remove_custom_exchange(exchange_id):
+        await rebuild_exchange_views()
         return {
             "status": "success",
             "message": f"Биржа {exchange_name} успешно удалена"
@@ -160,14 +1351,13 @@ async def update_custom_exchange(exchange_name: str, exchange_data: CustomExchan
     Обновляет отдельные параметры пользовательской биржи.
     Обновляются только те поля, которые указаны в запросе.
     """
-    global custom_exchanges
-    
     exchange_id = exchange_name.lower()
-    if exchange_id not in custom_exchanges:
-        raise HTTPException(status_code=404, detail=f"Биржа {exchange_name} не найдена")
     
-    # Получаем текущие данные о бирже
-    exchange = custom_exchanges[exchange_id]
+    # Получаем текущие данные о бирже напрямую из Redis, а не из локальной копии
+    stored = await redis_client.hgetall(custom_exchange_key(exchange_id))
+    if not stored:
+        raise HTTPException(status_code=404, detail=f"Биржа {exchange_name} не найдена")
+    exchange = record_from_hash(stored)
     
     # Обновляем поля, которые были предоставлены
     if exchange_data.pair is not None:
@@ -180,170 +1370,954 @@ async def update_custom_exchange(exchange_name: str, exchange_data: CustomExchan
         binance_price = await get_binance_ltc_price()
         if binance_price > 0:
             calculated_price = binance_price * (1 + exchange_data.price_percent / 100)
-            exchange.price = f"{calculated_price:.4f}"
+            exchange.price = calculated_price
     elif exchange_data.price is not None:
         # Если указана конкретная цена, обнуляем процентную корректировку
-        exchange.price = f"{exchange_data.price:.4f}"
+        exchange.price = exchange_data.price
         exchange.price_percent = None
         
     if exchange_data.plusTwoPercentDepth is not None:
-        exchange.plusTwoPercentDepth = f"${math.floor(exchange_data.plusTwoPercentDepth):,}"
+        exchange.plus_depth = exchange_data.plusTwoPercentDepth
         
     if exchange_data.minusTwoPercentDepth is not None:
-        exchange.minusTwoPercentDepth = f"${math.floor(exchange_data.minusTwoPercentDepth):,}"
+        exchange.minus_depth = exchange_data.minusTwoPercentDepth
         
     if exchange_data.volume24h is not None:
-        exchange.volume24h = f"${math.floor(exchange_data.volume24h):,}"
+        exchange.volume = exchange_data.volume24h
         
     if exchange_data.volumePercentage is not None:
-        exchange.volumePercentage = f"{exchange_data.volumePercentage:.2f}%"
+        exchange.volume_percentage = exchange_data.volumePercentage
         
     if exchange_data.icon is not None:
         exchange.icon = exchange_data.icon
     
     # Обновляем временную метку
-    exchange.lastUpdated = 'User updated'
+    exchange.last_updated = 'User updated'
+    await save_custom_exchange(exchange_id, exchange)
+    await rebuild_exchange_views()
     
     return {
         "status": "success",
         "message": f"Биржа {exchange_name} успешно обновлена",
-        "data": exchange
+        "data": exchange.to_display()
     }
 
 @app.get("/api/ltc-exchanges", response_model=ExchangeResponse, tags=["exchanges"])
 async def get_ltc_exchanges(
+    request: Request,
     sort_by: Optional[SortCriterion] = None,
-    descending: bool = True
+    descending: bool = True,
+    raw: bool = False,
+    limit: Optional[int] = Query(None, ge=1, le=EXCHANGES_PAGE_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    top: Optional[int] = Query(None, ge=1, le=EXCHANGES_PAGE_MAX_LIMIT),
+    fields: Optional[str] = None,
+    since: Optional[int] = None
 ):
     """
     Получает список бирж, торгующих парой LTC/USDT с возможностью сортировки по различным параметрам.
     
     - **sort_by**: Критерий сортировки (id, price, volume, plus_depth, minus_depth, exchange, volume_percentage)
     - **descending**: Порядок сортировки (по умолчанию - по убыванию)
+    - **raw**: Если True, цена, объем, глубина и процент объема возвращаются числами, без форматирования
+    - **limit**, **offset**: Постраничный вывод (не больше 500 бирж за запрос)
+    - **top**: Только первые N бирж по выбранной сортировке (то же, что limit=N без offset)
+    - **fields**: Список полей через запятую, например fields=exchange,price,volume24h
+    - **since**: Версия (поле version прошлого ответа): вернуть только изменения по биржам
+      с этой версии - added (строки целиком), removed (названия) и changed (изменившиеся поля).
+      Если версия уже слишком старая, возвращается таблица целиком
+    
+    Ответы отдаются с ETag (на If-None-Match с тем же значением - 304) и заранее
+    сжатыми в gzip/brotli, если клиент их поддерживает.
     """
     try:
-        # Проверяем наличие кеша базовых данных (без сортировки)
-        base_cache_key = "ltc_exchanges_base_data"
-        base_cached_data = redis_client.get(base_cache_key)
-        
-        # Проверяем наличие данных с текущими параметрами сортировки
-        sort_cache_key = f"ltc_exchanges_data:{sort_by}:{descending}"
-        sorted_cached_data = redis_client.get(sort_cache_key)
-        
-        # Если есть данные с запрошенной сортировкой, возвращаем их сразу
-        if sorted_cached_data:
-            print(f"CACHE HIT: Данные с сортировкой получены из кэша Redis с ключом {sort_cache_key}")
-            return json.loads(sorted_cached_data)
-        
-        print(f"CACHE MISS: Данные с сортировкой не найдены в кэше Redis с ключом {sort_cache_key}")
-        
-        # Если есть базовые данные, используем их без повторного вызова API
-        if base_cached_data:
-            print(f"CACHE HIT: Используем базовые данные из кэша Redis для сортировки")
-            result_data = json.loads(base_cached_data)
-            exchanges = []
-            
-            # Преобразуем сырые данные в объекты ExchangeData
-            for exchange_dict in result_data['data']:
-                exchange = ExchangeData(**exchange_dict)
-                exchanges.append(exchange)
-            
-            print(f"DEBUG: Загружено {len(exchanges)} бирж из базового кеша для сортировки")
-        else:
-            # Если базовых данных нет, получаем их из API и сохраняем
-            print(f"CACHE MISS: Базовые данные не найдены в кэше Redis, получаем из API")
-            exchanges = await fetch_exchange_data_from_api()
-            
-            # Сохраняем базовые данные в кеш
-            base_result = {
-                'status': 'success',
-                'data': [exchange.__dict__ for exchange in exchanges]
-            }
-            try:
-                redis_client.setex(base_cache_key, CACHE_TTL, json.dumps(base_result))
-                print(f"DEBUG: Базовые данные успешно сохранены в кэш Redis с ключом {base_cache_key}")
-            except Exception as cache_error:
-                print(f"DEBUG: Ошибка при сохранении базовых данных в кэш: {str(cache_error)}")
+        encoding = choose_encoding(request)
+        if since is not None:
+            delta = await load_exchanges_delta(since, raw)
+            if delta is not None:
+                return Response(content=delta, media_type="application/json", headers={'Cache-Control': 'no-cache'})
+            # Версия клиента устарела - отдаем таблицу целиком
+        if limit is not None or top is not None or fields or offset:
+            return await get_exchanges_page(request, encoding, sort_by, descending, raw, limit, offset, top, fields)
         
-        # Применяем сортировку
-        print(f"DEBUG: Применяем сортировку к кешированным данным")
-        print(f"DEBUG: Присвоены ID для {len(exchanges)} бирж")
+        # Проверяем наличие данных с текущими параметрами сортировки в текущей версии
+        version = await get_exchanges_version()
+        payload = None
+        if version is not None:
+            sort_cache_key = exchanges_sort_cache_key(version, sort_by, descending, raw)
+            payload = await read_payload(sort_cache_key, encoding)
+            if payload is None:
+                # Сообщение о новой версии могло еще не дойти - сверяемся с Redis
+                latest_version = await load_exchanges_version()
+                if latest_version is not None and latest_version != version:
+                    sort_cache_key = exchanges_sort_cache_key(latest_version, sort_by, descending, raw)
+                    payload = await read_payload(sort_cache_key, encoding)
         
-        # Выполняем сортировку в зависимости от параметров
-        if sort_by:
-            print(f"DEBUG: Сортировка по критерию: {sort_by}, по убыванию: {descending}")
-            if sort_by == SortCriterion.ID:
-                # Сортировка по ID
-                exchanges.sort(key=lambda x: x.id, reverse=descending)  
-                print(f"DEBUG: Выполнена сортировка по ID")
-            elif sort_by == SortCriterion.PRICE:
-                exchanges.sort(key=lambda x: float(x.price.replace(',', '')), reverse=descending)
-                print(f"DEBUG: Выполнена сортировка по цене")
-            elif sort_by == SortCriterion.VOLUME:
-                exchanges.sort(key=lambda x: float(x.volume24h.replace('$', '').replace(',', '')), reverse=descending)
-                print(f"DEBUG: Выполнена сортировка по объему")
-            elif sort_by == SortCriterion.PLUS_DEPTH:
-                exchanges.sort(key=lambda x: float(x.plusTwoPercentDepth.replace('$', '').replace(',', '')), reverse=descending)
-                print(f"DEBUG: Выполнена сортировка по глубине +2%")
-            elif sort_by == SortCriterion.MINUS_DEPTH:
-                exchanges.sort(key=lambda x: float(x.minusTwoPercentDepth.replace('$', '').replace(',', '')), reverse=descending)
-                print(f"DEBUG: Выполнена сортировка по глубине -2%")
-            elif sort_by == SortCriterion.EXCHANGE:
-                exchanges.sort(key=lambda x: x.exchange.lower(), reverse=descending)
-                print(f"DEBUG: Выполнена сортировка по названию биржи")
-            elif sort_by == SortCriterion.VOLUME_PERCENTAGE:
-                exchanges.sort(key=lambda x: float(x.volumePercentage.replace('%', '')), reverse=descending)
-                print(f"DEBUG: Выполнена сортировка по проценту объема")
-        else:
-            # По умолчанию сортируем по объему торгов
-            exchanges.sort(key=lambda x: float(x.volume24h.replace('$', '').replace(',', '')), reverse=True)
-            print(f"DEBUG: Выполнена сортировка по умолчанию (по объему, по убыванию)")
+        # Если есть данные с запрошенной сортировкой, отдаем сохраненные байты как есть,
+        # без разбора JSON, валидации модели, повторной сериализации и сжатия
+        if payload is not None:
+            CACHE_REQUESTS.labels("exchanges_view", "hit").inc()
+            log_sampled(logging.DEBUG, "CACHE HIT: Данные с сортировкой получены из кэша Redis с ключом %s", sort_cache_key)
+            return payload_response(payload, request, encoding)
         
-        # После сортировки, переназначаем ID чтобы они соответствовали новому порядку
-        for i, exchange in enumerate(exchanges, start=1):
-            exchange.id = i
-        print(f"DEBUG: ID назначены после сортировки")
+        CACHE_REQUESTS.labels("exchanges_view", "miss").inc()
+        logger.debug("CACHE MISS: Данные с сортировкой %s:%s не найдены в кэше Redis (версия %s)", sort_by, descending, version)
         
-        # Выводим информацию о первых и последних элементах после сортировки для проверки
-        if exchanges:
-            first_exchange = exchanges[0]
-            last_exchange = exchanges[-1]
-            print(f"DEBUG: Первая биржа после сортировки: ID={first_exchange.id}, {first_exchange.exchange}, цена={first_exchange.price}, объем={first_exchange.volume24h}")
-            print(f"DEBUG: Последняя биржа после сортировки: ID={last_exchange.id}, {last_exchange.exchange}, цена={last_exchange.price}, объем={last_exchange.volume24h}")
-                
-        result = {
-            'status': 'success',
-            'data': exchanges
-        }
-        
-        # Сохраняем отсортированные данные в кэш
-        print(f"CACHE SET: Сохраняем отсортированные данные в Redis с ключом {sort_cache_key} и TTL {CACHE_TTL} секунд")
+        # Параллельные промахи по одной сортировке собирают ее один раз
+        payload = await single_flight(
+            f"build:{sort_by}:{descending}:{raw}",
+            lambda: build_sorted_exchanges(sort_by, descending, raw)
+        )
+        return payload_response(payload, request, encoding)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении данных по LTC: {str(e)}")
+
+def exchanges_sort_cache_key(version: int, sort_by: Optional[SortCriterion], descending: bool,
+                             raw: bool = False) -> str:
+    """
+    Ключ кэша для списка бирж с заданной сортировкой в заданной версии
+    """
+    key = f"ltc_exchanges_data:v{version}:{sort_by}:{descending}"
+    return f"{key}:raw" if raw else key
+
+def exchanges_view_keys(version: int) -> List[str]:
+    """
+    Все ключи отсортированных представлений одной версии
+    """
+    return [
+        exchanges_sort_cache_key(version, sort_by, descending, raw)
+        for sort_by in [None, *SortCriterion]
+        for descending in (True, False)
+        for raw in (False, True)
+    ]
+
+async def load_exchanges_version() -> Optional[int]:
+    """
+    Читает текущую версию представлений из Redis
+    """
+    version = await redis_client.get(EXCHANGES_VERSION_KEY)
+    if version is not None:
+        # Через set_exchanges_version, чтобы подписчики потока получили изменения
+        set_exchanges_version(int(version))
+    return exchanges_version
+
+def set_exchanges_version(version: int):
+    """
+    Запоминает новую версию представлений (версии только растут)
+    """
+    global exchanges_version
+    if exchanges_version is None or version > exchanges_version:
+        exchanges_version = version
+        if exchange_broadcaster.subscribers:
+            spawn_background(exchange_broadcaster.update(version))
+
+async def get_exchanges_version() -> Optional[int]:
+    """
+    Возвращает известную процессу версию представлений, при необходимости читая ее из Redis
+    """
+    if exchanges_version is None:
+        return await load_exchanges_version()
+    return exchanges_version
+
+# Ключи сортировки по числовым полям записей (ID - это позиция в снапшоте)
+SORT_KEYS: Dict[SortCriterion, Callable[[int, ExchangeRecord], Any]] = {
+    SortCriterion.ID: lambda index, record: index,
+    SortCriterion.PRICE: lambda index, record: record.price,
+    SortCriterion.VOLUME: lambda index, record: record.volume,
+    SortCriterion.PLUS_DEPTH: lambda index, record: record.plus_depth,
+    SortCriterion.MINUS_DEPTH: lambda index, record: record.minus_depth,
+    SortCriterion.EXCHANGE: lambda index, record: record.exchange.lower(),
+    SortCriterion.VOLUME_PERCENTAGE: lambda index, record: record.volume_percentage,
+}
+
+def sort_order(records: List[ExchangeRecord], sort_by: Optional[SortCriterion],
+               descending: bool) -> List[int]:
+    """
+    Возвращает перестановку индексов записей для заданной сортировки;
+    без критерия - по объему торгов, по убыванию
+    """
+    if sort_by is None:
+        sort_by, descending = SortCriterion.VOLUME, True
+    key = SORT_KEYS[sort_by]
+    with request_stage("sort"):
+        order = sorted(range(len(records)), key=lambda i: key(i, records[i]))
+    if descending:
+        order.reverse()
+    return order
+
+def sort_exchange_records(records: List[ExchangeRecord], sort_by: Optional[SortCriterion],
+                          descending: bool) -> List[ExchangeRecord]:
+    """
+    Сортирует записи бирж
+    """
+    return [records[i] for i in sort_order(records, sort_by, descending)]
+
+def render_exchanges(records: List[ExchangeRecord], raw: bool) -> List[dict]:
+    """
+    Форматирует записи для ответа API; ID соответствуют порядку в списке
+    """
+    if raw:
+        return [record.to_raw(i) for i, record in enumerate(records, start=1)]
+    return [record.to_display(i) for i, record in enumerate(records, start=1)]
+
+def materialize_sort_views(records: List[ExchangeRecord], as_of: Optional[str], version: int) -> Dict[str, bytes]:
+    """
+    Строит все отсортированные представления снапшота за один проход:
+    каждая запись форматируется один раз, а для каждого критерия считается
+    одна перестановка индексов (по убыванию - та же, в обратном порядке).
+    Возвращает готовые к записи в Redis значения по ключам кэша.
+    """
+    rendered = {
+        False: [record.to_display() for record in records],
+        True: [record.to_raw() for record in records],
+    }
+    views = {}
+    for sort_by in [None, *SortCriterion]:
+        ascending_order = sort_order(records, sort_by or SortCriterion.VOLUME, False)
+        for descending in (True, False):
+            if sort_by is None:
+                # По умолчанию порядок всегда по убыванию объема
+                order = ascending_order[::-1]
+            else:
+                order = ascending_order[::-1] if descending else ascending_order
+            for raw, rows in rendered.items():
+                views[exchanges_sort_cache_key(version, sort_by, descending, raw)] = orjson.dumps({
+                    'status': 'success',
+                    'data': [{**rows[i], 'id': position} for position, i in enumerate(order, start=1)],
+                    'asOf': as_of,
+                    'version': version
+                })
+    return views
+
+async def load_exchange_snapshot() -> dict:
+    """
+    Читает последний снапшот бирж из Redis, при его отсутствии ждет первое обновление
+    """
+    # Базовые данные обновляет фоновая задача, здесь только читаем последний снапшот
+    base_cached_data = await redis_client.get(EXCHANGES_BASE_CACHE_KEY)
+    if not base_cached_data:
+        # Снапшота еще нет (например, сразу после старта) - ждем первое обновление,
+        # которое может выполнить любой процесс
+        logger.info("CACHE MISS: Базовые данные не найдены в кэше Redis, ждем фоновое обновление")
+        base_cached_data = await single_flight(
+            f"wait:{EXCHANGES_BASE_CACHE_KEY}",
+            lambda: wait_for_cache_value(EXCHANGES_BASE_CACHE_KEY, EXCHANGES_SNAPSHOT_WAIT_TIMEOUT)
+        )
+        if not base_cached_data:
+            raise HTTPException(status_code=503, detail="Данные о биржах еще не загружены, попробуйте позже")
+    return orjson.loads(base_cached_data)
+
+def exchanges_records_key(version: int) -> str:
+    """
+    Ключ с записями бирж (уже объединенными с пользовательскими) одной версии
+    """
+    return f"ltc_exchanges_records:v{version}"
+
+def exchanges_page_cache_key(version: Optional[int], sort_by: Optional[SortCriterion], descending: bool, raw: bool,
+                             offset: int, limit: Optional[int], fields: List[str]) -> str:
+    return f"ltc_exchanges_page:v{version}:{sort_by}:{descending}:{raw}:{offset}:{limit}:{','.join(fields)}"
+
+def parse_exchange_fields(fields: Optional[str]) -> List[str]:
+    """
+    Разбирает параметр fields= и возвращает поля в порядке EXCHANGE_FIELDS
+    """
+    if not fields:
+        return []
+    requested = {field.strip() for field in fields.split(',') if field.strip()}
+    unknown = requested - set(EXCHANGE_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400,
+                            detail=f"Неизвестные поля: {', '.join(sorted(unknown))}. Доступны: {', '.join(EXCHANGE_FIELDS)}")
+    return [field for field in EXCHANGE_FIELDS if field in requested]
+
+def select_order(records: List[ExchangeRecord], sort_by: Optional[SortCriterion], descending: bool,
+                 count: int) -> List[int]:
+    """
+    Возвращает индексы первых count записей в порядке сортировки.
+    Если нужна только часть списка, используется частичный выбор через кучу (O(n log k))
+    вместо полной сортировки; порядок совпадает с sort_order, в том числе для равных значений.
+    """
+    if count >= len(records):
+        return sort_order(records, sort_by, descending)
+    if sort_by is None:
+        sort_by, descending = SortCriterion.VOLUME, True
+    key = SORT_KEYS[sort_by]
+    # Индекс в ключе повторяет порядок равных значений у развернутой стабильной сортировки
+    select = heapq.nlargest if descending else heapq.nsmallest
+    with request_stage("sort"):
+        return select(count, range(len(records)), key=lambda i: (key(i, records[i]), i))
+
+def snapshot_fresh_until(snapshot: dict) -> float:
+    """
+    До какого времени снапшот считается свежим: до его планового обновления
+    """
+    return snapshot.get('refreshedAt', time.time()) + EXCHANGES_REFRESH_INTERVAL
+
+async def read_exchange_records(version: int) -> Optional[tuple]:
+    """
+    Читает записи бирж, сохраненные при публикации версии: (записи, asOf, время свежести)
+    """
+    cached = await redis_client.get(exchanges_records_key(version))
+    if not cached:
+        return None
+    with request_stage("transform"):
+        data = orjson.loads(cached)
+        records = [ExchangeRecord.from_dict(item) for item in data['records']]
+    return records, data.get('asOf'), data['freshUntil']
+
+async def load_exchange_records(version: Optional[int]):
+    """
+    Читает записи бирж заданной версии; если их нет, собирает из снапшота
+    и локальной копии пользовательских бирж.
+    Возвращает (записи, asOf, время свежести).
+    """
+    if version is not None:
+        stored = await read_exchange_records(version)
+        if stored is not None:
+            return stored
+    snapshot = await load_exchange_snapshot()
+    with request_stage("transform"):
+        upstream = [ExchangeRecord.from_dict(item) for item in snapshot.get('upstream', [])]
+    return await merge_custom_exchanges(upstream), snapshot.get('asOf'), snapshot_fresh_until(snapshot)
+
+async def get_exchange_records(version: Optional[int]):
+    """
+    Возвращает записи бирж версии из локального кэша процесса, загружая их один раз на версию
+    """
+    if version is None or exchange_records_cache['version'] != version:
+        loaded = await single_flight(
+            f"records:{version}",
+            lambda: load_exchange_records(version)
+        )
+        if version is not None:
+            exchange_records_cache.update(version=version, loaded=loaded)
+        return loaded
+    return exchange_records_cache['loaded']
+
+async def build_exchanges_page(version: Optional[int], sort_by: Optional[SortCriterion], descending: bool,
+                               raw: bool, offset: int, limit: Optional[int], fields: List[str]) -> Dict[str, Any]:
+    """
+    Строит страницу списка бирж: частичный выбор, форматирование и проекция
+    только возвращаемых записей
+    """
+    records, as_of, fresh_until = await get_exchange_records(version)
+    total = len(records)
+    end = total if limit is None else min(total, offset + limit)
+    order = select_order(records, sort_by, descending, end)[offset:end]
+    with request_stage("transform"):
+        rows = []
+        for position, i in enumerate(order, start=offset + 1):
+            row = records[i].to_raw(position) if raw else records[i].to_display(position)
+            if fields:
+                row = {field: row[field] for field in fields}
+            rows.append(row)
+    with request_stage("serialize"):
+        body = orjson.dumps({
+            'status': 'success',
+            'data': rows,
+            'asOf': as_of,
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'version': version
+        })
+    return encode_payload(body, fresh_until, time.time() + CACHE_TTL)
+
+async def build_and_store_exchanges_page(version: Optional[int], page_cache_key: str, *args) -> Dict[str, Any]:
+    """
+    Строит страницу и сохраняет ее в кэш под версией (если версия известна)
+    """
+    payload = await build_exchanges_page(version, *args)
+    if version is not None:
         try:
-            redis_client.setex(sort_cache_key, CACHE_TTL, json.dumps(result, default=lambda o: o.__dict__))
-            print(f"DEBUG: Отсортированные данные успешно сохранены в кэш Redis")
+            await write_payload(page_cache_key, payload, CACHE_TTL)
         except Exception as cache_error:
-            print(f"DEBUG: Ошибка при сохранении отсортированных данных в кэш: {str(cache_error)}")
-        
-        return result
+            logger.warning("Ошибка при сохранении страницы в кэш: %s", cache_error)
+    return payload
+
+async def get_exchanges_page(request: Request, encoding: Optional[str], sort_by: Optional[SortCriterion],
+                             descending: bool, raw: bool, limit: Optional[int], offset: int,
+                             top: Optional[int], fields: Optional[str]) -> Response:
+    """
+    Постраничный вывод с проекцией полей. Готовые страницы кэшируются в Redis
+    под текущей версией и отдаются без повторной сериализации.
+    """
+    if top is not None:
+        limit, offset = top, 0
+    selected_fields = parse_exchange_fields(fields)
+    version = await get_exchanges_version()
+    page_cache_key = exchanges_page_cache_key(version, sort_by, descending, raw, offset, limit, selected_fields)
+    if version is not None:
+        payload = await read_payload(page_cache_key, encoding)
+        if payload is not None:
+            CACHE_REQUESTS.labels("exchanges_page", "hit").inc()
+            return payload_response(payload, request, encoding)
+    
+    CACHE_REQUESTS.labels("exchanges_page", "miss").inc()
+    payload = await single_flight(
+        page_cache_key,
+        lambda: build_and_store_exchanges_page(version, page_cache_key, sort_by, descending, raw,
+                                               offset, limit, selected_fields)
+    )
+    return payload_response(payload, request, encoding)
+
+# Поток обновлений таблицы бирж (/api/ltc-exchanges/stream и /api/ltc-exchanges/ws):
+# подписчик получает таблицу целиком, затем только изменения полей по биржам.
+# Каждое сообщение кодируется один раз и раскладывается по очередям подписчиков.
+EXCHANGES_STREAM_QUEUE_SIZE = 16        # сообщений в очереди подписчика до пересинхронизации
+EXCHANGES_STREAM_KEEPALIVE = 15.0       # пауза, после которой SSE отправляет комментарий-пинг
+
+def exchange_rows(records: List[ExchangeRecord], raw: bool = False) -> Dict[str, dict]:
+    """
+    Строки таблицы по ключу биржи в порядке по умолчанию (по объему).
+    ID (позиция) не входит в строку, чтобы сдвиг позиций не выглядел изменением всех бирж.
+    """
+    rows = {}
+    for i in sort_order(records, None, True):
+        record = records[i]
+        row = record.to_raw() if raw else record.to_display()
+        del row['id']
+        key = record.exchange
+        suffix = 2
+        while key in rows:
+            # Одинаковые названия (например, пользовательская биржа) различаем номером
+            key = f"{record.exchange}#{suffix}"
+            suffix += 1
+        rows[key] = row
+    return rows
+
+def diff_exchange_rows(old_rows: Dict[str, dict], new_rows: Dict[str, dict]) -> Dict[str, Any]:
+    """
+    Изменения между двумя состояниями таблицы: добавленные строки, ключи удаленных
+    и для остальных - только изменившиеся поля
+    """
+    changed = {}
+    for key, row in new_rows.items():
+        old_row = old_rows.get(key)
+        if old_row is None:
+            continue
+        fields = {field: value for field, value in row.items() if old_row.get(field) != value}
+        if fields:
+            changed[key] = fields
+    return {
+        'added': {key: row for key, row in new_rows.items() if key not in old_rows},
+        'removed': [key for key in old_rows if key not in new_rows],
+        'changed': changed
+    }
+
+def encode_stream_message(event: str, message: dict) -> tuple:
+    """
+    Кодирует сообщение потока один раз для всех подписчиков: (текст JSON, кадр SSE)
+    """
+    text = orjson.dumps(message).decode()
+    return text, f"event: {event}\nid: {message.get('version')}\ndata: {text}\n\n".encode()
+
+class ExchangeStreamSubscriber:
+    __slots__ = ('queue', 'resync')
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EXCHANGES_STREAM_QUEUE_SIZE)
+        self.resync = False   # очередь переполнилась - следующим сообщением будет таблица целиком
+
+class ExchangeBroadcaster:
+    """
+    Рассылка изменений таблицы бирж подписчикам процесса.
+    При новой версии представлений сравнивает таблицу с предыдущей и рассылает
+    одно закодированное сообщение. Медленный подписчик не задерживает остальных:
+    при переполнении его очередь очищается, и он получает таблицу заново.
+    """
+    def __init__(self):
+        self.subscribers: Set[ExchangeStreamSubscriber] = set()
+        self.version: Optional[int] = None
+        self.as_of: Optional[str] = None
+        self.rows: Dict[str, dict] = {}
+        self._snapshot_message: Optional[tuple] = None
+        self._lock = asyncio.Lock()
+
+    async def update(self, version: Optional[int]):
+        """
+        Переходит на версию представлений и рассылает изменения относительно текущей
+        """
+        async with self._lock:
+            if version is None or (self.version is not None and version <= self.version):
+                return
+            records, as_of, _ = await get_exchange_records(version)
+            rows = exchange_rows(records)
+            previous_version = self.version
+            delta = diff_exchange_rows(self.rows, rows) if previous_version is not None else None
+            self.version, self.as_of, self.rows = version, as_of, rows
+            self._snapshot_message = None
+            if previous_version is None:
+                # Подписчики, пришедшие до первой версии, получили пустую таблицу:
+                # отправляем им таблицу целиком
+                self.resync_all()
+            elif delta['added'] or delta['removed'] or delta['changed']:
+                self.broadcast(encode_stream_message('delta', {
+                    'type': 'delta',
+                    'version': version,
+                    'asOf': as_of,
+                    **delta
+                }))
+
+    def snapshot(self) -> tuple:
+        """Таблица целиком в текущей версии (кодируется один раз на версию)"""
+        if self._snapshot_message is None:
+            self._snapshot_message = encode_stream_message('snapshot', {
+                'type': 'snapshot',
+                'version': self.version,
+                'asOf': self.as_of,
+                'data': self.rows
+            })
+        return self._snapshot_message
+
+    def broadcast(self, message: tuple):
+        for subscriber in self.subscribers:
+            if subscriber.resync:
+                continue
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Подписчик не успевает: пропущенные изменения заменит таблица целиком
+                self.resync(subscriber)
+
+    def resync(self, subscriber: ExchangeStreamSubscriber):
+        """Очищает очередь подписчика: следующим сообщением он получит таблицу целиком"""
+        subscriber.resync = True
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def resync_all(self):
+        for subscriber in self.subscribers:
+            if not subscriber.resync:
+                self.resync(subscriber)
+
+    def subscribe(self) -> ExchangeStreamSubscriber:
+        subscriber = ExchangeStreamSubscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: ExchangeStreamSubscriber):
+        self.subscribers.discard(subscriber)
+
+    async def next_message(self, subscriber: ExchangeStreamSubscriber) -> tuple:
+        message = await subscriber.queue.get()
+        if message is None:
+            subscriber.resync = False
+            return self.snapshot()
+        return message
+
+exchange_broadcaster = ExchangeBroadcaster()
+
+@app.get("/api/ltc-exchanges/stream", tags=["exchanges"])
+async def stream_ltc_exchanges(request: Request):
+    """
+    Поток Server-Sent Events с таблицей бирж: сначала событие snapshot
+    (строки по названию биржи), затем события delta с добавленными (added),
+    удаленными (removed) и изменившимися полями (changed) при каждой новой версии
+    """
+    await exchange_broadcaster.update(await get_exchanges_version())
+    subscriber = exchange_broadcaster.subscribe()
+    # Таблица берется сразу после подписки, поэтому изменения не теряются и не дублируются
+    first_message = exchange_broadcaster.snapshot()
+
+    async def events():
+        try:
+            yield first_message[1]
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(exchange_broadcaster.next_message(subscriber),
+                                                     EXCHANGES_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield message[1]
+        finally:
+            exchange_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.websocket("/api/ltc-exchanges/ws")
+async def websocket_ltc_exchanges(websocket: WebSocket):
+    """
+    То же, что /api/ltc-exchanges/stream, но через WebSocket: сообщения JSON с полем type
+    """
+    await websocket.accept()
+    await exchange_broadcaster.update(await get_exchanges_version())
+    subscriber = exchange_broadcaster.subscribe()
+    try:
+        await websocket.send_text(exchange_broadcaster.snapshot()[0])
+        while True:
+            message = await exchange_broadcaster.next_message(subscriber)
+            await websocket.send_text(message[0])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        exchange_broadcaster.unsubscribe(subscriber)
+
+async def merge_custom_exchanges(upstream: List[ExchangeRecord],
+                                 custom_exchanges: Optional[Dict[str, ExchangeRecord]] = None) -> List[ExchangeRecord]:
+    """
+    Добавляет пользовательские биржи к биржам из API; цены с процентной
+    корректировкой пересчитываются от текущей цены Binance.
+    Без custom_exchanges берется локальная копия процесса.
+    """
+    if custom_exchanges is None:
+        custom_exchanges = await get_custom_exchange_records()
+    logger.debug("Добавляем %d пользовательских бирж", len(custom_exchanges))
+    # Цена Binance одна на все биржи с процентной корректировкой
+    has_percent_prices = any(ex.price_percent is not None for ex in custom_exchanges.values())
+    binance_price = await get_binance_ltc_price() if has_percent_prices else 0
+    
+    records = list(upstream)
+    for custom_exchange in custom_exchanges.values():
+        # Копируем данные, чтобы избежать изменения оригинального объекта
+        exchange_copy = custom_exchange.copy()
+        # Обновляем цену для бирж с процентной корректировкой
+        if custom_exchange.price_percent is not None and binance_price > 0:
+            exchange_copy.price = binance_price * (1 + custom_exchange.price_percent / 100)
+        records.append(exchange_copy)
+    return records
+
+async def build_sorted_exchanges(sort_by: Optional[SortCriterion], descending: bool, raw: bool):
+    """
+    Строит отсортированный список бирж текущей версии и сохраняет его в кэш под ней.
+    Записи берутся из сохраненных при публикации версии; если их уже нет, список
+    собирается из снапшота и локальной копии пользовательских бирж и в кэш не пишется,
+    чтобы под версией не оказались данные, которых в ней не было.
+    """
+    version = await load_exchanges_version()
+    stored = await read_exchange_records(version) if version is not None else None
+    if stored is not None:
+        records, as_of, fresh_until = stored
+    else:
+        snapshot = await load_exchange_snapshot()
+        with request_stage("transform"):
+            upstream = [ExchangeRecord.from_dict(item) for item in snapshot.get('upstream', [])]
+        records = await merge_custom_exchanges(upstream)
+        as_of, fresh_until = snapshot.get('asOf'), snapshot_fresh_until(snapshot)
+    logger.debug("Загружено %d бирж версии %s для сортировки", len(records), version)
+    
+    records = sort_exchange_records(records, sort_by, descending)
+    logger.debug("Выполнена сортировка по критерию: %s, по убыванию: %s", sort_by, descending)
+    
+    with request_stage("transform"):
+        data = render_exchanges(records, raw)
+    with request_stage("serialize"):
+        body = orjson.dumps({
+            'status': 'success',
+            'data': data,
+            'asOf': as_of,
+            'version': version or 0
+        })
+    payload = encode_payload(body, fresh_until, time.time() + CACHE_TTL)
+    if stored is None:
+        return payload
+    
+    # Сохраняем отсортированные данные в кэш
+    sort_cache_key = exchanges_sort_cache_key(version, sort_by, descending, raw)
+    logger.debug("CACHE SET: Сохраняем отсортированные данные в Redis с ключом %s и TTL %d секунд", sort_cache_key, CACHE_TTL)
+    try:
+        await write_payload(sort_cache_key, payload, CACHE_TTL)
+    except Exception as cache_error:
+        logger.warning("Ошибка при сохранении отсортированных данных в кэш: %s", cache_error)
+    
+    return payload
+
+def exchanges_delta_key(version: int) -> str:
+    return f"ltc_exchanges_delta:v{version}"
+
+def build_exchanges_delta(previous_records: List[ExchangeRecord], records: List[ExchangeRecord],
+                          previous_version: int, version: int, as_of: Optional[str]) -> bytes:
+    """
+    Изменения по биржам от предыдущей версии к новой в обоих форматах (строковом и raw)
+    """
+    return orjson.dumps({
+        'from': previous_version,
+        'version': version,
+        'asOf': as_of,
+        'display': diff_exchange_rows(exchange_rows(previous_records), exchange_rows(records)),
+        'raw': diff_exchange_rows(exchange_rows(previous_records, True), exchange_rows(records, True))
+    })
+
+def compose_exchange_deltas(deltas: List[dict]) -> Dict[str, Any]:
+    """
+    Объединяет последовательные изменения в одно: added - строки целиком
+    (добавить или заменить), removed - удалить, changed - обновить поля
+    """
+    added: Dict[str, dict] = {}
+    removed: Dict[str, None] = {}
+    changed: Dict[str, dict] = {}
+    # Была ли строка в начале диапазона - по первому изменению, которое ее касается
+    existed: Dict[str, bool] = {}
+    for delta in deltas:
+        for key in delta['removed']:
+            existed.setdefault(key, True)
+            changed.pop(key, None)
+            added.pop(key, None)
+            if existed[key]:
+                removed[key] = None
+        for key, row in delta['added'].items():
+            existed.setdefault(key, False)
+            removed.pop(key, None)
+            changed.pop(key, None)
+            added[key] = dict(row)
+        for key, fields in delta['changed'].items():
+            existed.setdefault(key, True)
+            if key in added:
+                added[key].update(fields)
+            else:
+                changed.setdefault(key, {}).update(fields)
+    return {'added': added, 'removed': list(removed), 'changed': changed}
+
+async def load_exchanges_delta(since: int, raw: bool) -> Optional[bytes]:
+    """
+    Собирает ответ с изменениями от версии since до текущей.
+    None, если since уже выпала из кольца (или цепочка версий неполна) - тогда нужен полный ответ.
+    """
+    version = await get_exchanges_version()
+    if version is None or since > version or since < 0:
+        return None
+    deltas = []
+    if since < version:
+        ring = {int(item) for item in await redis_client.lrange(EXCHANGES_DELTA_RING_KEY, 0, -1)}
+        needed = sorted(v for v in ring if since < v <= version)
+        if not needed:
+            return None
+        expected_from = since
+        for v, value in zip(needed, await redis_client.mget([exchanges_delta_key(v) for v in needed])):
+            if value is None:
+                return None
+            delta = orjson.loads(value)
+            if delta['from'] != expected_from:
+                return None
+            deltas.append(delta['raw' if raw else 'display'])
+            expected_from = v
+        if expected_from != version:
+            return None
+    _, as_of, _ = await get_exchange_records(version)
+    return orjson.dumps({
+        'status': 'success',
+        'delta': True,
+        'since': since,
+        'version': version,
+        'asOf': as_of,
+        **compose_exchange_deltas(deltas)
+    })
+
+async def publish_exchange_views(upstream: List[ExchangeRecord], as_of: str, fresh_until: float,
+                                 snapshot_payload: Optional[bytes] = None) -> int:
+    """
+    Объединяет биржи из API с пользовательскими, строит все отсортированные
+    представления под новой версией и атомарно (MULTI/EXEC) переключает на нее
+    текущую версию. Представления предыдущей версии доживают EXCHANGES_OLD_VERSION_TTL
+    секунд, чтобы процессы, еще не узнавшие о новой версии, не попадали на холодный путь.
+    Вызывается под блокировкой lock:ltc_exchanges_base_data. Пользовательские биржи
+    перечитываются из Redis: локальная копия обновляется по pub/sub и может еще не знать
+    об изменении из другого процесса, которое тогда пропало бы из версии до следующего обновления.
+    """
+    records = await merge_custom_exchanges(upstream, await load_custom_exchanges())
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.incr(EXCHANGES_VERSION_SEQ_KEY)
+        pipe.get(EXCHANGES_VERSION_KEY)
+        version, previous_version = await pipe.execute()
+    sort_views = materialize_sort_views(records, as_of, version)
+    delta = None
+    if previous_version is not None:
+        previous_data = await redis_client.get(exchanges_records_key(int(previous_version)))
+        if previous_data:
+            previous_records = [ExchangeRecord.from_dict(item) for item in orjson.loads(previous_data)['records']]
+            delta = build_exchanges_delta(previous_records, records, int(previous_version), version, as_of)
+    # Сжатие всех представлений заметно дороже их сборки, поэтому выполняется вне цикла событий
+    expires_at = time.time() + EXCHANGES_SNAPSHOT_MAX_AGE
+    encoded_views = await asyncio.to_thread(
+        lambda: {key: encode_payload(body, fresh_until, expires_at) for key, body in sort_views.items()}
+    )
+    
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if snapshot_payload is not None:
+            pipe.setex(EXCHANGES_BASE_CACHE_KEY, EXCHANGES_SNAPSHOT_MAX_AGE, snapshot_payload)
+        for sort_cache_key, payload in encoded_views.items():
+            pipe.delete(sort_cache_key)
+            pipe.hset(sort_cache_key, mapping=payload)
+            pipe.expire(sort_cache_key, EXCHANGES_SNAPSHOT_MAX_AGE)
+        pipe.setex(exchanges_records_key(version), EXCHANGES_SNAPSHOT_MAX_AGE, orjson.dumps({
+            'asOf': as_of,
+            'freshUntil': fresh_until,
+            'records': [record.to_dict() for record in records]
+        }))
+        if delta is not None:
+            pipe.setex(exchanges_delta_key(version), EXCHANGES_SNAPSHOT_MAX_AGE, delta)
+            pipe.lpush(EXCHANGES_DELTA_RING_KEY, version)
+            pipe.ltrim(EXCHANGES_DELTA_RING_KEY, 0, EXCHANGES_DELTA_RING_SIZE - 1)
+        pipe.set(EXCHANGES_VERSION_KEY, version)
+        if previous_version is not None:
+            previous_version = int(previous_version)
+            for sort_cache_key in exchanges_view_keys(previous_version):
+                pipe.expire(sort_cache_key, EXCHANGES_OLD_VERSION_TTL)
+            pipe.expire(exchanges_records_key(previous_version), EXCHANGES_OLD_VERSION_TTL)
+        pipe.publish(EXCHANGES_VERSION_CHANNEL, version)
+        await pipe.execute()
+    set_exchanges_version(version)
+    logger.info("Опубликована версия %d (%d бирж, %d сортировок, asOf=%s)", version, len(records), len(sort_views), as_of)
+    return version
+
+# Время последнего известного процессу обновления снапшота (для метрики возраста)
+exchange_snapshot_state: Dict[str, Optional[float]] = {'refreshedAt': None}
+REFRESH_INTERVAL.labels("exchanges").set_function(
+    lambda: adaptive_interval("coingecko", EXCHANGES_REFRESH_INTERVAL)
+)
+SNAPSHOT_AGE.labels("exchanges").set_function(
+    lambda: time.time() - exchange_snapshot_state['refreshedAt']
+    if exchange_snapshot_state['refreshedAt'] is not None else math.nan
+)
+
+async def refresh_exchange_snapshot():
+    """
+    Получает свежие данные о биржах из API и сохраняет в Redis снапшот
+    вместе со всеми отсортированными вариантами.
+    """
+    started = time.monotonic()
+    as_of = format_timestamp(datetime.now(timezone.utc))
+    upstream = await fetch_exchange_data_from_api(as_of)
     
+    # В снапшоте только биржи из API: пользовательские добавляются при построении
+    # представлений, чтобы их изменения не требовали повторного запроса к CoinGecko
+    base_result = {
+        'status': 'success',
+        'asOf': as_of,
+        'refreshedAt': time.time(),
+        'refreshDuration': time.monotonic() - started,
+        'upstream': [exchange.to_dict() for exchange in upstream]
+    }
+    await publish_exchange_views(upstream, as_of, snapshot_fresh_until(base_result), orjson.dumps(base_result))
+    exchange_snapshot_state['refreshedAt'] = base_result['refreshedAt']
+
+async def rebuild_exchange_views():
+    """
+    Пересобирает представления после изменения пользовательских бирж:
+    новые данные объединяются с уже сохраненным снапшотом CoinGecko без повторного запроса.
+    """
+    lock = redis_client.lock(f"lock:{EXCHANGES_BASE_CACHE_KEY}", timeout=SINGLE_FLIGHT_LOCK_TTL,
+                             blocking_timeout=EXCHANGES_REBUILD_LOCK_TIMEOUT)
+    try:
+        if not await lock.acquire():
+            logger.warning("Снапшот обновляется слишком долго, изменения попадут в следующее обновление")
+            return
+        try:
+            base_cached_data = await redis_client.get(EXCHANGES_BASE_CACHE_KEY)
+            if not base_cached_data:
+                # Снапшота еще нет - его соберет фоновое обновление
+                return
+            snapshot = orjson.loads(base_cached_data)
+            if 'upstream' not in snapshot:
+                return
+            upstream = [ExchangeRecord.from_dict(item) for item in snapshot['upstream']]
+            await publish_exchange_views(upstream, snapshot['asOf'], snapshot_fresh_until(snapshot))
+        finally:
+            try:
+                await lock.release()
+            except redis.exceptions.LockError:
+                pass
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка при получении данных по LTC: {str(e)}")
+        logger.warning("Ошибка при пересборке представлений бирж: %s", e)
+
+async def exchange_snapshot_needs_refresh() -> bool:
+    """
+    Проверяет, пора ли обновлять снапшот бирж (с вероятностным ранним истечением)
+    """
+    base_cached_data = await redis_client.get(EXCHANGES_BASE_CACHE_KEY)
+    if not base_cached_data:
+        return True
+    snapshot = orjson.loads(base_cached_data)
+    if 'refreshedAt' not in snapshot or 'upstream' not in snapshot:
+        return True
+    exchange_snapshot_state['refreshedAt'] = snapshot['refreshedAt']
+    return should_refresh_early(snapshot['refreshedAt'], snapshot.get('refreshDuration', 0.0),
+                                adaptive_interval("coingecko", EXCHANGES_REFRESH_INTERVAL))
+
+async def refresh_exchange_snapshot_if_due():
+    """
+    Обновляет снапшот, если он устарел. Блокировка в Redis гарантирует,
+    что при нескольких воркерах CoinGecko опрашивает только один из них.
+    """
+    if not await exchange_snapshot_needs_refresh():
+        return
+    lock = redis_client.lock(f"lock:{EXCHANGES_BASE_CACHE_KEY}", timeout=SINGLE_FLIGHT_LOCK_TTL, blocking=False)
+    if not await lock.acquire():
+        # Снапшот уже обновляет другой процесс
+        return
+    try:
+        # Пока ждали блокировку, снапшот мог обновить другой процесс
+        if await exchange_snapshot_needs_refresh():
+            await refresh_exchange_snapshot()
+    finally:
+        try:
+            await lock.release()
+        except redis.exceptions.LockError:
+            pass
+
+async def exchange_snapshot_refresher():
+    """
+    Фоновая задача: обновляет снапшот бирж по расписанию, до истечения кэша,
+    чтобы запросы к /api/ltc-exchanges никогда не ждали ответа CoinGecko
+    """
+    while True:
+        try:
+            await single_flight(EXCHANGES_BASE_CACHE_KEY, refresh_exchange_snapshot_if_due)
+            delay = EXCHANGES_REFRESH_CHECK_INTERVAL
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Ошибка фонового обновления снапшота бирж: %s", e)
+            delay = EXCHANGES_REFRESH_RETRY_INTERVAL
+        await asyncio.sleep(delay)
+
+# Иконки бирж меняются редко: список бирж CoinGecko запрашивается не при каждом
+# обновлении снапшота, а раз в EXCHANGE_ICONS_REFRESH_INTERVAL и только при свободном бюджете
+EXCHANGE_ICONS_KEY = "coingecko_exchange_icons"
+EXCHANGE_ICONS_REFRESH_INTERVAL = 3600
+EXCHANGE_ICONS_MAX_AGE = 7 * 86400      # сколько хранить последний полученный список
+
+async def load_exchange_icons() -> Dict[str, Optional[str]]:
+    """
+    Возвращает иконки бирж по идентификатору CoinGecko: из Redis, а если список устарел -
+    запрашивает новый с приоритетом UPSTREAM_PRIORITY_ICONS. Без бюджета или при ошибке API
+    используется прежний список.
+    """
+    cached = await redis_client.get(EXCHANGE_ICONS_KEY)
+    stored = orjson.loads(cached) if cached else None
+    if stored is not None and time.time() - stored['fetchedAt'] < adaptive_interval(
+            "coingecko", EXCHANGE_ICONS_REFRESH_INTERVAL):
+        return stored['icons']
+    try:
+        with upstream_call_priority(UPSTREAM_PRIORITY_ICONS):
+            exchanges_response = await get_http_client("coingecko").get("/exchanges")
+        if exchanges_response.status_code == 200:
+            exchanges_data = exchanges_response.json()
+            logger.debug("Получено %d бирж из API exchanges", len(exchanges_data))
+            icons = {ex["id"]: ex.get("image") for ex in exchanges_data}
+            await redis_client.setex(EXCHANGE_ICONS_KEY, EXCHANGE_ICONS_MAX_AGE,
+                                     orjson.dumps({'fetchedAt': time.time(), 'icons': icons}))
+            return icons
+        logger.warning("Ошибка API exchanges: %s, %s", exchanges_response.status_code, exchanges_response.text[:200])
+    except UpstreamRateLimited:
+        logger.debug("Бюджет CoinGecko оставлен снапшоту, иконки берутся из прежнего списка")
+    return stored['icons'] if stored is not None else {}
 
 # Выделяем получение данных из API в отдельную функцию
-async def fetch_exchange_data_from_api():
+async def fetch_exchange_data_from_api(as_of: str) -> List[ExchangeRecord]:
     """
     Получает данные о биржах из API CoinGecko и обрабатывает их
+
+    - **as_of**: Время получения снапшота, записывается в lastUpdated бирж из API
     """
     # Получаем список бирж для сопоставления иконок
-    exchanges_response = requests.get("https://api.coingecko.com/api/v3/exchanges")
-    exchange_icon_mapping = {}
-    if exchanges_response.status_code == 200:
-        exchanges_data = exchanges_response.json()
-        print(f"DEBUG: Получено {len(exchanges_data)} бирж из API exchanges")
-        for ex in exchanges_data:
-            exchange_icon_mapping[ex["id"]] = ex.get("image")
-    else:
-        print(f"DEBUG: Ошибка API exchanges: {exchanges_response.status_code}, {exchanges_response.text[:200]}")
+    exchange_icon_mapping = await load_exchange_icons()
     
     # Хардкод иконок для бирж, которые отсутствуют в API или имеют проблемы с сопоставлением
     hardcoded_icons = {
@@ -364,16 +2338,19 @@ async def fetch_exchange_data_from_api():
     exchange_icon_mapping.update(hardcoded_icons)
     
     # Получаем данные о Litecoin с CoinGecko
-    response = requests.get('https://api.coingecko.com/api/v3/coins/litecoin/tickers')
+    response = await get_http_client("coingecko").get("/coins/litecoin/tickers")
+    if response.status_code in RATE_LIMIT_STATUSES:
+        raise UpstreamRateLimited("coingecko", parse_retry_after(response.headers.get('retry-after')))
     if response.status_code != 200:
-        print(f"DEBUG: Ошибка API tickers: {response.status_code}, {response.text[:200]}")
+        logger.warning("Ошибка API tickers: %s, %s", response.status_code, response.text[:200])
         raise HTTPException(status_code=response.status_code, 
                             detail=f"Ошибка API CoinGecko: {response.text}")
     
     data = response.json()
     exchanges = []
+    market_ids = []
     
-    print(f"DEBUG: Получено {len(data['tickers'])} тикеров, фильтруем по USDT")
+    logger.debug("Получено %d тикеров, фильтруем по USDT", len(data['tickers']))
     usdt_tickers_count = 0
     
     for ticker in data['tickers']:
@@ -382,7 +2359,8 @@ async def fetch_exchange_data_from_api():
             usdt_tickers_count += 1
             base_volume_usd = ticker['converted_volume'].get('usd', 0)
             
-            # Расчет значений глубины ордеров (примерные расчеты)
+            # Оценка глубины по объему; для бирж с коннектором книги ордеров
+            # она заменяется реальной глубиной ±2% (apply_order_book_depth)
             plus_two_percent_depth = math.floor(base_volume_usd * 0.06)
             minus_two_percent_depth = math.floor(base_volume_usd * 0.05)
             
@@ -396,62 +2374,28 @@ async def fetch_exchange_data_from_api():
             
             # Простая отладочная информация
             if icon_url:
-                print(f"DEBUG: Биржа '{exchange_name}' (id: {exchange_identifier}): иконка найдена")
+                log_sampled(logging.DEBUG, "Биржа '%s' (id: %s): иконка найдена", exchange_name, exchange_identifier)
             else:
-                print(f"DEBUG: ⚠️ Биржа '{exchange_name}' (id: {exchange_identifier}): иконка НЕ найдена!")
+                log_sampled(logging.DEBUG, "Биржа '%s' (id: %s): иконка НЕ найдена", exchange_name, exchange_identifier)
             
-            exchange_data = ExchangeData(
-                id=0,  # Временный ID, переназначим позже
+            exchange_data = ExchangeRecord(
                 exchange=exchange_name,
                 pair='LTC/USDT',
-                price=f"{float(ticker['last']):.4f}",
-                plusTwoPercentDepth=f"${plus_two_percent_depth:,}",
-                minusTwoPercentDepth=f"${minus_two_percent_depth:,}",
-                volume24h=f"${math.floor(base_volume_usd):,}",
-                volumePercentage=f"{ticker.get('bid_ask_spread_percentage', 1.0):.2f}%",
-                lastUpdated='Recently',
+                price=float(ticker['last']),
+                plus_depth=plus_two_percent_depth,
+                minus_depth=minus_two_percent_depth,
+                volume=base_volume_usd,
+                volume_percentage=ticker.get('bid_ask_spread_percentage', 1.0),
+                last_updated=as_of,
                 icon=icon_url
             )
             
             exchanges.append(exchange_data)
+            market_ids.append(exchange_identifier)
     
-    print(f"DEBUG: Обработано {usdt_tickers_count} USDT тикеров")
-    
-    # Добавляем пользовательские биржи к основному списку
-    custom_exchange_count = len(custom_exchanges)
-    print(f"DEBUG: Добавляем {custom_exchange_count} пользовательских бирж")
-    for custom_exchange in custom_exchanges.values():
-        # Обновляем цену для бирж с процентной корректировкой
-        if custom_exchange.price_percent is not None:
-            binance_price = await get_binance_ltc_price()
-            if binance_price > 0:
-                calculated_price = binance_price * (1 + custom_exchange.price_percent / 100)
-                price_str = f"{calculated_price:.4f}"
-            else:
-                price_str = custom_exchange.price
-        else:
-            price_str = custom_exchange.price
-        
-        # Копируем данные, чтобы избежать изменения оригинального объекта
-        exchange_copy = ExchangeData(
-            id=0,  # Временный ID, переназначим позже
-            exchange=custom_exchange.exchange,
-            pair=custom_exchange.pair,
-            price=price_str,  # Используем обновленную цену
-            price_percent=custom_exchange.price_percent,
-            plusTwoPercentDepth=custom_exchange.plusTwoPercentDepth,
-            minusTwoPercentDepth=custom_exchange.minusTwoPercentDepth,
-            volume24h=custom_exchange.volume24h,
-            volumePercentage=custom_exchange.volumePercentage,
-            lastUpdated=custom_exchange.lastUpdated,
-            icon=custom_exchange.icon
-        )
-        exchanges.append(exchange_copy)
-    
-    # Присваиваем начальные ID всем биржам
-    for i, exchange in enumerate(exchanges, start=1):
-        exchange.id = i
+    logger.debug("Обработано %d USDT тикеров", usdt_tickers_count)
     
+    await apply_order_book_depth(exchanges, market_ids)
     return exchanges
 
 @app.get("/api/ltc-exchanges-cmc", response_model=ExchangeResponse, tags=["exchanges"])
@@ -473,8 +2417,8 @@ async def get_ltc_exchanges_cmc():
             'convert': 'USD'
         }
         
-        response = requests.get(
-            'https://pro-api.coinmarketcap.com/v1/cryptocurrency/market-pairs/latest',
+        response = await get_http_client("coinmarketcap").get(
+            '/cryptocurrency/market-pairs/latest',
             headers=headers,
             params=params
         )
@@ -514,226 +2458,1394 @@ async def get_ltc_exchanges_cmc():
             'data': top_10_exchanges
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, 
                             detail=f"Ошибка при получении данных по LTC через CoinMarketCap: {str(e)}")
 
+# Книги ордеров бирж. Для каждой биржи свой коннектор: запрос к API и разбор
+# ответа в общий вид (OrderBook), поэтому глубину считает один код для всех бирж.
+ORDER_BOOK_TIMEOUT = 3.0        # таймаут получения книги с одной биржи, секунды
+ORDER_BOOK_MAX_AGE = 5.0        # сколько книга считается свежей в кэше процесса
+DEPTH_PERCENT = 2.0             # глубина считается в пределах ±2% от середины книги
+
+class OrderBook:
+    """
+    Книга ордеров в общем виде: массивы NumPy цен и количеств LTC,
+    bids по убыванию цены, asks по возрастанию. Накопленные суммы считаются
+    один раз при создании, поэтому глубина для любого набора полос и стоимость
+    исполнения находятся через searchsorted без обхода уровней.
+    """
+    __slots__ = ('exchange', 'bid_prices', 'bid_volumes', 'ask_prices', 'ask_volumes',
+                 'bid_notional', 'ask_notional', 'bid_volume_total', 'ask_volume_total',
+                 'fetched_at', 'updated_at')
+    source = "rest"
+
+    def __init__(self, exchange: str, bids: np.ndarray, asks: np.ndarray,
+                 updated_at: Optional[datetime] = None):
+        self.exchange = exchange
+        bids = np.asarray(bids, dtype=float).reshape(-1, 2)
+        asks = np.asarray(asks, dtype=float).reshape(-1, 2)
+        bids = bids[bids[:, 1] > 0]
+        asks = asks[asks[:, 1] > 0]
+        bids = bids[np.argsort(-bids[:, 0], kind='stable')]
+        asks = asks[np.argsort(asks[:, 0], kind='stable')]
+        self.bid_prices, self.bid_volumes = bids[:, 0], bids[:, 1]
+        self.ask_prices, self.ask_volumes = asks[:, 0], asks[:, 1]
+        # Накопленные объемы с нулем в начале: сумма первых k уровней - элемент k
+        self.bid_notional = np.concatenate(([0.0], np.cumsum(self.bid_prices * self.bid_volumes)))
+        self.ask_notional = np.concatenate(([0.0], np.cumsum(self.ask_prices * self.ask_volumes)))
+        self.bid_volume_total = np.concatenate(([0.0], np.cumsum(self.bid_volumes)))
+        self.ask_volume_total = np.concatenate(([0.0], np.cumsum(self.ask_volumes)))
+        self.fetched_at = time.monotonic()
+        self.updated_at = updated_at or datetime.now(timezone.utc)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def _check_not_empty(self):
+        if not len(self.bid_prices) or not len(self.ask_prices):
+            raise ValueError(f"Пустая книга ордеров {self.exchange}")
+
+    @property
+    def best_bid(self) -> float:
+        self._check_not_empty()
+        return float(self.bid_prices[0])
+
+    @property
+    def best_ask(self) -> float:
+        self._check_not_empty()
+        return float(self.ask_prices[0])
+
+    @property
+    def mid_price(self) -> float:
+        return (self.best_bid + self.best_ask) / 2
+
+    @property
+    def micro_price(self) -> float:
+        """Середина, взвешенная объемами лучших уровней: ближе к стороне с меньшим объемом"""
+        bid, ask = self.best_bid, self.best_ask
+        bid_volume, ask_volume = float(self.bid_volumes[0]), float(self.ask_volumes[0])
+        return (bid * ask_volume + ask * bid_volume) / (bid_volume + ask_volume)
+
+    def snapshot(self) -> 'OrderBook':
+        return self
+
+    def depth_bands(self, bands: List[float], reference: Optional[float] = None) -> tuple:
+        """
+        Объем в USDT в пределах каждой полосы ±percent% от reference (по умолчанию середина).
+        Возвращает массивы (плюс, минус) в порядке bands.
+        """
+        if reference is None:
+            reference = self.mid_price
+        percents = np.asarray(bands, dtype=float) / 100
+        ask_count = np.searchsorted(self.ask_prices, reference * (1 + percents), side='right')
+        # bids по убыванию: для searchsorted берем цены с обратным знаком
+        bid_count = np.searchsorted(-self.bid_prices, -reference * (1 - percents), side='right')
+        return self.ask_notional[ask_count], self.bid_notional[bid_count]
+
+    def depth(self, percent: float = DEPTH_PERCENT) -> tuple:
+        """
+        Объем в USDT (плюс, минус): asks до mid*(1+percent%) и bids до mid*(1-percent%)
+        """
+        plus_depth, minus_depth = self.depth_bands([percent])
+        return float(plus_depth[0]), float(minus_depth[0])
+
+    def fill(self, notional: float, side: str, reference: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Исполнение рыночной заявки на notional USDT: buy - по asks, sell - по bids.
+        Возвращает исполненный объем, среднюю цену, проскальзывание от reference
+        и его стоимость в USDT. Если книги не хватает, заявка исполняется частично.
+        """
+        if reference is None:
+            reference = self.mid_price
+        if side == 'buy':
+            prices, cumulative, volumes = self.ask_prices, self.ask_notional, self.ask_volume_total
+        else:
+            prices, cumulative, volumes = self.bid_prices, self.bid_notional, self.bid_volume_total
+        # Число полностью исполненных уровней и остаток на следующем
+        full_levels = int(np.searchsorted(cumulative, notional, side='right')) - 1
+        if full_levels >= len(prices):
+            filled = float(cumulative[-1])
+            volume = float(volumes[-1])
+        else:
+            filled = notional
+            volume = float(volumes[full_levels]) + (notional - float(cumulative[full_levels])) / float(prices[full_levels])
+        average_price = filled / volume if volume else None
+        if average_price is None:
+            slippage = cost = None
+        elif side == 'buy':
+            slippage = (average_price / reference - 1) * 100
+            cost = filled - volume * reference
+        else:
+            slippage = (1 - average_price / reference) * 100
+            cost = volume * reference - filled
+        return {
+            'side': side,
+            'notional': notional,
+            'filledNotional': filled,
+            'volume': volume,
+            'averagePrice': average_price,
+            'slippagePercent': slippage,
+            'cost': cost
+        }
+
+def parse_levels(levels: list) -> np.ndarray:
+    """Уровни книги вида [цена, количество, ...] (строки или числа) - массив (n, 2)"""
+    return np.array([level[:2] for level in levels], dtype=float).reshape(-1, 2)
+
+def parse_binance_book(data: dict) -> tuple:
+    # Binance и MEXC: {"bids": [["цена", "кол-во"], ...], "asks": [...]}
+    return parse_levels(data['bids']), parse_levels(data['asks'])
+
+def parse_okx_book(data: dict) -> tuple:
+    if data.get('code') != '0':
+        raise ValueError(f"Ошибка API OKX: {data.get('msg')}")
+    book = data['data'][0]
+    return parse_levels(book['bids']), parse_levels(book['asks'])
+
+def parse_bybit_book(data: dict) -> tuple:
+    if data.get('retCode') != 0:
+        raise ValueError(f"Ошибка API Bybit: {data.get('retMsg')}")
+    return parse_levels(data['result']['b']), parse_levels(data['result']['a'])
+
+def parse_kraken_book(data: dict) -> tuple:
+    if data.get('error'):
+        raise ValueError(f"Ошибка API Kraken: {', '.join(data['error'])}")
+    # Ключ результата - внутреннее имя пары Kraken, оно может отличаться от запрошенного
+    book = next(iter(data['result'].values()))
+    return parse_levels(book['bids']), parse_levels(book['asks'])
+
+def parse_kucoin_book(data: dict) -> tuple:
+    if data.get('code') != '200000':
+        raise ValueError(f"Ошибка API KuCoin: {data.get('msg')}")
+    return parse_levels(data['data']['bids']), parse_levels(data['data']['asks'])
+
+def parse_htx_book(data: dict) -> tuple:
+    if data.get('status') != 'ok':
+        raise ValueError(f"Ошибка API HTX: {data.get('err-msg')}")
+    return parse_levels(data['tick']['bids']), parse_levels(data['tick']['asks'])
+
+class OrderBookConnector:
+    """
+    Коннектор книги ордеров LTC/USDT одной биржи.
+    Разбор ответа (parse) не делает запросов, поэтому проверяется на сохраненных
+    ответах API, а сам запрос - на локальной заглушке через <UPSTREAM>_BASE_URL.
+
+    - **name**: Ключ биржи в /api/ltc-depth
+    - **upstream**: Ключ пула соединений в UPSTREAMS
+    - **market_ids**: Идентификаторы биржи в CoinGecko (market.identifier)
+    """
+    def __init__(self, name: str, title: str, upstream: str, path: str, params: Dict[str, Any],
+                 parse: Callable[[dict], tuple], market_ids: tuple = ()):
+        self.name = name
+        self.title = title
+        self.upstream = upstream
+        self.path = path
+        self.params = params
+        self.parse = parse
+        self.market_ids = market_ids
+
+    async def fetch(self) -> OrderBook:
+        response = await get_http_client(self.upstream).get(self.path, params=self.params)
+        if response.status_code != 200:
+            raise HTTPException(status_code=502,
+                                detail=f"Ошибка API {self.title}: {response.status_code} {response.text[:200]}")
+        bids, asks = self.parse(response.json())
+        return OrderBook(self.name, bids, asks)
+
+# Реестр коннекторов: ключ биржи -> коннектор
+ORDER_BOOK_CONNECTORS: Dict[str, OrderBookConnector] = {}
+
+def register_order_book_connector(connector: OrderBookConnector):
+    ORDER_BOOK_CONNECTORS[connector.name] = connector
+
+for connector in (
+    OrderBookConnector("binance", "Binance", "binance", "/depth",
+                       {'symbol': 'LTCUSDT', 'limit': 500}, parse_binance_book, ("binance",)),
+    OrderBookConnector("okx", "OKX", "okx", "/market/books",
+                       {'instId': 'LTC-USDT', 'sz': 400}, parse_okx_book, ("okex",)),
+    OrderBookConnector("bybit", "Bybit", "bybit", "/market/orderbook",
+                       {'category': 'spot', 'symbol': 'LTCUSDT', 'limit': 200}, parse_bybit_book, ("bybit_spot",)),
+    OrderBookConnector("kraken", "Kraken", "kraken", "/Depth",
+                       {'pair': 'LTCUSDT', 'count': 500}, parse_kraken_book, ("kraken",)),
+    OrderBookConnector("kucoin", "KuCoin", "kucoin", "/market/orderbook/level2_100",
+                       {'symbol': 'LTC-USDT'}, parse_kucoin_book, ("kucoin",)),
+    OrderBookConnector("gate", "Gate", "gate", "/spot/order_book",
+                       {'currency_pair': 'LTC_USDT', 'limit': 100}, parse_binance_book, ("gate",)),
+    OrderBookConnector("htx", "HTX", "htx", "/market/depth",
+                       {'symbol': 'ltcusdt', 'type': 'step0'}, parse_htx_book, ("huobi",)),
+    OrderBookConnector("mexc", "MEXC", "mexc", "/depth",
+                       {'symbol': 'LTCUSDT', 'limit': 500}, parse_binance_book, ("mxc",)),
+):
+    register_order_book_connector(connector)
+
+def find_order_book_connector(name: Optional[str]) -> Optional[OrderBookConnector]:
+    """
+    Ищет коннектор по ключу, названию биржи или ее идентификатору в CoinGecko
+    """
+    if not name:
+        return None
+    name = name.strip().lower()
+    connector = ORDER_BOOK_CONNECTORS.get(name)
+    if connector is not None:
+        return connector
+    for connector in ORDER_BOOK_CONNECTORS.values():
+        if name == connector.title.lower() or name in connector.market_ids:
+            return connector
+    return None
+
+class OrderBookGap(Exception):
+    """Пропуск в последовательности обновлений книги ордеров - нужна пересинхронизация"""
+
+# Локальная книга ордеров по потоку изменений (сейчас - Binance).
+# Включается переменной окружения BINANCE_DEPTH_STREAM=1; без нее глубина берется из REST.
+BINANCE_DEPTH_STREAM = os.getenv("BINANCE_DEPTH_STREAM", "0") == "1"
+BINANCE_DEPTH_STREAM_URL = os.getenv("BINANCE_DEPTH_STREAM_URL",
+                                     "wss://stream.binance.com:9443/ws/ltcusdt@depth@100ms")
+BINANCE_DEPTH_SNAPSHOT_LIMIT = 1000     # уровней в снимке, с которого начинается книга
+LOCAL_ORDER_BOOK_MAX_SILENCE = 10.0     # книга без обновлений дольше - не используется
+LOCAL_ORDER_BOOK_RETRY_INTERVAL = 5.0   # пауза перед переподключением после ошибки
+LOCAL_ORDER_BOOK_RECOMPUTE_EVERY = 1000 # полный пересчет сумм раз в N обновлений (ошибка float)
+
+class LocalOrderBook:
+    """
+    Книга ордеров, которая ведется по снимку и последовательным изменениям.
+    Уровни хранятся в словарях цена -> количество и в отсортированных списках цен.
+    Объем в пределах ±percent% от середины обновляется инкрементально:
+    на каждое изменение уровня внутри полосы и на сдвиг ее границ при движении середины,
+    поэтому чтение глубины не требует обхода книги.
+    """
+    source = "stream"
+
+    def __init__(self, exchange: str, percent: float = DEPTH_PERCENT):
+        self.exchange = exchange
+        self.percent = percent
+        self.bid_levels: Dict[float, float] = {}
+        self.ask_levels: Dict[float, float] = {}
+        self.bid_prices: List[float] = []   # по возрастанию, лучшая цена - последняя
+        self.ask_prices: List[float] = []   # по возрастанию, лучшая цена - первая
+        self.last_update_id: Optional[int] = None
+        self.synced = False
+        self.fetched_at: Optional[float] = None    # time.monotonic() последнего обновления
+        self.updated_at: Optional[datetime] = None
+        self.plus_depth = 0.0
+        self.minus_depth = 0.0
+        self.upper = 0.0    # asks с ценой <= upper входят в plus_depth
+        self.lower = 0.0    # bids с ценой >= lower входят в minus_depth
+        self._banded = False    # есть ли полоса: без одной из сторон нет середины и границ
+        self.updates = 0
+        self._bridged = False   # применено ли первое изменение после снимка
+        self._snapshot: Optional[OrderBook] = None
+        self._snapshot_updates = -1
+
+    @property
+    def age(self) -> float:
+        if self.fetched_at is None:
+            return math.inf
+        return time.monotonic() - self.fetched_at
+
+    @property
+    def best_bid(self) -> float:
+        return self.bid_prices[-1]
+
+    @property
+    def best_ask(self) -> float:
+        return self.ask_prices[0]
+
+    @property
+    def mid_price(self) -> float:
+        if not self.bid_prices or not self.ask_prices:
+            raise ValueError(f"Пустая книга ордеров {self.exchange}")
+        return (self.bid_prices[-1] + self.ask_prices[0]) / 2
+
+    @property
+    def micro_price(self) -> float:
+        bid, ask = self.best_bid, self.best_ask
+        bid_volume, ask_volume = self.bid_levels[bid], self.ask_levels[ask]
+        return (bid * ask_volume + ask * bid_volume) / (bid_volume + ask_volume)
+
+    def snapshot(self) -> OrderBook:
+        """
+        Снимок книги в массивах для полос и стоимости исполнения;
+        строится не чаще одного раза на обновление
+        """
+        if self._snapshot is None or self._snapshot_updates != self.updates:
+            self._snapshot = OrderBook(
+                self.exchange,
+                np.fromiter(((price, self.bid_levels[price]) for price in self.bid_prices),
+                            dtype=np.dtype((float, 2)), count=len(self.bid_prices)),
+                np.fromiter(((price, self.ask_levels[price]) for price in self.ask_prices),
+                            dtype=np.dtype((float, 2)), count=len(self.ask_prices)),
+                self.updated_at
+            )
+            self._snapshot_updates = self.updates
+        return self._snapshot
+
+    def load_snapshot(self, bids: np.ndarray, asks: np.ndarray, last_update_id: int):
+        self.bid_levels = {price: volume for price, volume in np.asarray(bids, dtype=float).tolist() if volume > 0}
+        self.ask_levels = {price: volume for price, volume in np.asarray(asks, dtype=float).tolist() if volume > 0}
+        self.bid_prices = sorted(self.bid_levels)
+        self.ask_prices = sorted(self.ask_levels)
+        self.last_update_id = last_update_id
+        self._bridged = False
+        self._snapshot = None
+        self.synced = True
+        self._touch(None)
+        self._recompute()
+
+    def apply_diff(self, event: dict) -> bool:
+        """
+        Применяет изменение потока (поля U, u, b, a как у Binance depthUpdate).
+        Возвращает False для устаревших изменений; при пропуске бросает OrderBookGap.
+        """
+        first_id, last_id = event['U'], event['u']
+        if last_id <= self.last_update_id:
+            return False
+        expected = self.last_update_id + 1
+        if first_id > expected or (self._bridged and first_id != expected):
+            self.synced = False
+            raise OrderBookGap(f"Пропуск обновлений книги {self.exchange}: ожидалось {expected}, пришло {first_id}")
+        for price, volume in event['b']:
+            self._set_level(self.bid_levels, self.bid_prices, float(price), float(volume), False)
+        for price, volume in event['a']:
+            self._set_level(self.ask_levels, self.ask_prices, float(price), float(volume), True)
+        self.last_update_id = last_id
+        self._bridged = True
+        self._touch(event.get('E'))
+        self.updates += 1
+        if self.updates % LOCAL_ORDER_BOOK_RECOMPUTE_EVERY == 0 or not self._banded:
+            # Без полосы изменения не учитывались: суммы считаются заново, как только есть обе стороны
+            self._recompute()
+        else:
+            self._move_bounds()
+        return True
+
+    def depth(self, percent: float = DEPTH_PERCENT) -> tuple:
+        """
+        Объем в USDT (плюс, минус); для полосы книги - готовые суммы, для другой - по снимку
+        """
+        if percent == self.percent:
+            return self.plus_depth, self.minus_depth
+        return self.snapshot().depth(percent)
+
+    def _touch(self, event_time_ms: Optional[int]):
+        self.fetched_at = time.monotonic()
+        if event_time_ms:
+            self.updated_at = datetime.fromtimestamp(event_time_ms / 1000, timezone.utc)
+        else:
+            self.updated_at = datetime.now(timezone.utc)
+
+    def _sum_asks(self, start: int, end: int) -> float:
+        return sum(price * self.ask_levels[price] for price in self.ask_prices[start:end])
+
+    def _sum_bids(self, start: int, end: int) -> float:
+        return sum(price * self.bid_levels[price] for price in self.bid_prices[start:end])
+
+    def _set_level(self, levels: Dict[float, float], prices: List[float], price: float, volume: float, is_ask: bool):
+        previous = levels.get(price, 0.0)
+        if volume == 0:
+            if not previous:
+                return
+            del levels[price]
+            prices.pop(bisect.bisect_left(prices, price))
+        else:
+            if not previous:
+                bisect.insort(prices, price)
+            levels[price] = volume
+        if not self._banded:
+            return
+        if is_ask:
+            if price <= self.upper:
+                self.plus_depth += price * (volume - previous)
+        elif price >= self.lower:
+            self.minus_depth += price * (volume - previous)
+
+    def _recompute(self):
+        if not self.bid_prices or not self.ask_prices:
+            self.plus_depth = self.minus_depth = self.upper = self.lower = 0.0
+            self._banded = False
+            return
+        self._banded = True
+        mid = self.mid_price
+        self.upper = mid * (1 + self.percent / 100)
+        self.lower = mid * (1 - self.percent / 100)
+        self.plus_depth = self._sum_asks(0, bisect.bisect_right(self.ask_prices, self.upper))
+        self.minus_depth = self._sum_bids(bisect.bisect_left(self.bid_prices, self.lower), len(self.bid_prices))
+
+    def _move_bounds(self):
+        """Сдвигает границы полосы за серединой, добавляя и вычитая только пересеченные уровни"""
+        if not self.bid_prices or not self.ask_prices:
+            self._recompute()
+            return
+        mid = self.mid_price
+        upper = mid * (1 + self.percent / 100)
+        lower = mid * (1 - self.percent / 100)
+        old_end = bisect.bisect_right(self.ask_prices, self.upper)
+        new_end = bisect.bisect_right(self.ask_prices, upper)
+        if new_end > old_end:
+            self.plus_depth += self._sum_asks(old_end, new_end)
+        elif new_end < old_end:
+            self.plus_depth -= self._sum_asks(new_end, old_end)
+        old_start = bisect.bisect_left(self.bid_prices, self.lower)
+        new_start = bisect.bisect_left(self.bid_prices, lower)
+        if new_start < old_start:
+            self.minus_depth += self._sum_bids(new_start, old_start)
+        elif new_start > old_start:
+            self.minus_depth -= self._sum_bids(old_start, new_start)
+        self.upper = upper
+        self.lower = lower
+
+# Локальные книги по ключу биржи; get_order_book отдает их вместо REST, пока они синхронизированы
+live_order_books: Dict[str, LocalOrderBook] = {}
+
+async def binance_depth_stream() -> AsyncIterator[dict]:
+    """
+    Поток изменений книги LTCUSDT из WebSocket Binance
+    """
+    import websockets  # нужен только в режиме BINANCE_DEPTH_STREAM
+    async with websockets.connect(BINANCE_DEPTH_STREAM_URL, ping_interval=20) as websocket:
+        async for message in websocket:
+            yield orjson.loads(message)
+
+async def replay_depth_feed(events: Iterable, delay: float = 0.0) -> AsyncIterator[dict]:
+    """
+    Поток изменений из записанных событий (словари или строки JSON, например строки файла) -
+    заменяет WebSocket в тестах и при отладке
+    """
+    for event in events:
+        if isinstance(event, (str, bytes)):
+            event = orjson.loads(event)
+        yield event
+        await asyncio.sleep(delay)
+
+async def fetch_binance_depth_snapshot() -> tuple:
+    """
+    Снимок книги LTCUSDT из REST API Binance: (bids, asks, lastUpdateId)
+    """
+    response = await get_http_client("binance").get('/depth', params={
+        'symbol': 'LTCUSDT',
+        'limit': BINANCE_DEPTH_SNAPSHOT_LIMIT
+    })
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Ошибка API Binance: {response.text[:200]}")
+    data = response.json()
+    bids, asks = parse_binance_book(data)
+    return bids, asks, data['lastUpdateId']
+
+async def sync_local_order_book(book: LocalOrderBook, feed: AsyncIterator[dict],
+                                fetch_snapshot: Callable[[], Awaitable[tuple]]):
+    """
+    Синхронизирует книгу с потоком: изменения буферизуются с момента подключения,
+    затем загружается снимок и изменения применяются по порядку.
+    Возвращается, когда поток закончился; при пропуске бросает OrderBookGap.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in feed:
+                await queue.put(event)
+        finally:
+            await queue.put(None)
+
+    pump_task = asyncio.create_task(pump())
+    try:
+        # Снимок берем после первого изменения, чтобы между ними не было пропуска
+        event = await queue.get()
+        if event is None:
+            pump_task.result()
+            return
+        bids, asks, last_update_id = await fetch_snapshot()
+        book.load_snapshot(bids, asks, last_update_id)
+        logger.info("Локальная книга %s загружена из снимка %s", book.exchange, last_update_id)
+        while event is not None:
+            book.apply_diff(event)
+            event = await queue.get()
+        # Поток закончился сам или с ошибкой подключения
+        pump_task.result()
+    finally:
+        pump_task.cancel()
+
+async def local_order_book_task(book: LocalOrderBook, open_feed: Callable[[], AsyncIterator[dict]],
+                                fetch_snapshot: Callable[[], Awaitable[tuple]]):
+    """
+    Фоновая задача: держит локальную книгу синхронизированной, переподключаясь
+    после обрыва потока и пересинхронизируясь при пропуске обновлений
+    """
+    while True:
+        delay = LOCAL_ORDER_BOOK_RETRY_INTERVAL
+        try:
+            await sync_local_order_book(book, open_feed(), fetch_snapshot)
+            logger.info("Поток книги %s закрыт, переподключаемся", book.exchange)
+        except asyncio.CancelledError:
+            raise
+        except OrderBookGap as e:
+            logger.warning("%s, пересинхронизация", e)
+            delay = 0
+        except Exception as e:
+            logger.warning("Ошибка потока книги %s: %s", book.exchange, e)
+        book.synced = False
+        await asyncio.sleep(delay)
+
+# Последние полученные книги ордеров по ключу биржи
+order_book_cache: Dict[str, OrderBook] = {}
+
+async def fetch_order_book(connector: OrderBookConnector) -> OrderBook:
+    book = await asyncio.wait_for(connector.fetch(), ORDER_BOOK_TIMEOUT)
+    order_book_cache[connector.name] = book
+    return book
+
+async def get_order_book(connector: OrderBookConnector) -> OrderBook:
+    """
+    Возвращает локальную книгу из потока, если она синхронизирована, иначе
+    книгу из REST не старше ORDER_BOOK_MAX_AGE; параллельные запросы к одной
+    бирже ждут один и тот же запрос
+    """
+    live_book = live_order_books.get(connector.name)
+    if live_book is not None and live_book.synced and live_book.age < LOCAL_ORDER_BOOK_MAX_SILENCE:
+        return live_book
+    book = order_book_cache.get(connector.name)
+    if book is not None and book.age < ORDER_BOOK_MAX_AGE:
+        return book
+    return await single_flight(f"order_book:{connector.name}", lambda: fetch_order_book(connector))
+
+async def get_order_books(connectors: List[OrderBookConnector]) -> tuple:
+    """
+    Получает книги нескольких бирж параллельно.
+    Возвращает (книги по ключу биржи, ошибки по ключу биржи): медленная или
+    недоступная биржа не мешает остальным.
+    """
+    results = await asyncio.gather(*(get_order_book(connector) for connector in connectors),
+                                   return_exceptions=True)
+    books = {}
+    errors = {}
+    for connector, result in zip(connectors, results):
+        if isinstance(result, asyncio.TimeoutError):
+            errors[connector.name] = f"Превышено время ожидания ({ORDER_BOOK_TIMEOUT} с)"
+        elif isinstance(result, HTTPException):
+            errors[connector.name] = result.detail
+        elif isinstance(result, Exception):
+            errors[connector.name] = str(result) or type(result).__name__
+        else:
+            books[connector.name] = result
+    return books, errors
+
+class DepthReference(str, Enum):
+    MID = "mid"
+    MICROPRICE = "microprice"
+
+DEPTH_MAX_BANDS = 20        # полос в одном запросе
+DEPTH_MAX_BAND_PERCENT = 50.0
+
+def parse_depth_bands(bands: Optional[str]) -> List[float]:
+    """
+    Разбирает параметр bands (проценты через запятую, например 0.5,1,2,5,10)
+    """
+    if not bands:
+        return []
+    try:
+        percents = sorted({float(part) for part in bands.split(',') if part.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректный список полос: {bands}")
+    if len(percents) > DEPTH_MAX_BANDS:
+        raise HTTPException(status_code=400, detail=f"Не больше {DEPTH_MAX_BANDS} полос за запрос")
+    if percents and not (0 < percents[0] and percents[-1] <= DEPTH_MAX_BAND_PERCENT):
+        raise HTTPException(status_code=400,
+                            detail=f"Полосы должны быть в пределах (0, {DEPTH_MAX_BAND_PERCENT}] процентов")
+    return percents
+
+def depth_data(connector: OrderBookConnector, book: OrderBook, bands: Optional[List[float]] = None,
+               reference: DepthReference = DepthReference.MID, notional: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Глубина рынка по книге: ±2% от выбранной цены отсчета, а также по запросу
+    произвольные полосы и стоимость исполнения заявки на notional USDT в обе стороны
+    """
+    mid_price = book.mid_price
+    micro_price = book.micro_price
+    if reference == DepthReference.MID:
+        reference_price = mid_price
+        # Для локальной книги ±2% от середины уже посчитаны инкрементально
+        plus_depth, minus_depth = book.depth()
+    else:
+        reference_price = micro_price
+        plus_depth, minus_depth = book.snapshot().depth_bands([DEPTH_PERCENT], reference_price)
+        plus_depth, minus_depth = float(plus_depth[0]), float(minus_depth[0])
+    data = {
+        'exchange': connector.title,
+        'currentPrice': reference_price,
+        'plus2PercentDepth': format_usd(plus_depth),
+        'minus2PercentDepth': format_usd(minus_depth),
+        'bestBid': book.best_bid,
+        'bestAsk': book.best_ask,
+        'updatedAt': format_timestamp(book.updated_at),
+        'source': book.source,
+        'midPrice': mid_price,
+        'microPrice': micro_price,
+        'reference': reference.value
+    }
+    if bands:
+        plus_depths, minus_depths = book.snapshot().depth_bands(bands, reference_price)
+        data['bands'] = [
+            {'percent': percent, 'plusDepth': float(plus), 'minusDepth': float(minus)}
+            for percent, plus, minus in zip(bands, plus_depths, minus_depths)
+        ]
+    if notional:
+        snapshot = book.snapshot()
+        data['fills'] = [snapshot.fill(notional, side, reference_price) for side in ('buy', 'sell')]
+    return data
+
+async def apply_order_book_depth(exchanges: List[ExchangeRecord], market_ids: List[Optional[str]]):
+    """
+    Заменяет оценку глубины ±2% на посчитанную по книге ордеров
+    для бирж, у которых есть коннектор
+    """
+    matched = {}
+    for exchange, market_id in zip(exchanges, market_ids):
+        connector = find_order_book_connector(market_id)
+        if connector is not None:
+            matched.setdefault(connector.name, (connector, []))[1].append(exchange)
+    if not matched:
+        return
+    books, errors = await get_order_books([connector for connector, _ in matched.values()])
+    for name, error in errors.items():
+        logger.warning("Книга ордеров %s недоступна, глубина оценивается по объему: %s", name, error)
+    for name, book in books.items():
+        try:
+            plus_depth, minus_depth = book.depth()
+        except ValueError as e:
+            logger.warning("%s", e)
+            continue
+        for exchange in matched[name][1]:
+            exchange.plus_depth = math.floor(plus_depth)
+            exchange.minus_depth = math.floor(minus_depth)
+
+@app.get("/api/ltc-depth", response_model=DepthBatchResponse, tags=["depth"])
+async def get_ltc_depth_batch(
+    exchanges: Optional[str] = None,
+    bands: Optional[str] = None,
+    reference: DepthReference = DepthReference.MID,
+    notional: Optional[float] = Query(None, gt=0)
+):
+    """
+    Получает глубину рынка для нескольких бирж одним запросом.
+    Книги запрашиваются параллельно; биржи, которые не ответили вовремя, попадают в errors.
+    
+    - **exchanges**: Биржи через запятую, например exchanges=binance,okx,kraken (по умолчанию все)
+    - **bands**, **reference**, **notional**: Как в /api/ltc-depth/{exchange}
+    """
+    band_percents = parse_depth_bands(bands)
+    if exchanges:
+        names = list(dict.fromkeys(name.strip().lower() for name in exchanges.split(',') if name.strip()))
+    else:
+        names = list(ORDER_BOOK_CONNECTORS)
+    connectors = []
+    errors = {}
+    for name in names:
+        connector = find_order_book_connector(name)
+        if connector is None:
+            errors[name] = f"Данные о глубине рынка для биржи {name} недоступны"
+        elif connector not in connectors:
+            connectors.append(connector)
+    
+    books, fetch_errors = await get_order_books(connectors)
+    errors.update(fetch_errors)
+    data = []
+    for connector in connectors:
+        book = books.get(connector.name)
+        if book is None:
+            continue
+        try:
+            data.append(depth_data(connector, book, band_percents, reference, notional))
+        except ValueError as e:
+            errors[connector.name] = str(e)
+    return {
+        'status': 'success',
+        'data': data,
+        'errors': errors
+    }
+
 @app.get("/api/ltc-depth/{exchange}", response_model=DepthResponse, tags=["depth"])
-async def get_ltc_depth(exchange: str):
+async def get_ltc_depth(
+    exchange: str,
+    bands: Optional[str] = None,
+    reference: DepthReference = DepthReference.MID,
+    notional: Optional[float] = Query(None, gt=0)
+):
     """
     Получает подробную информацию о глубине рынка для конкретной биржи.
-    Пример для биржи Binance (для других бирж может потребоваться другая логика).
+    Глубина считается по книге ордеров в пределах ±2% от цены отсчета.
     
-    - **exchange**: Название биржи (например, 'binance')
+    - **exchange**: Название биржи (binance, okx, bybit, kraken, kucoin, gate, htx, mexc)
+    - **bands**: Дополнительные полосы глубины в процентах через запятую, например bands=0.5,1,2,5,10
+    - **reference**: Цена отсчета: mid (середина книги) или microprice (взвешенная объемами лучших уровней)
+    - **notional**: Сумма заявки в USDT: средняя цена, проскальзывание и стоимость исполнения на покупку и продажу
     """
+    band_percents = parse_depth_bands(bands)
+    connector = find_order_book_connector(exchange)
+    if connector is None:
+        raise HTTPException(status_code=404, 
+                            detail=f"Данные о глубине рынка для биржи {exchange} недоступны")
     try:
-        depth_data = None
-        
-        # Логика получения книги ордеров с разных бирж
-        if exchange.lower() == 'binance':
-            response = requests.get('https://api.binance.com/api/v3/depth', 
-                                    params={'symbol': 'LTCUSDT', 'limit': 100})
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, 
-                                    detail=f"Ошибка API Binance: {response.text}")
-            
-            depth_data = response.json()
-        else:
-            raise HTTPException(status_code=404, 
-                                detail=f"Данные о глубине рынка для биржи {exchange} недоступны")
-        
-        # Получаем текущую цену LTC
-        current_price = await get_current_ltc_price()
-        plus_2_percent = current_price * 1.02
-        minus_2_percent = current_price * 0.98
-        
-        # Расчет суммарного объема до +2% и -2% от текущей цены
-        plus_2_percent_depth = 0
-        minus_2_percent_depth = 0
-        
-        # Расчет для ордеров на покупку (bid)
-        for price, volume in depth_data['bids']:
-            if float(price) >= minus_2_percent:
-                minus_2_percent_depth += float(price) * float(volume)
-            else:
-                break
-        
-        # Расчет для ордеров на продажу (ask)
-        for price, volume in depth_data['asks']:
-            if float(price) <= plus_2_percent:
-                plus_2_percent_depth += float(price) * float(volume)
-            else:
-                break
-        
+        book = await get_order_book(connector)
         return {
             'status': 'success',
-            'data': {
-                'exchange': exchange,
-                'currentPrice': current_price,
-                'plus2PercentDepth': f"${math.floor(plus_2_percent_depth):,}",
-                'minus2PercentDepth': f"${math.floor(minus_2_percent_depth):,}"
-            }
+            'data': depth_data(connector, book, band_percents, reference, notional)
         }
     
     except HTTPException:
         raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504,
+                            detail=f"Биржа {connector.title} не ответила за {ORDER_BOOK_TIMEOUT} с")
     except Exception as e:
         raise HTTPException(status_code=500, 
                             detail=f"Ошибка при получении данных о глубине рынка для {exchange}: {str(e)}")
 
-async def get_current_ltc_price() -> float:
+# История цены хранится локально в SQLite: один раз загружается за весь период,
+# дальше догружаются только точки новее последней сохраненной.
+# Все запросы с разными days/daily_close отвечаются выборкой диапазона из хранилища.
+PRICE_HISTORY_DB_PATH = os.getenv("PRICE_HISTORY_DB_PATH", "data/ltc_price_history.sqlite3")
+PRICE_HISTORY_MAX_DAYS = 365            # глубина первичной загрузки и максимум для days
+PRICE_HISTORY_APPEND_INTERVAL = 300     # не чаще раза в 5 минут запрашиваем новые точки
+PRICE_HISTORY_CACHE_TTL = 300           # ответы дешево пересобрать из хранилища, поэтому TTL короткий
+# Первичная загрузка: чем короче период, тем подробнее точки CoinGecko
+# (365 дней - по дням, 90 - по часам, 1 - каждые 5 минут)
+PRICE_HISTORY_BACKFILL_PERIODS = (PRICE_HISTORY_MAX_DAYS, 90, 1)
+
+class PriceHistoryStore:
+    """
+    Хранилище точек истории цены (время в мс, цена) в SQLite.
+    Методы блокирующие - из асинхронного кода они вызываются через asyncio.to_thread.
     """
-    Вспомогательная функция для получения текущей цены LTC
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.checked_at: Optional[float] = None   # time.monotonic() последней проверки новых точек
+        self.latest_ms: Optional[int] = None      # время последней известной точки (для метрик)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS ltc_prices (ts INTEGER PRIMARY KEY, price REAL NOT NULL) WITHOUT ROWID"
+            )
+            self._connection = connection
+        return self._connection
+
+    def last_timestamp(self) -> Optional[int]:
+        with self._lock:
+            self.latest_ms = self._connect().execute("SELECT MAX(ts) FROM ltc_prices").fetchone()[0]
+            return self.latest_ms
+
+    def add(self, points: List[list], newer_than: Optional[int] = None) -> int:
+        """
+        Сохраняет точки [время в мс, цена]; с newer_than - только новее этого времени
+        """
+        rows = [(int(ts), float(price)) for ts, price in points
+                if price is not None and (newer_than is None or ts > newer_than)]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO ltc_prices (ts, price) VALUES (?, ?)", rows)
+            if rows:
+                self.latest_ms = max(self.latest_ms or 0, max(ts for ts, _ in rows))
+        return len(rows)
+
+    def range(self, since_ms: int) -> List[tuple]:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT ts, price FROM ltc_prices WHERE ts >= ? ORDER BY ts", (since_ms,)
+            ).fetchall()
+
+price_history_store = PriceHistoryStore(PRICE_HISTORY_DB_PATH)
+REFRESH_INTERVAL.labels("price_history").set_function(
+    lambda: adaptive_interval("coingecko", PRICE_HISTORY_APPEND_INTERVAL)
+)
+SNAPSHOT_AGE.labels("price_history").set_function(
+    lambda: time.time() - price_history_store.latest_ms / 1000 if price_history_store.latest_ms else math.nan
+)
+
+async def fetch_market_chart(path: str, params: Dict[str, Any]) -> List[list]:
     """
+    Запрашивает точки цены LTC из API CoinGecko (market_chart или market_chart/range)
+    """
+    response = await get_http_client("coingecko").get(f'/coins/litecoin/{path}', params={'vs_currency': 'usd', **params})
+    if response.status_code in RATE_LIMIT_STATUSES:
+        raise UpstreamRateLimited("coingecko", parse_retry_after(response.headers.get('retry-after')))
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, 
+                            detail=f"Ошибка API CoinGecko: {response.text}")
+    return response.json().get('prices', [])  # Исторические цены в формате [timestamp, price]
+
+async def backfill_price_history():
+    logger.info("Получаем данные истории цен из API CoinGecko за %d дней (первичная загрузка)", PRICE_HISTORY_MAX_DAYS)
+    for days in PRICE_HISTORY_BACKFILL_PERIODS:
+        points = await fetch_market_chart('market_chart', {'days': days})
+        await asyncio.to_thread(price_history_store.add, points)
+
+async def append_price_history(last_ts: int):
+    points = await fetch_market_chart('market_chart/range', {
+        'from': last_ts // 1000,
+        'to': int(time.time())
+    })
+    added = await asyncio.to_thread(price_history_store.add, points, last_ts)
+    logger.debug("В историю цены добавлено %d новых точек", added)
+
+async def update_price_history():
+    """
+    Догружает в хранилище точки новее последней сохраненной (при пустом хранилище - весь период).
+    Если хранилище уже не пустое, ошибка API не мешает отвечать по имеющимся данным.
+    """
+    store = price_history_store
+    append_interval = adaptive_interval("coingecko", PRICE_HISTORY_APPEND_INTERVAL)
+    if store.checked_at is not None and time.monotonic() - store.checked_at < append_interval:
+        return
+    last_ts = await asyncio.to_thread(store.last_timestamp)
     try:
-        response = requests.get('https://api.coingecko.com/api/v3/simple/price', 
-                                params={'ids': 'litecoin', 'vs_currencies': 'usd'})
-        if response.status_code != 200:
-            return 0
-        
-        return response.json()['litecoin']['usd']
+        with upstream_call_priority(UPSTREAM_PRIORITY_HISTORY):
+            if last_ts is None:
+                await backfill_price_history()
+            elif time.time() * 1000 - last_ts >= append_interval * 1000:
+                await append_price_history(last_ts)
+        store.checked_at = time.monotonic()
     except Exception as e:
-        print(f"Ошибка при получении текущей цены LTC: {str(e)}")
-        return 0
+        if last_ts is None:
+            raise
+        # Повторим не раньше, чем через интервал
+        store.checked_at = time.monotonic()
+        logger.warning("Не удалось догрузить историю цены, отвечаем по сохраненным данным: %s", e)
+
+def format_history_period(days: int) -> str:
+    if days <= 1:
+        return "24 часа"
+    elif days <= 7:
+        return "7 дней"
+    elif days <= 30:
+        return "1 месяц"
+    return f"{days} дней"
+
+def thin_price_history(points: List[tuple], days: int, daily_close: bool) -> List[tuple]:
+    """
+    В хранилище соседствуют точки разной частоты, поэтому они прореживаются до частоты,
+    которую CoinGecko отдает для такого периода: последняя точка в каждом часе
+    (до 90 дней) или дне (дольше), а для daily_close - последняя цена каждого дня.
+    Дни считаются по UTC, как у дневных свечей /api/ltc-candles.
+    """
+    if days <= 1 and not daily_close:
+        bucket_ms = 1
+    elif days <= 90 and not daily_close:
+        bucket_ms = 3600 * 1000
+    else:
+        # Цены закрытия: последнее значение каждого дня UTC
+        bucket_ms = 86400 * 1000
+    buckets = {}
+    for ts, price in points:
+        buckets[ts // bucket_ms] = (ts, price)
+    return list(buckets.values())
 
-# Добавление эндпоинта для графика цены LTC
+def lttb(timestamps: np.ndarray, values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Прореживание ряда до threshold точек по алгоритму Largest-Triangle-Three-Buckets:
+    из каждой корзины берется точка, образующая наибольший треугольник с выбранной
+    точкой предыдущей корзины и средним следующей, поэтому пики и провалы сохраняются.
+    Возвращает индексы выбранных точек.
+    """
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # Первая и последняя точки всегда в выборке, остальные делятся на threshold-2 корзин
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    x = timestamps.astype(float)
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        average_x = x[end:next_end].mean()
+        average_y = values[end:next_end].mean()
+        areas = np.abs((x[a] - average_x) * (values[start:end] - values[a])
+                       - (x[a] - x[start:end]) * (average_y - values[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
 
-class PriceHistoryItem(BaseModel):
-    """Модель для элемента истории цены"""
-    date: str       # Дата в формате "месяц/день" (например, "3/23")
-    price: float    # Цена в USD
+def render_price_history(points: List[tuple], days: int, daily_close: bool,
+                         max_points: Optional[int] = None, columnar: bool = False) -> dict:
+    """
+    Приводит точки из хранилища к формату ответа: список {date, price}
+    или, при columnar, параллельные массивы timestamps (мс) и prices
+    """
+    thinned = thin_price_history(points, days, daily_close)
+    if max_points is not None and len(thinned) > max_points:
+        history = np.array(thinned, dtype=float)
+        thinned = [thinned[i] for i in lttb(history[:, 0], history[:, 1], max_points).tolist()]
+    result = {
+        'status': 'success',
+        'currency': 'USD',
+        'period': format_history_period(days)
+    }
+    if columnar:
+        result['timestamps'] = [int(ts) for ts, _ in thinned]
+        result['prices'] = [round(price, 2) for _, price in thinned]
+        return result
+    price_history = []
+    for ts, price in thinned:
+        date_obj = datetime.fromtimestamp(ts / 1000, timezone.utc)
+        price_history.append({
+            'date': f"{date_obj.month}/{date_obj.day}",
+            'price': round(price, 2)
+        })
+    result['data'] = price_history
+    return result
 
-class PriceHistoryResponse(BaseModel):
-    """Модель для ответа с историей цены"""
-    status: str
-    data: List[PriceHistoryItem]
-    currency: str = "USD"
-    period: str
+async def build_price_history(days: int, daily_close: bool, max_points: Optional[int] = None,
+                              columnar: bool = False) -> dict:
+    """
+    Собирает историю цены за days дней из локального хранилища
+    """
+    await single_flight("price_history:update", update_price_history)
+    since_ms = int((time.time() - days * 86400) * 1000)
+    points = await asyncio.to_thread(price_history_store.range, since_ms)
+    with request_stage("transform"):
+        return await asyncio.to_thread(render_price_history, points, days, daily_close, max_points, columnar)
+
+# Стандартные периоды истории собираются фоновой задачей из одной выборки хранилища
+# и записываются в Redis одним пайплайном, поэтому запросы к ним не ждут CoinGecko
+PRICE_HISTORY_STANDARD_DAYS = (1, 7, 30, 90, PRICE_HISTORY_MAX_DAYS)
+PRICE_HISTORY_REFRESH_INTERVAL = PRICE_HISTORY_APPEND_INTERVAL   # как часто пересобираются представления
+PRICE_HISTORY_REFRESH_CHECK_INTERVAL = 30   # как часто процесс пробует взять пересборку на себя
+PRICE_HISTORY_VIEW_TTL = PRICE_HISTORY_REFRESH_INTERVAL * 3      # переживают пару неудачных пересборок
+PRICE_HISTORY_REFRESH_CLAIM_KEY = "ltc_price_history:refresh_claim"
+
+def price_history_cache_key(days: int, daily_close: bool) -> str:
+    return f"ltc_price_history:{days}:{daily_close}"
+
+def render_price_history_views(points: List[tuple], now_ms: int) -> Dict[str, dict]:
+    """
+    Собирает записи кэша для всех стандартных (days, daily_close) из одной выборки точек
+    """
+    timestamps = [ts for ts, _ in points]
+    fresh_until = now_ms / 1000 + PRICE_HISTORY_REFRESH_INTERVAL
+    views = {}
+    for days in PRICE_HISTORY_STANDARD_DAYS:
+        started = time.monotonic()
+        # Более короткий период - хвост того же ряда
+        window = points[bisect.bisect_left(timestamps, now_ms - days * 86400 * 1000):]
+        for daily_close in (True, False):
+            value = render_price_history(window, days, daily_close)
+            views[price_history_cache_key(days, daily_close)] = build_cache_entry(
+                value, PRICE_HISTORY_VIEW_TTL, time.monotonic() - started, fresh_until
+            )
+    return views
+
+async def materialize_price_history_views():
+    """
+    Догружает новые точки и пересобирает все стандартные представления истории цены
+    """
+    await single_flight("price_history:update", update_price_history)
+    now_ms = int(time.time() * 1000)
+    since_ms = now_ms - max(PRICE_HISTORY_STANDARD_DAYS) * 86400 * 1000
+    points = await asyncio.to_thread(price_history_store.range, since_ms)
+    views = await asyncio.to_thread(render_price_history_views, points, now_ms)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for cache_key, entry in views.items():
+            pipe.delete(cache_key)
+            pipe.hset(cache_key, mapping=entry)
+            pipe.expire(cache_key, PRICE_HISTORY_VIEW_TTL)
+        await pipe.execute()
+    logger.debug("Пересобрано %d представлений истории цены (%d точек)", len(views), len(points))
+
+async def price_history_refresher():
+    """
+    Фоновая задача: раз в PRICE_HISTORY_REFRESH_INTERVAL один из процессов
+    (кто первым возьмет метку в Redis) пересобирает представления истории цены
+    """
+    while True:
+        delay = PRICE_HISTORY_REFRESH_CHECK_INTERVAL
+        claimed = False
+        try:
+            claimed = await redis_client.set(PRICE_HISTORY_REFRESH_CLAIM_KEY, 1, nx=True,
+                                             ex=PRICE_HISTORY_REFRESH_INTERVAL)
+            if claimed:
+                await materialize_price_history_views()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Ошибка фоновой пересборки истории цены: %s", e)
+            if claimed:
+                # Снимаем метку, чтобы повторить пересборку при следующей проверке
+                try:
+                    await redis_client.delete(PRICE_HISTORY_REFRESH_CLAIM_KEY)
+                except Exception:
+                    pass
+        await asyncio.sleep(delay)
+
+class HistoryFormat(str, Enum):
+    POINTS = "points"
+    COLUMNAR = "columnar"
 
 @app.get("/api/ltc-price-history", tags=["prices"])
-async def get_ltc_price_history(days: int = 30, daily_close: bool = True):
+async def get_ltc_price_history(
+    request: Request,
+    days: int = 30,
+    daily_close: bool = True,
+    max_points: Optional[int] = Query(None, ge=3, le=10000),
+    format: HistoryFormat = HistoryFormat.POINTS
+):
     """
     Получает историю цены Litecoin за указанный период для построения графика.
+    Ответ поддерживает ETag (304 Not Modified) и сжатие gzip/brotli.
     
-    - **days**: Количество дней истории (по умолчанию 30 дней)
+    - **days**: Количество дней истории (по умолчанию 30 дней, не больше 365)
     - **daily_close**: Если True, возвращает только цены закрытия дня
+    - **max_points**: Не больше стольких точек: ряд прореживается с сохранением формы (LTTB)
+    - **format**: points - список {date, price}; columnar - массивы timestamps (мс, UTC) и prices
     """
     try:
-        # Ограничиваем maximum до 90 дней
-        if days > 90:
-            days = 90
+        # Ограничиваем глубиной локального хранилища
+        if days > PRICE_HISTORY_MAX_DAYS:
+            days = PRICE_HISTORY_MAX_DAYS
         elif days < 1:
             days = 1
-            
-        # Проверяем наличие данных в кэше Redis с учетом параметра daily_close
-        cache_key = f"ltc_price_history_new_format:{days}:{daily_close}"
-        cached_data = redis_client.get(cache_key)
-        
-        if cached_data:
-            # Если данные найдены в кэше, возвращаем их
-            print(f"Возвращаем данные истории цен из кэша Redis за {days} дней")
-            return json.loads(cached_data)
         
-        # Если данных в кэше нет, получаем их из API CoinGecko
-        print(f"Получаем данные истории цен из API CoinGecko за {days} дней")
-        
-        # Убираем параметр interval, так как API автоматически определит нужный интервал
-        params = {
-            'vs_currency': 'usd',
-            'days': days
-        }
-        
-        response = requests.get(
-            'https://api.coingecko.com/api/v3/coins/litecoin/market_chart',
-            params=params
+        # Стандартные периоды заранее собирает price_history_refresher; при промахе
+        # ответ собирается из локального хранилища, а к CoinGecko уходят только новые точки
+        cache_key = price_history_cache_key(days, daily_close)
+        if max_points is not None or format != HistoryFormat.POINTS:
+            cache_key += f":{max_points}:{format.value}"
+        encoding = choose_encoding(request)
+        payload = await get_or_compute(
+            cache_key,
+            PRICE_HISTORY_CACHE_TTL,
+            lambda: build_price_history(days, daily_close, max_points, format == HistoryFormat.COLUMNAR),
+            encoding
         )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, 
-                                detail=f"Ошибка API CoinGecko: {response.text}")
-        
-        data = response.json()
-        prices = data.get('prices', [])  # Исторические цены в формате [timestamp, price]
-        
-        # Если нужны только цены закрытия дня
-        if daily_close:
-            # Группируем данные по дням и берем последнее значение для каждого дня
-            daily_prices = {}
-            for item in prices:
-                timestamp, price = item
-                # Преобразуем timestamp в дату без времени
-                date_obj = datetime.fromtimestamp(timestamp / 1000)
-                date_key = f"{date_obj.year}-{date_obj.month}-{date_obj.day}"
-                
-                # Сохраняем или обновляем цену для этого дня
-                # Последняя запись для каждого дня будет перезаписывать предыдущие
-                daily_prices[date_key] = {
-                    'date': f"{date_obj.month}/{date_obj.day}",
-                    'price': round(price, 2)
-                }
-            
-            # Преобразуем словарь в список, сортируя по дате
-            price_history = [daily_prices[key] for key in sorted(daily_prices.keys())]
-        else:
-            # Преобразуем данные в прежний формат с почасовой детализацией
-            price_history = []
-            for item in prices:
-                timestamp, price = item
-                date_obj = datetime.fromtimestamp(timestamp / 1000)
-                formatted_date = f"{date_obj.month}/{date_obj.day}"
-                
-                price_history.append({
-                    'date': formatted_date,
-                    'price': round(price, 2)
-                })
-        
-        # Определяем период
-        if days <= 1:
-            period = "24 часа"
-        elif days <= 7:
-            period = "7 дней"
-        elif days <= 30:
-            period = "1 месяц"
-        else:
-            period = f"{days} дней"
-        
-        result = {
-            'status': 'success',
-            'data': price_history,
-            'currency': 'USD',
-            'period': period
-        }
-        
-        # Устанавливаем время кэширования в зависимости от запрошенного периода
-        if days >= 30:
-            ttl = 43200  # 12 часов в секундах
-        elif days >= 7:
-            ttl = 21600  # 6 часов в секундах
-        else:
-            ttl = 3600   # 1 час в секундах
-            
-        # Сохраняем результат в Redis с новым TTL
-        redis_client.setex(cache_key, ttl, json.dumps(result, default=lambda o: o.__dict__))
-        
-        return result
+        # Сохраненные (и заранее сжатые) байты отдаются как есть, без повторной сериализации
+        return payload_response(payload, request, encoding)
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении истории цен LTC: {str(e)}")
 
+# Свечи OHLC по истории цены из локального хранилища. Границы свечей - по UTC.
+# В хранилище не больше одной точки за 5 минут, поэтому свеча должна покрывать
+# несколько точек, иначе open = high = low = close: 5-минутных свечей нет.
+CANDLE_INTERVALS = {'1h': 3600, '4h': 14400, '1d': 86400}   # длительность в секундах
+# Максимальный период для интервала: точки за 5 минут есть только за последние сутки,
+# часовые - за 90 дней, дальше - по одной в день (см. PRICE_HISTORY_BACKFILL_PERIODS)
+CANDLE_MAX_DAYS = {'1h': 1, '4h': 90, '1d': 90}
+CANDLE_DEFAULT_DAYS = {'1h': 1, '4h': 30, '1d': 90}
+
+class CandleInterval(str, Enum):
+    H1 = "1h"
+    H4 = "4h"
+    D1 = "1d"
+
+def resample_ohlc(timestamps: np.ndarray, prices: np.ndarray, interval_ms: int) -> Dict[str, np.ndarray]:
+    """
+    Группирует отсортированные по времени точки в свечи длиной interval_ms.
+    Свеча начинается на кратном интервалу времени от эпохи, то есть по UTC.
+    """
+    buckets = timestamps // interval_ms
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.concatenate((starts[1:], [len(prices)])) - 1
+    return {
+        'timestamp': buckets[starts] * interval_ms,
+        'open': prices[starts],
+        'high': np.maximum.reduceat(prices, starts),
+        'low': np.minimum.reduceat(prices, starts),
+        'close': prices[ends]
+    }
+
+def render_candles(points: List[tuple], interval: CandleInterval) -> dict:
+    data = []
+    if points:
+        history = np.array(points, dtype=float)
+        candles = resample_ohlc(history[:, 0].astype(np.int64), history[:, 1],
+                                CANDLE_INTERVALS[interval.value] * 1000)
+        timestamps = candles['timestamp'].tolist()
+        columns = [np.round(candles[name], 4).tolist() for name in ('open', 'high', 'low', 'close')]
+        for timestamp, open_price, high, low, close in zip(timestamps, *columns):
+            data.append({
+                'time': format_timestamp(datetime.fromtimestamp(timestamp / 1000, timezone.utc)),
+                'timestamp': timestamp,
+                'open': open_price,
+                'high': high,
+                'low': low,
+                'close': close
+            })
+    return {
+        'status': 'success',
+        'interval': interval.value,
+        'data': data,
+        'currency': 'USD'
+    }
+
+async def build_candles(interval: CandleInterval, days: int) -> dict:
+    await single_flight("price_history:update", update_price_history)
+    # Начало периода выравниваем на границу свечи, чтобы первая свеча была полной
+    interval_ms = CANDLE_INTERVALS[interval.value] * 1000
+    since_ms = int((time.time() - days * 86400) * 1000) // interval_ms * interval_ms
+    points = await asyncio.to_thread(price_history_store.range, since_ms)
+    with request_stage("transform"):
+        return await asyncio.to_thread(render_candles, points, interval)
+
+@app.get("/api/ltc-candles", tags=["prices"])
+async def get_ltc_candles(request: Request, interval: CandleInterval = CandleInterval.H1, days: Optional[int] = None):
+    """
+    Получает свечи OHLC по цене Litecoin для графиков. Границы свечей - по UTC.
+    Объем не отдается: CoinGecko дает только скользящий объем за 24 часа, а не объем по свечам.
+    
+    - **interval**: Длительность свечи: 1h, 4h или 1d
+    - **days**: Период в днях (по умолчанию 1, 30 и 90 дней соответственно;
+      не больше 1 дня для 1h и 90 дней для 4h/1d - дальше в истории слишком редкие точки)
+    """
+    try:
+        if days is None:
+            days = CANDLE_DEFAULT_DAYS[interval.value]
+        days = min(max(days, 1), CANDLE_MAX_DAYS[interval.value])
+        
+        cache_key = f"ltc_candles:{interval.value}:{days}"
+        encoding = choose_encoding(request)
+        payload = await get_or_compute(
+            cache_key,
+            PRICE_HISTORY_CACHE_TTL,
+            lambda: build_candles(interval, days),
+            encoding
+        )
+        return payload_response(payload, request, encoding)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении свечей LTC: {str(e)}")
+
 # Функция для получения текущей цены LTC с Binance
-async def get_binance_ltc_price() -> float:
-    """Получение текущей цены LTC с Binance"""
+async def fetch_binance_ltc_price() -> float:
+    """Запрос текущей цены LTC с Binance (без кэширования)"""
     try:
-        response = requests.get('https://api.binance.com/api/v3/ticker/price', params={'symbol': 'LTCUSDT'})
+        response = await get_http_client("binance").get('/ticker/price', params={'symbol': 'LTCUSDT'})
         if response.status_code == 200:
             data = response.json()
             return float(data['price'])
         else:
             return 0
     except Exception as e:
-        print(f"Ошибка при получении цены LTC с Binance: {str(e)}")
+        logger.warning("Ошибка при получении цены LTC с Binance: %s", e)
         return 0
 
+BINANCE_PRICE_MAX_AGE = 5.0     # окно свежести цены Binance в секундах
+BINANCE_PRICE_MAX_STALE = 30.0  # сколько после ошибок запроса еще отдается последняя цена
+
+class PriceOracle:
+    """
+    Общий источник цены с коротким окном свежести.
+    Делает не больше одного запроса к внешнему API за окно, параллельные
+    вызовы ждут один и тот же запрос. При ошибке отдает последнюю известную цену,
+    пока она не старше max_stale секунд; более старая цена не отдается.
+    """
+    def __init__(self, fetch: Callable[[], Awaitable[float]], max_age: float, max_stale: float):
+        self._fetch = fetch
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.price: Optional[float] = None
+        self.updated_at: Optional[datetime] = None  # время получения цены (UTC)
+        self._fetched_at: Optional[float] = None    # time.monotonic() последней цены
+        self._attempted_at: Optional[float] = None  # time.monotonic() последнего запроса
+        self._lock = asyncio.Lock()
+
+    @property
+    def age(self) -> Optional[float]:
+        """Возраст последней цены в секундах (None, если цены еще нет)"""
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def _attempted_recently(self) -> bool:
+        return self._attempted_at is not None and time.monotonic() - self._attempted_at < self.max_age
+
+    async def get_price(self) -> float:
+        """
+        Возвращает цену не старше окна свежести, а если запрос не удался - последнюю
+        цену не старше max_stale; 0, если такой цены нет
+        """
+        if not self._attempted_recently():
+            async with self._lock:
+                # Пока ждали блокировку, цену мог обновить другой вызов
+                if not self._attempted_recently():
+                    self._attempted_at = time.monotonic()
+                    price = await self._fetch()
+                    if price > 0:
+                        self.price = price
+                        self._fetched_at = time.monotonic()
+                        self.updated_at = datetime.now(timezone.utc)
+        age = self.age
+        if age is None or age > self.max_stale:
+            return 0
+        return self.price
+
+binance_price_oracle = PriceOracle(fetch_binance_ltc_price, BINANCE_PRICE_MAX_AGE, BINANCE_PRICE_MAX_STALE)
+
+async def get_binance_ltc_price() -> float:
+    """Получение текущей цены LTC с Binance через общий оракул цены"""
+    return await binance_price_oracle.get_price()
+
+class OraclePriceData(BaseModel):
+    source: str
+    price: float
+    ageSeconds: Optional[float] = None
+    updatedAt: Optional[str] = None
+
+class OraclePriceResponse(BaseModel):
+    status: str
+    data: OraclePriceData
+
+@app.get("/api/ltc-price/binance", response_model=OraclePriceResponse, tags=["prices"])
+async def get_binance_price():
+    """
+    Возвращает текущую цену LTC/USDT с Binance из общего оракула цены
+    вместе с ее возрастом. Используется ботом для расчета процентных цен.
+    """
+    price = await binance_price_oracle.get_price()
+    if price <= 0:
+        raise HTTPException(status_code=503, detail="Цена LTC с Binance недоступна")
+    age = binance_price_oracle.age
+    return {
+        'status': 'success',
+        'data': {
+            'source': 'binance',
+            'price': price,
+            'ageSeconds': round(age, 3) if age is not None else None,
+            'updatedAt': format_timestamp(binance_price_oracle.updated_at) if binance_price_oracle.updated_at else None
+        }
+    }
+
+@app.get("/api/redis-stats", tags=["info"])
+async def get_redis_stats():
+    """
+    Возвращает задержки операций Redis в этом процессе по командам
+    (количество, среднее и максимальное время в миллисекундах)
+    """
+    return {
+        'status': 'success',
+        'data': {
+            operation: {
+                'count': stats['count'],
+                'avgMs': round(stats['total'] / stats['count'] * 1000, 3),
+                'maxMs': round(stats['max'] * 1000, 3)
+            }
+            for operation, stats in sorted(redis_latency.items())
+        }
+    }
+
+# Административные маршруты (/api/admin/...): доступны только с заголовком X-Admin-Token,
+# совпадающим с переменной окружения ADMIN_TOKEN; без нее отключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = 60                # максимальная длительность профилирования
+PROFILE_DEFAULT_INTERVAL_MS = 5         # период выборки стеков
+# Кадры, на которых поток простаивает: ожидание событий в цикле asyncio
+# или работы в пуле потоков. Такие стеки по умолчанию не попадают в профиль
+PROFILE_IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+}
+profiler_lock = asyncio.Lock()
+
+def check_admin_token(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Административные маршруты отключены (не задан ADMIN_TOKEN)")
+    if not hmac.compare_digest(request.headers.get('x-admin-token', ''), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Неверный токен администратора")
+
+def sample_stacks(seconds: float, interval: float, include_idle: bool) -> Dict[str, int]:
+    """
+    Статистический профилировщик: каждые interval секунд снимает стеки всех потоков
+    процесса (кроме своего) и считает одинаковые стеки.
+    Ключ - стек в свернутом виде "поток;внешняя функция;...;внутренняя функция".
+    Работает в отдельном потоке и не требует инструментирования кода.
+    """
+    own_thread = threading.get_ident()
+    thread_names = {}
+    counts: Dict[str, int] = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            code = frame.f_code
+            if not include_idle and (os.path.basename(code.co_filename), code.co_name) in PROFILE_IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            name = thread_names.get(thread_id)
+            if name is None:
+                thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                name = thread_names.get(thread_id, str(thread_id))
+            stack.append(name)
+            folded = ';'.join(reversed(stack))
+            counts[folded] = counts.get(folded, 0) + 1
+        time.sleep(interval)
+    return counts
+
+@app.post("/api/admin/profile", tags=["admin"])
+async def profile_process(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=PROFILE_MAX_SECONDS, description="Длительность профилирования, секунды"),
+    interval_ms: float = Query(PROFILE_DEFAULT_INTERVAL_MS, ge=1, le=100, description="Период выборки стеков, мс"),
+    idle: bool = Query(False, description="Учитывать стеки простаивающих потоков")
+):
+    """
+    Включает профилировщик на заданное время и возвращает стеки в свернутом формате
+    (строка "стек количество"), который понимают flamegraph.pl, inferno и speedscope:
+
+    curl -X POST -H "X-Admin-Token: ..." ".../api/admin/profile?seconds=30" > ltc.folded
+    """
+    check_admin_token(request)
+    if profiler_lock.locked():
+        raise HTTPException(status_code=409, detail="Профилирование уже выполняется")
+    async with profiler_lock:
+        counts = await asyncio.to_thread(sample_stacks, seconds, interval_ms / 1000, idle)
+    lines = [f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1])]
+    return Response('\n'.join(lines) + '\n', media_type="text/plain")
+
+@app.get("/api/admin/slow-requests", tags=["admin"])
+async def get_slow_requests(
+    request: Request,
+    limit: int = Query(50, ge=1, le=SLOW_REQUEST_RING_SIZE, description="Количество последних запросов")
+):
+    """
+    Возвращает последние запросы дольше SLOW_REQUEST_THRESHOLD с разбивкой по этапам:
+    redis, upstream (внешние API), transform, sort, serialize (JSON и сжатие)
+    """
+    check_admin_token(request)
+    return {
+        'status': 'success',
+        'thresholdMs': SLOW_REQUEST_THRESHOLD * 1000,
+        'data': list(slow_requests)[-limit:][::-1]
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Метрики процесса в формате Prometheus
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Корневой маршрут с информацией об API
 @app.get("/", tags=["info"])
 async def root():
@@ -749,6 +3861,10 @@ async def root():
                 "path": "/api/ltc-exchanges",
                 "description": "Получить данные о биржах LTC/USDT через CoinGecko"
             },
+            {
+                "path": "/api/ltc-exchanges/stream",
+                "description": "Поток изменений таблицы бирж (Server-Sent Events; WebSocket - /api/ltc-exchanges/ws)"
+            },
             {
                 "path": "/api/ltc-exchanges-cmc",
                 "description": "Получить данные о биржах LTC/USDT через CoinMarketCap"
@@ -757,9 +3873,29 @@ async def root():
                 "path": "/api/ltc-depth/{exchange}",
                 "description": "Получить данные о глубине рынка для конкретной биржи"
             },
+            {
+                "path": "/api/ltc-depth?exchanges=binance,okx",
+                "description": "Получить глубину рынка для нескольких бирж одним запросом"
+            },
+            {
+                "path": "/api/ltc-price/binance",
+                "description": "Получить текущую цену LTC/USDT с Binance и ее возраст"
+            },
             {
                 "path": "/api/ltc-price-history",
                 "description": "Получить историю цены Litecoin за указанный период для построения графика"
+            },
+            {
+                "path": "/api/ltc-candles",
+                "description": "Получить свечи OHLC по цене Litecoin (1h, 4h, 1d) по UTC"
+            },
+            {
+                "path": "/api/redis-stats",
+                "description": "Получить задержки операций Redis по командам"
+            },
+            {
+                "path": "/metrics",
+                "description": "Метрики Prometheus: задержки маршрутов, кэша, внешних API и Redis"
             }
         ]
     }
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Клиент Redis приложения на fakeredis (нужен fakeredis[lua]: блокировки и бюджет
+    запросов выполняются скриптами Lua) и сброшенные локальные копии процесса
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    pool = main.redis.asyncio.ConnectionPool(
+        connection_class=fakeredis.FakeAsyncConnection,
+        server=fakeredis.FakeServer(),
+        decode_responses=False,
+    )
+    client = main.TimedRedis(connection_pool=pool)
+    monkeypatch.setattr(main, "redis_client", client)
+    monkeypatch.setattr(main, "custom_exchanges", {})
+    monkeypatch.setattr(main, "custom_exchanges_loaded", False)
+    monkeypatch.setattr(main, "exchanges_version", None)
+    monkeypatch.setattr(main, "exchange_records_cache", {'version': None, 'loaded': None})
+    return client
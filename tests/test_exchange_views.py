@@ -0,0 +1,195 @@
+"""
+Версии представлений бирж: пересборка после изменения пользовательских бирж.
+"""
+import asyncio
+
+import orjson
+
+import main
+
+
+def make_record(name: str, price: float, volume: float) -> main.ExchangeRecord:
+    return main.ExchangeRecord(exchange=name, pair="LTC/USDT", price=price, plus_depth=volume * 0.06,
+                               minus_depth=volume * 0.05, volume=volume, volume_percentage=1.0,
+                               last_updated="2025-03-23T12:00:00Z")
+
+
+async def store_snapshot(upstream):
+    await main.redis_client.set(main.EXCHANGES_BASE_CACHE_KEY, orjson.dumps({
+        'status': 'success',
+        'asOf': "2025-03-23T12:00:00Z",
+        'refreshedAt': 1742731200.0,
+        'upstream': [record.to_dict() for record in upstream],
+    }))
+
+
+async def version_exchanges(version: int) -> list:
+    data = orjson.loads(await main.redis_client.get(main.exchanges_records_key(version)))
+    return [item['exchange'] for item in data['records']]
+
+
+def test_rebuild_uses_custom_exchanges_from_redis(fake_redis):
+    async def run():
+        await store_snapshot([make_record("Binance", 85.0, 1e6)])
+        await main.save_custom_exchange("a", make_record("Alpha", 85.1, 1e5))
+        await main.load_custom_exchanges()
+        # Изменения другого процесса: записаны в Redis, но сообщение pub/sub сюда еще не дошло
+        async with main.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(main.custom_exchange_key("b"), mapping=main.record_to_hash(make_record("Beta", 85.2, 2e5)))
+            pipe.sadd(main.CUSTOM_EXCHANGES_INDEX_KEY, "b")
+            pipe.srem(main.CUSTOM_EXCHANGES_INDEX_KEY, "a")
+            pipe.delete(main.custom_exchange_key("a"))
+            await pipe.execute()
+        assert set(main.custom_exchanges) == {"a"}
+
+        await main.rebuild_exchange_views()
+        return await version_exchanges(await main.load_exchanges_version())
+
+    assert asyncio.run(run()) == ["Binance", "Beta"]
+
+
+def test_sorted_view_is_built_from_version_records(fake_redis):
+    async def run():
+        await store_snapshot([make_record("Binance", 85.0, 1e6)])
+        await main.save_custom_exchange("a", make_record("Alpha", 85.1, 1e5))
+        await main.rebuild_exchange_views()
+        version = await main.load_exchanges_version()
+        key = main.exchanges_sort_cache_key(version, main.SortCriterion.PRICE, True)
+        await main.redis_client.delete(key)
+        # Локальная копия опережает версию: ее изменения попадут только в следующую версию
+        main.custom_exchanges["g"] = make_record("Gamma", 90.0, 1.0)
+
+        payload = await main.build_sorted_exchanges(main.SortCriterion.PRICE, True, False)
+        cached = await main.read_payload(key, None)
+
+        # Записей версии уже нет: список собирается из снапшота, но в кэш версии не пишется
+        await main.redis_client.delete(main.exchanges_records_key(version), key)
+        fallback = await main.build_sorted_exchanges(main.SortCriterion.PRICE, True, False)
+        return version, payload, cached, fallback, await main.read_payload(key, None)
+
+    version, payload, cached, fallback, cached_fallback = asyncio.run(run())
+    body = orjson.loads(payload['body'])
+    assert body['version'] == version
+    assert [row['exchange'] for row in body['data']] == ["Alpha", "Binance"]
+    assert cached['body'] == payload['body']
+    assert [row['exchange'] for row in orjson.loads(fallback['body'])['data']] == ["Gamma", "Alpha", "Binance"]
+    assert cached_fallback is None
+
+
+def apply_delta(rows: dict, delta: dict) -> dict:
+    """Применяет изменения так же, как клиент: удалить, добавить или заменить, обновить поля"""
+    rows = {key: dict(row) for key, row in rows.items() if key not in delta['removed']}
+    for key, row in delta['added'].items():
+        rows[key] = dict(row)
+    for key, fields in delta['changed'].items():
+        rows[key].update(fields)
+    return rows
+
+
+def test_compose_add_change_remove_of_one_row():
+    rows = [
+        {"A": {"price": 1}},
+        {"A": {"price": 1}, "B": {"price": 2}},
+        {"A": {"price": 1}, "B": {"price": 3}},
+        {"A": {"price": 1}},
+    ]
+    deltas = [main.diff_exchange_rows(old, new) for old, new in zip(rows, rows[1:])]
+    # Строки, которой не было в начале диапазона, в объединенных изменениях нет совсем
+    assert main.compose_exchange_deltas(deltas) == {'added': {}, 'removed': [], 'changed': {}}
+    assert main.compose_exchange_deltas(deltas[:2]) == {'added': {"B": {"price": 3}}, 'removed': [], 'changed': {}}
+    assert main.compose_exchange_deltas(deltas[1:]) == {'added': {}, 'removed': ["B"], 'changed': {}}
+
+
+def test_compose_remove_then_add_back_and_change():
+    rows = [
+        {"A": {"price": 1, "volume": 5}, "B": {"price": 2, "volume": 6}},
+        {"B": {"price": 2, "volume": 6}},
+        {"A": {"price": 4, "volume": 5}, "B": {"price": 2, "volume": 6}},
+        {"A": {"price": 4, "volume": 7}, "B": {"price": 9, "volume": 6}},
+    ]
+    deltas = [main.diff_exchange_rows(old, new) for old, new in zip(rows, rows[1:])]
+    composed = main.compose_exchange_deltas(deltas)
+    # Удаленная и вновь добавленная строка приходит целиком, чтобы заменить старую
+    assert composed == {'added': {"A": {"price": 4, "volume": 7}}, 'removed': [],
+                        'changed': {"B": {"price": 9}}}
+    assert apply_delta(rows[0], composed) == rows[-1]
+
+    # Строка из начала диапазона удалена, добавлена и снова удалена - клиенту нужно ее удалить
+    rows = [{"A": {"price": 1}}, {}, {"A": {"price": 2}}, {}]
+    deltas = [main.diff_exchange_rows(old, new) for old, new in zip(rows, rows[1:])]
+    assert main.compose_exchange_deltas(deltas) == {'added': {}, 'removed': ["A"], 'changed': {}}
+
+
+def test_compose_matches_sequential_application():
+    import random
+    rng = random.Random(3)
+    states = [{}]
+    for _ in range(200):
+        rows = {key: dict(row) for key, row in states[-1].items()}
+        for _ in range(rng.randint(1, 4)):
+            key = rng.choice("ABCDEFGH")
+            action = rng.random()
+            if action < 0.3:
+                rows.pop(key, None)
+            elif key in rows and action < 0.7:
+                rows[key][rng.choice(("price", "volume"))] = rng.randint(1, 5)
+            else:
+                rows[key] = {"price": rng.randint(1, 5), "volume": rng.randint(1, 5)}
+        states.append(rows)
+    deltas = [main.diff_exchange_rows(old, new) for old, new in zip(states, states[1:])]
+    for start in range(0, 200, 7):
+        for end in range(start, 201, 11):
+            assert apply_delta(states[start], main.compose_exchange_deltas(deltas[start:end])) == states[end]
+
+
+def test_since_returns_deltas_or_full_table(fake_redis, monkeypatch):
+    import httpx
+
+    monkeypatch.setattr(main, "EXCHANGES_DELTA_RING_SIZE", 3)
+    upstream = [make_record("Binance", 85.0, 1e6), make_record("Kraken", 85.1, 5e5)]
+
+    async def publish(records):
+        await main.publish_exchange_views(records, "2025-03-23T12:00:00Z", 1742731320.0)
+        return await main.load_exchanges_version()
+
+    async def run():
+        versions = [await publish(upstream)]
+        # Добавление, изменение и удаление одной биржи в пределах одного диапазона
+        versions.append(await publish(upstream + [make_record("Gate", 84.9, 1e5)]))
+        versions.append(await publish(upstream + [make_record("Gate", 85.3, 1e5)]))
+        versions.append(await publish([upstream[0], make_record("Kraken", 86.0, 5e5)]))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = {since: (await client.get("/api/ltc-exchanges", params={"since": since})).json()
+                         for since in (versions[0], versions[1], versions[3], versions[3] + 1, -1)}
+            # Кольцо хранит 3 изменения: от первой версии цепочка еще полная
+            responses["raw"] = (await client.get("/api/ltc-exchanges",
+                                                 params={"since": versions[0], "raw": "true"})).json()
+            # Цепочка с пропуском: промежуточное изменение истекло
+            await main.redis_client.delete(main.exchanges_delta_key(versions[2]))
+            responses["broken"] = (await client.get("/api/ltc-exchanges", params={"since": versions[1]})).json()
+            # Новая версия вытесняет из кольца изменение от первой версии
+            versions.append(await publish(upstream))
+            responses["aged"] = (await client.get("/api/ltc-exchanges", params={"since": versions[3]})).json()
+            responses["aged_out"] = (await client.get("/api/ltc-exchanges", params={"since": versions[0]})).json()
+        return versions, responses
+
+    versions, responses = asyncio.run(run())
+
+    delta = responses[versions[0]]
+    assert delta['delta'] is True and delta['since'] == versions[0] and delta['version'] == versions[3]
+    assert delta['added'] == {} and delta['removed'] == []
+    assert set(delta['changed']) == {"Kraken"} and set(delta['changed']["Kraken"]) == {"price"}
+    assert responses["raw"]['changed'] == {"Kraken": {"price": 86.0}}
+
+    assert responses[versions[1]]['removed'] == ["Gate"]
+    assert responses[versions[3]] == {**responses[versions[3]], 'delta': True, 'added': {},
+                                      'removed': [], 'changed': {}}
+
+    # Версия впереди текущей, отрицательная, с разорванной цепочкой или выпавшая из кольца - таблица целиком
+    for key in (versions[3] + 1, -1, "broken", "aged_out"):
+        full = responses[key]
+        assert 'delta' not in full
+        assert full['version'] in (versions[3], versions[4])
+        assert [row['exchange'] for row in full['data']][:2] == ["Binance", "Kraken"]
+    assert responses["aged"]['delta'] is True and responses["aged"]['version'] == versions[4]
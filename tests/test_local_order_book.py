@@ -0,0 +1,165 @@
+"""
+Локальная книга ордеров на записанном потоке: снимок, последовательные изменения,
+пропуск в последовательности и пересинхронизация.
+"""
+import asyncio
+import json
+import random
+
+import numpy as np
+import pytest
+
+import main
+
+SNAPSHOT_ID = 1000
+
+
+def make_snapshot(levels: int = 300) -> tuple:
+    bids = np.array([[round(85.0 - 0.01 * (i + 1), 2), 1 + i % 7] for i in range(levels)], dtype=float)
+    asks = np.array([[round(85.0 + 0.01 * (i + 1), 2), 1 + i % 5] for i in range(levels)], dtype=float)
+    return bids, asks, SNAPSHOT_ID
+
+
+def make_events(count: int, seed: int = 7) -> list:
+    """
+    Изменения в формате depthUpdate Binance строками JSON, как в записанном файле.
+    Середина блуждает, поэтому границы ±2% сдвигаются и уровни пересекают их в обе стороны.
+    """
+    rng = random.Random(seed)
+    bids, asks, _ = make_snapshot()
+    bid_levels = dict(bids.tolist())
+    ask_levels = dict(asks.tolist())
+    center = 85.0
+    # Первое изменение перекрывает lastUpdateId снимка
+    first_id = SNAPSHOT_ID - 5
+    events = []
+    for i in range(count):
+        center = min(max(center + rng.gauss(0, 0.15), 80.0), 90.0)
+        b, a = [], []
+        # Уровни, которые оказались по другую сторону середины, снимаются
+        for price in [price for price in bid_levels if price >= center]:
+            del bid_levels[price]
+            b.append([f"{price:.2f}", "0.00"])
+        for price in [price for price in ask_levels if price <= center]:
+            del ask_levels[price]
+            a.append([f"{price:.2f}", "0.00"])
+        for _ in range(rng.randint(1, 20)):
+            offset = round(rng.uniform(0.01, 3.0), 2)
+            volume = 0.0 if rng.random() < 0.3 else round(rng.uniform(0.1, 50), 3)
+            if rng.random() < 0.5:
+                levels, changes, price = bid_levels, b, round(center - offset, 2)
+            else:
+                levels, changes, price = ask_levels, a, round(center + offset, 2)
+            if volume:
+                levels[price] = volume
+            else:
+                levels.pop(price, None)
+            changes.append([f"{price:.2f}", f"{volume:.3f}"])
+        last_id = SNAPSHOT_ID + 1 + i * 3
+        events.append(json.dumps({"e": "depthUpdate", "E": 1742731200000 + i * 100,
+                                  "U": first_id, "u": last_id, "b": b, "a": a}))
+        first_id = last_id + 1
+    return events
+
+
+def test_incremental_depth_matches_full_recompute(monkeypatch):
+    # Без периодического пересчета: проверяются только инкрементальные суммы
+    monkeypatch.setattr(main, "LOCAL_ORDER_BOOK_RECOMPUTE_EVERY", 10**9)
+    book = main.LocalOrderBook("binance")
+    book.load_snapshot(*make_snapshot())
+
+    async def replay():
+        max_error = 0.0
+        async for event in main.replay_depth_feed(make_events(2000)):
+            assert book.apply_diff(event)
+            plus, minus = book.snapshot().depth(book.percent)
+            assert book.plus_depth == pytest.approx(plus, rel=1e-9, abs=1e-6)
+            assert book.minus_depth == pytest.approx(minus, rel=1e-9, abs=1e-6)
+            max_error = max(max_error, abs(book.plus_depth - plus), abs(book.minus_depth - minus))
+        return max_error
+
+    assert asyncio.run(replay()) < 1e-6
+    assert book.synced
+    assert book.last_update_id == SNAPSHOT_ID + 1 + 1999 * 3
+    assert book.best_bid < book.best_ask
+
+
+def test_stale_events_are_skipped():
+    book = main.LocalOrderBook("binance")
+    book.load_snapshot(*make_snapshot())
+    assert not book.apply_diff({"U": SNAPSHOT_ID - 10, "u": SNAPSHOT_ID, "b": [["84.99", "0"]], "a": []})
+    assert book.bid_levels[84.99] == 1
+
+
+def test_gap_raises_and_task_resyncs():
+    events = make_events(20)
+    # Пропущено одно изменение: поток надо начинать заново со свежего снимка
+    gapped = events[:10] + events[11:]
+    feeds = [gapped, events]
+    snapshots = []
+
+    def open_feed():
+        return main.replay_depth_feed(feeds.pop(0) if feeds else [], delay=0.001)
+
+    async def fetch_snapshot():
+        snapshots.append(len(feeds))
+        return make_snapshot()
+
+    async def run():
+        book = main.LocalOrderBook("binance")
+        with pytest.raises(main.OrderBookGap):
+            await main.sync_local_order_book(book, open_feed(), fetch_snapshot)
+        assert not book.synced
+
+        feeds[:] = [gapped, events]
+        book = main.LocalOrderBook("binance")
+        task = asyncio.create_task(main.local_order_book_task(book, open_feed, fetch_snapshot))
+        # После пропуска задача сразу пересинхронизируется и доходит до конца второго потока
+        for _ in range(500):
+            await asyncio.sleep(0.005)
+            if not feeds and book.last_update_id == json.loads(events[-1])["u"]:
+                break
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return book
+
+    book = asyncio.run(run())
+    assert book.last_update_id == json.loads(events[-1])["u"]
+    plus, minus = book.snapshot().depth(book.percent)
+    assert book.plus_depth == pytest.approx(plus)
+    assert book.minus_depth == pytest.approx(minus)
+    # Снимок: первый поток без задачи, затем оба потока в задаче
+    assert len(snapshots) == 3
+
+
+def test_one_sided_book_recomputes_when_both_sides_exist(monkeypatch):
+    monkeypatch.setattr(main, "LOCAL_ORDER_BOOK_RECOMPUTE_EVERY", 10**9)
+    bids, asks, _ = make_snapshot(20)
+    book = main.LocalOrderBook("binance")
+    book.load_snapshot(bids, np.empty((0, 2)), SNAPSHOT_ID)
+    assert book.depth() == (0.0, 0.0)
+
+    update_id = SNAPSHOT_ID
+
+    def apply(b=(), a=()):
+        nonlocal update_id
+        update_id += 1
+        assert book.apply_diff({"U": update_id, "u": update_id, "b": list(b), "a": list(a)})
+        plus, minus = book.snapshot().depth(book.percent) if book.bid_prices and book.ask_prices else (0.0, 0.0)
+        assert book.plus_depth == pytest.approx(plus)
+        assert book.minus_depth == pytest.approx(minus)
+
+    # Без asks изменения bids не попадают в суммы полосы
+    apply(b=[["84.99", "100"], ["84.50", "3"], ["60.00", "1000"]])
+    assert book.depth() == (0.0, 0.0)
+    # Появилась вторая сторона - суммы пересчитываются и дальше ведутся инкрементально
+    apply(a=[["85.01", "2"], ["86.00", "5"]])
+    assert book.minus_depth > 84.99 * 100
+    apply(b=[["84.98", "7"]], a=[["85.02", "1"]])
+    # Сторона опустела и снова заполнилась
+    apply(a=[["85.01", "0"], ["85.02", "0"], ["86.00", "0"]])
+    assert book.depth() == (0.0, 0.0)
+    apply(b=[["84.97", "4"]])
+    apply(a=[["85.20", "9"]])
+    assert book.plus_depth == pytest.approx(85.20 * 9)
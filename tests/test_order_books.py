@@ -0,0 +1,117 @@
+"""
+Коннекторы книг ордеров на сохраненных ответах API бирж (tests/fixtures/order_books),
+глубина и стоимость исполнения OrderBook и /api/ltc-depth?exchanges= при сбое одной из бирж.
+"""
+import asyncio
+import json
+import os
+
+import httpx
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "order_books")
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("name", sorted(main.ORDER_BOOK_CONNECTORS))
+def test_connector_parses_recorded_response(name):
+    connector = main.ORDER_BOOK_CONNECTORS[name]
+    bids, asks = connector.parse(load_fixture(name))
+    book = main.OrderBook(name, bids, asks)
+
+    assert np.all(np.diff(book.bid_prices) < 0)
+    assert np.all(np.diff(book.ask_prices) > 0)
+    assert np.all(book.bid_volumes > 0) and np.all(book.ask_volumes > 0)
+    assert len(book.bid_prices) == len(book.ask_prices) == 6
+    assert book.best_bid == 84.99
+    assert book.best_ask == 85.01
+    assert book.mid_price == pytest.approx(85.0)
+    assert book.bid_volumes[0] == 12.5 and book.ask_volumes[0] == 8.4
+
+
+@pytest.mark.parametrize("parse, payload", [
+    (main.parse_okx_book, {"code": "51001", "msg": "Instrument ID does not exist", "data": []}),
+    (main.parse_bybit_book, {"retCode": 10001, "retMsg": "Not supported symbols", "result": {}}),
+    (main.parse_kraken_book, {"error": ["EQuery:Unknown asset pair"]}),
+    (main.parse_kucoin_book, {"code": "400100", "msg": "symbol not exists"}),
+    (main.parse_htx_book, {"status": "error", "err-msg": "invalid symbol"}),
+])
+def test_connector_rejects_error_response(parse, payload):
+    with pytest.raises(ValueError):
+        parse(payload)
+
+
+@pytest.fixture
+def book():
+    return main.OrderBook("test",
+                          np.array([[97, 3], [99, 1], [98, 2], [96, 0]], dtype=float),
+                          np.array([[104, 3], [101, 1], [102, 2], [103, 0]], dtype=float))
+
+
+def test_order_book_depth(book):
+    assert book.mid_price == 100
+    assert book.depth() == (101 + 102 * 2, 99 + 98 * 2)
+    plus, minus = book.depth_bands([1, 2, 5])
+    assert plus.tolist() == [101, 305, 617]
+    assert minus.tolist() == [99, 295, 586]
+
+
+def test_order_book_fill(book):
+    fill = book.fill(200, "buy")
+    assert fill["filledNotional"] == pytest.approx(200)
+    assert fill["volume"] == pytest.approx(1 + 99 / 102)
+    assert fill["averagePrice"] == pytest.approx(200 / (1 + 99 / 102))
+    assert fill["slippagePercent"] == pytest.approx((fill["averagePrice"] / 100 - 1) * 100)
+
+    fill = book.fill(50, "sell")
+    assert fill["volume"] == pytest.approx(50 / 99)
+    assert fill["averagePrice"] == pytest.approx(99)
+
+    # Книги не хватает: исполняется все, что есть
+    fill = book.fill(10_000, "buy")
+    assert fill["filledNotional"] == pytest.approx(617)
+    assert fill["volume"] == pytest.approx(6)
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    """
+    Подменяет пулы соединений: OKX отвечает дольше таймаута, Bybit - 500,
+    остальные биржи - сохраненными ответами
+    """
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host == "okx":
+            await asyncio.sleep(1)
+        if host == "bybit":
+            return httpx.Response(500, text="Internal Server Error")
+        return httpx.Response(200, json=load_fixture(host))
+
+    monkeypatch.setattr(main, "get_http_client", lambda upstream: httpx.AsyncClient(
+        base_url=f"http://{upstream}", transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(main, "ORDER_BOOK_TIMEOUT", 0.2)
+    monkeypatch.setattr(main, "order_book_cache", {})
+    monkeypatch.setattr(main, "live_order_books", {})
+
+
+def test_depth_batch_reports_failed_exchanges(upstreams):
+    response = TestClient(main.app).get("/api/ltc-depth", params={
+        "exchanges": "binance,okx,bybit,kraken,nosuch", "notional": 1000})
+    assert response.status_code == 200
+    body = response.json()
+
+    assert [item["exchange"] for item in body["data"]] == ["Binance", "Kraken"]
+    for item in body["data"]:
+        assert item["bestBid"] == 84.99 and item["bestAsk"] == 85.01
+        assert [fill["side"] for fill in item["fills"]] == ["buy", "sell"]
+    assert set(body["errors"]) == {"okx", "bybit", "nosuch"}
+    assert "Превышено время ожидания" in body["errors"]["okx"]
+    assert "500" in body["errors"]["bybit"]
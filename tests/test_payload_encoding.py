@@ -0,0 +1,125 @@
+"""
+Выбор сжатия по Accept-Encoding и ответы из записи кэша: ETag, 304 и Content-Encoding.
+"""
+import gzip
+import time
+
+import brotli
+import pytest
+from starlette.requests import Request
+
+import main
+
+
+def make_request(**headers) -> Request:
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'path': '/',
+        'headers': [(name.replace('_', '-').encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+@pytest.mark.parametrize("params, quality", [
+    ("", 1.0),
+    (";q=0.5", 0.5),
+    ("; Q = 0.25 ", 0.25),
+    (";q=x", 1.0),
+    (";q=", 1.0),
+    (";q=nan", 1.0),
+    (";q=inf", 1.0),
+    (";q=2", 1.0),
+    (";q=-1", 0.0),
+    (";level=1;q=0.3", 0.3),
+])
+def test_parse_quality(params, quality):
+    assert main.parse_quality(params) == quality
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    (None, None),
+    ("", None),
+    ("gzip", "gzip"),
+    ("br", "br"),
+    # Равные q - в порядке PAYLOAD_ENCODINGS
+    ("gzip, br", "br"),
+    ("gzip;q=0.8, br;q=0.8", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("GZIP;Q=1, Br;q=0.1", "gzip"),
+    # Некорректное q не ломает выбор и считается 1
+    ("br;q=x, gzip;q=0.9", "br"),
+    ("gzip;q=0.9, br;q=oops", "br"),
+    # * задает q для не перечисленных кодировок
+    ("*", "br"),
+    ("*;q=0.5, br;q=0.1", "gzip"),
+    ("*, br;q=0", "gzip"),
+    ("*;q=0", None),
+    ("br;q=0, gzip;q=0", None),
+    ("deflate", None),
+    # identity;q=0 только запрещает ответ без сжатия
+    ("identity;q=0, gzip", "gzip"),
+    ("identity;q=0, gzip;q=0.5", "gzip"),
+    # identity с большим q, чем у лучшего сжатия, - без сжатия
+    ("identity, gzip;q=0.5", None),
+    ("identity;q=0.5, gzip;q=0.5", "gzip"),
+    ("identity;q=1, br;q=0.9, gzip;q=0.8", None),
+])
+def test_choose_encoding(accept_encoding, encoding):
+    headers = {} if accept_encoding is None else {'accept_encoding': accept_encoding}
+    assert main.choose_encoding(make_request(**headers)) == encoding
+
+
+@pytest.fixture
+def payload():
+    now = time.time()
+    return main.encode_payload(b'{"status":"success"}', now + 60.5, now + 600)
+
+
+def test_payload_response_encodings(payload):
+    response = main.payload_response(payload, make_request(), None)
+    assert response.status_code == 200
+    assert response.body == b'{"status":"success"}'
+    assert response.headers['etag'] == f'"{payload["etag"]}"'
+    assert 'content-encoding' not in response.headers
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers['cache-control'] == "public, max-age=60, stale-while-revalidate=300"
+
+    response = main.payload_response(payload, make_request(), 'gzip')
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['etag'] == f'"{payload["etag"]}-gzip"'
+    assert gzip.decompress(response.body) == payload['body']
+
+    response = main.payload_response(payload, make_request(), 'br')
+    assert brotli.decompress(response.body) == payload['body']
+
+
+@pytest.mark.parametrize("if_none_match, encoding", [
+    ('"{etag}"', None),
+    ('"{etag}-gzip"', 'gzip'),
+    # ETag другой кодировки: содержимое то же
+    ('"{etag}-br"', 'gzip'),
+    ('W/"{etag}-gzip"', 'gzip'),
+    ('"other", "{etag}"', 'br'),
+    ('*', None),
+])
+def test_payload_response_not_modified(payload, if_none_match, encoding):
+    request = make_request(if_none_match=if_none_match.format(etag=payload['etag']))
+    response = main.payload_response(payload, request, encoding)
+    assert response.status_code == 304
+    assert response.body == b''
+    assert 'content-encoding' not in response.headers
+    assert response.headers['etag'] == (f'"{payload["etag"]}-{encoding}"' if encoding else f'"{payload["etag"]}"')
+
+
+@pytest.mark.parametrize("if_none_match", ['"other"', '"{etag}x"', ''])
+def test_payload_response_etag_mismatch(payload, if_none_match):
+    request = make_request(if_none_match=if_none_match.format(etag=payload['etag']))
+    assert main.payload_response(payload, request, None).status_code == 200
+
+
+def test_payload_response_from_redis_fields(payload):
+    # Из HMGET поля приходят байтами
+    stored = {name: value if isinstance(value, bytes) else str(value).encode() for name, value in payload.items()}
+    request = make_request(if_none_match=f'"{payload["etag"]}"')
+    assert main.payload_response(stored, request, None).status_code == 304
+    assert main.payload_response(stored, make_request(), 'gzip').body == payload['gzip']
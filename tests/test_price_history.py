@@ -0,0 +1,109 @@
+"""
+Цены закрытия истории цены и дневные свечи считают дни по UTC независимо от часового пояса сервера.
+"""
+import time
+
+import numpy as np
+import pytest
+
+import main
+
+DAY_MS = 86_400_000
+
+
+@pytest.fixture(params=["UTC", "America/New_York", "Asia/Tokyo"])
+def server_timezone(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_daily_close_matches_daily_candles(server_timezone):
+    # 10 дней по 5 минут, начиная с полуночи UTC
+    start = 1742688000000
+    timestamps = np.arange(start, start + 10 * DAY_MS, 300_000, dtype=np.int64)
+    prices = 80 + np.sin(np.arange(len(timestamps)) / 50)
+    points = list(zip(timestamps.tolist(), prices.tolist()))
+
+    closes = main.thin_price_history(points, 10, True)
+    candles = main.resample_ohlc(timestamps, prices, DAY_MS)
+    assert [price for _, price in closes] == candles['close'].tolist()
+    assert [ts // DAY_MS * DAY_MS for ts, _ in closes] == candles['timestamp'].tolist()
+
+    rendered = main.render_price_history(points, 10, True)
+    assert [item['date'] for item in rendered['data']] == [f"3/{day}" for day in range(23, 32)] + ["4/1"]
+
+
+def test_intraday_candles_have_range():
+    # Сутки точек по 5 минут, как их хранит PriceHistoryStore
+    start = 1742688000000
+    timestamps = np.arange(start, start + DAY_MS, 300_000, dtype=np.int64)
+    # Тренд с колебаниями внутри часа: экстремумы не совпадают с открытием и закрытием
+    index = np.arange(len(timestamps))
+    prices = 80 + index * 0.01 + np.where(index % 12 == 5, 0.5, 0) - np.where(index % 12 == 8, 0.5, 0)
+    points = list(zip(timestamps.tolist(), prices.tolist()))
+
+    candles = main.render_candles(points, main.CandleInterval.H1)['data']
+    assert len(candles) == 24
+    for candle in candles:
+        assert candle['high'] > max(candle['open'], candle['close'])
+        assert candle['low'] < min(candle['open'], candle['close'])
+
+
+def test_candle_intervals_span_several_points():
+    # Каждая свеча покрывает несколько точек хранилища и в пределах периода, где они есть
+    assert "5m" not in main.CANDLE_INTERVALS
+    for interval in main.CandleInterval:
+        seconds = main.CANDLE_INTERVALS[interval.value]
+        max_days = main.CANDLE_MAX_DAYS[interval.value]
+        step = 300 if max_days <= 1 else 3600
+        assert seconds >= 3 * step
+
+
+def lttb_series(n: int = 1000, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(n, dtype=np.int64) * 300_000 + 1742688000000
+    prices = 80 + rng.normal(0, 0.05, n).cumsum()
+    return timestamps, prices
+
+
+@pytest.mark.parametrize("threshold", [3, 4, 10, 500, 999])
+def test_lttb_keeps_edges_and_count(threshold):
+    timestamps, prices = lttb_series()
+    selected = main.lttb(timestamps, prices, threshold)
+    assert len(selected) == threshold
+    assert selected[0] == 0 and selected[-1] == len(prices) - 1
+    # Индексы по возрастанию без повторов
+    assert np.all(np.diff(selected) > 0)
+
+
+@pytest.mark.parametrize("index", [1, 337, 998])
+def test_lttb_keeps_spike(index):
+    timestamps, prices = lttb_series()
+    prices[index] += 50
+    assert index in main.lttb(timestamps, prices, 50).tolist()
+    prices[index] -= 100
+    assert index in main.lttb(timestamps, prices, 50).tolist()
+
+
+@pytest.mark.parametrize("threshold", [1000, 5000, 2, 1, 0, -1])
+def test_lttb_returns_all_points_when_not_thinning(threshold):
+    timestamps, prices = lttb_series()
+    assert main.lttb(timestamps, prices, threshold).tolist() == list(range(len(prices)))
+
+
+def test_lttb_small_series():
+    assert main.lttb(np.array([], dtype=np.int64), np.array([]), 10).tolist() == []
+    assert main.lttb(np.array([1]), np.array([5.0]), 3).tolist() == [0]
+    timestamps, prices = lttb_series(4)
+    assert main.lttb(timestamps, prices, 3).tolist()[::2] == [0, 3]
+
+
+def test_render_price_history_max_points():
+    timestamps, prices = lttb_series(2000)
+    points = list(zip(timestamps.tolist(), prices.tolist()))
+    result = main.render_price_history(points, 1, False, 100, True)
+    assert len(result['timestamps']) == 100
+    assert result['timestamps'][0] == timestamps[0] and result['timestamps'][-1] == timestamps[-1]
@@ -0,0 +1,33 @@
+"""
+Оракул цены: окно свежести, последняя цена при ошибках и предел ее устаревания.
+"""
+import asyncio
+
+import main
+
+
+def test_stale_price_is_not_served():
+    prices = [85.0, 0, 0, 0, 86.0]
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return prices.pop(0)
+
+    async def run():
+        oracle = main.PriceOracle(fetch, max_age=0.02, max_stale=0.1)
+        results = [await oracle.get_price(), await oracle.get_price()]
+        # Запрос не удался: пока цена не старше max_stale, отдается последняя известная
+        await asyncio.sleep(0.03)
+        results.append(await oracle.get_price())
+        # Ошибки продолжаются дольше max_stale: цены нет
+        await asyncio.sleep(0.1)
+        results.append(await oracle.get_price())
+        await asyncio.sleep(0.03)
+        results.append(await oracle.get_price())
+        await asyncio.sleep(0.03)
+        results.append(await oracle.get_price())
+        return results
+
+    assert asyncio.run(run()) == [85.0, 85.0, 85.0, 0, 0, 86.0]
+    assert len(calls) == 5
@@ -0,0 +1,123 @@
+"""
+Общий бюджет запросов к внешним API на fakeredis: резервы приоритетов,
+пауза по Retry-After и 503 с Retry-After для клиента.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture
+def upstream(fake_redis, monkeypatch):
+    """Хост с корзиной на 10 запросов; вызовы не ждут пополнения, а сразу получают отказ"""
+    def configure(capacity: int, period: float) -> str:
+        monkeypatch.setitem(main.UPSTREAMS, "test", {
+            "base_url": "http://test", "max_connections": 1, "max_keepalive_connections": 1,
+            "http2": False, "rate_limit": (capacity, period),
+        })
+        return "test"
+
+    monkeypatch.setattr(main, "RATE_LIMIT_MAX_WAIT", {0: 0.0, 1: 0.0, 2: 0.0})
+    return configure
+
+
+async def try_acquire(upstream: str, priority: int):
+    """None, если бюджет выдан, иначе UpstreamRateLimited"""
+    with main.upstream_call_priority(priority):
+        try:
+            await main.acquire_upstream_budget(upstream)
+        except main.UpstreamRateLimited as e:
+            return e
+    return None
+
+
+def test_lower_priorities_keep_out_of_reserve(upstream):
+    name = upstream(10, 3600)
+
+    async def run():
+        # Снапшот расходует корзину до 4 запросов: ниже резерва истории (5), но выше резерва иконок (3)
+        for _ in range(6):
+            assert await try_acquire(name, main.UPSTREAM_PRIORITY_SNAPSHOT) is None
+        history = await try_acquire(name, main.UPSTREAM_PRIORITY_HISTORY)
+        icons = [await try_acquire(name, main.UPSTREAM_PRIORITY_ICONS) for _ in range(2)]
+        snapshot = [await try_acquire(name, main.UPSTREAM_PRIORITY_SNAPSHOT) for _ in range(3)]
+        return history, icons, snapshot, await try_acquire(name, main.UPSTREAM_PRIORITY_SNAPSHOT)
+
+    history, icons, snapshot, exhausted = asyncio.run(run())
+    assert isinstance(history, main.UpstreamRateLimited)
+    # Истории нужно 6 запросов в корзине, а осталось 4: 2 запроса при пополнении 10 в час
+    assert history.retry_after == pytest.approx(720, rel=0.01)
+    assert icons[0] is None and isinstance(icons[1], main.UpstreamRateLimited)
+    # Резерв - только для менее важных вызовов: снапшот расходует корзину до дна
+    assert snapshot == [None] * 3
+    assert isinstance(exhausted, main.UpstreamRateLimited)
+    assert exhausted.status_code == 503
+
+
+def test_retry_after_blocks_every_priority(upstream, monkeypatch):
+    name = upstream(10, 1)
+    responses = []
+
+    async def handle(self, request):
+        responses.append(request.url.path)
+        return httpx.Response(429, headers={'Retry-After': "0.5"})
+
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request", handle)
+
+    async def run():
+        transport = main.TimedTransport(name)
+        async with httpx.AsyncClient(base_url="http://test", transport=transport) as client:
+            response = await client.get("/limited")
+            blocked = [await try_acquire(name, priority) for priority in main.UPSTREAM_PRIORITY_NAMES]
+            # Пока пауза не кончилась, запрос не уходит на хост
+            with pytest.raises(main.UpstreamRateLimited):
+                await client.get("/limited")
+            await asyncio.sleep(0.8)
+            resumed = await try_acquire(name, main.UPSTREAM_PRIORITY_SNAPSHOT)
+        return response, blocked, resumed
+
+    response, blocked, resumed = asyncio.run(run())
+    assert response.status_code == 429
+    assert responses == ["/limited"]
+    for error in blocked:
+        assert isinstance(error, main.UpstreamRateLimited)
+        assert 0.3 < error.retry_after <= 0.5
+    # После паузы корзина пополняется с нуля
+    assert resumed is None
+    assert main.estimated_budget(name) < 10
+
+
+def test_rate_limited_route_returns_503_with_retry_after(fake_redis, monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_MAX_WAIT", {0: 0.0, 1: 0.0, 2: 0.0})
+    monkeypatch.setattr(main, "http_clients", {})
+    monkeypatch.setattr(main, "order_book_cache", {})
+    monkeypatch.setattr(main, "live_order_books", {})
+
+    async def run():
+        await main.block_upstream("binance", 42)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/api/ltc-depth/binance")
+        for client in main.http_clients.values():
+            await client.aclose()
+        return response
+
+    response = asyncio.run(run())
+    assert response.status_code == 503, response.text
+    assert response.headers['retry-after'] == "42"
+    assert "binance" in response.json()['detail']
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("5", 5.0),
+    ("0.5", 0.5),
+    ("-3", 0.0),
+    (None, main.RATE_LIMIT_DEFAULT_RETRY_AFTER),
+    ("soon", main.RATE_LIMIT_DEFAULT_RETRY_AFTER),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0),
+])
+def test_parse_retry_after(value, seconds):
+    assert main.parse_retry_after(value) == seconds